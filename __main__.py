@@ -0,0 +1,6 @@
+import sys
+from benchmark import run_cli
+
+# python . [--quick] [--backend ...] runs the benchmarks, see benchmark.run_cli
+if __name__ == '__main__':
+        sys.exit(run_cli())
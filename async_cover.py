@@ -0,0 +1,455 @@
+import unittest
+import asyncio
+import collections
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import aclosing
+from lattice import SparseLattice
+from exact_cover import Checkpoint, iter_exact_cover_solutions
+from parallel_cover import split_search
+
+# The cancel flags of the jobs, one byte per job slot, shared with every worker process.
+# It is set once per process by _init_worker
+_worker_flags = None
+
+# The (job, lattice) a worker process searches for every job slot, kept from the first task
+# of the job it ran on, so the later tasks only carry their prefix and position
+_worker_lattices = {}
+
+def _init_worker(flags):
+    global _worker_flags
+    _worker_flags = flags
+
+class _Pause(Exception):
+    """ Stops a task when its time slice is over or its job was cancelled """
+
+class _SliceCheckpoint(Checkpoint):
+    """
+    A Checkpoint kept in memory that stops the search once its time slice is over or its
+    job is cancelled. The position it stops at is where the next task of the prefix
+    carries on from. It never stops at a solution that was yielded already, but at the
+    next node that is not one.
+    :ivar flags: the cancel flags of the jobs
+    :ivar slot: the index of the flag of the job the task works for
+    """
+    def __init__(self, position, time_slice, flags, slot, check_every=1024):
+        self.path = None
+        self.interval = time_slice
+        self.check_every = check_every
+        self.position = position
+        self.solutions = 0
+        self.emitted = False
+        self.done = False
+        self.shape = None
+        self.flags = flags
+        self.slot = slot
+        self._pending = False
+        self._nodes = 0
+        self._next_save = time.monotonic() + time_slice
+
+    def due(self):
+        self._nodes += 1
+        if self._pending:
+            return True
+        if self._nodes % self.check_every:
+            return False
+        return bool(self.flags[self.slot]) or time.monotonic() >= self._next_save
+
+    def save(self, position, emitted=False):
+        if emitted:
+            self._pending = True
+            return
+        self.position = position
+        if not self.done:
+            raise _Pause()
+
+def _run_task(lattice, prefix, position, count, slot, time_slice, flags=None):
+    """
+    Searches under prefix, starting from position, for about time_slice seconds. Returns
+    (solutions, position), the solutions being a count with count. position is None once
+    the prefix is done, else where to carry on from.
+    """
+    if flags is None:
+        flags = _worker_flags
+    checkpoint = _SliceCheckpoint(position, time_slice, flags, slot)
+    solutions = []
+    try:
+        for s in iter_exact_cover_solutions(lattice, prefix, checkpoint=checkpoint):
+            if not count:
+                solutions.append(s)
+    except _Pause:
+        return (checkpoint.solutions if count else solutions), checkpoint.position
+    return (checkpoint.solutions if count else solutions), None
+
+def _run_job_task(job, lattice, prefix, position, count, slot, time_slice):
+    """
+    Runs _run_task in a worker process on the lattice of the job. The lattice is only sent
+    when the worker does not hold it yet, and None is returned when it has to be.
+    """
+    if lattice is not None:
+        _worker_lattices[slot] = (job, lattice)
+    elif _worker_lattices.get(slot, (None, None))[0] != job:
+        return None
+    return _run_task(_worker_lattices[slot][1], prefix, position, count, slot, time_slice)
+
+# Put on the queue of a job after its last solution
+_DONE = object()
+
+def _remaining(loop, deadline):
+    if deadline is None:
+        return None
+    return max(0.0, deadline - loop.time())
+
+class SolverPool():
+    """
+    A pool of workers that many asyncio jobs share. Every job splits its search tree into
+    prefixes (see split_search) and searches every prefix in tasks of about time_slice
+    seconds. A task that runs out of time hands its position back and joins the end of the
+    line, and the workers go to the tasks first come first served, so a short query only
+    waits for the slices in front of it, never for a whole long enumeration.
+    :ivar max_workers: the number of workers, os.cpu_count() by default
+    :ivar use_threads: run the tasks on threads instead of processes. The search holds the
+        GIL, so threads only suit small problems
+    :ivar time_slice: the seconds a task runs for before it gives its worker back
+    :ivar max_jobs: the most jobs that run at once. The jobs after them wait for a place
+    :ivar tasks_run: the number of tasks handed to the workers so far
+    :ivar lattices_sent: the number of times the lattice of a job was sent to a worker process,
+        or copied for a worker thread. A worker keeps it for the later tasks of the job
+    """
+    def __init__(self, max_workers=None, use_threads=False, time_slice=0.5, max_jobs=64):
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        self.max_workers = max_workers
+        self.use_threads = use_threads
+        self.time_slice = time_slice
+        self.max_jobs = max_jobs
+        self.tasks_run = 0
+        self.lattices_sent = 0
+        self._jobs = 0
+        # The futures of every job that a worker may still be running, by job
+        self._inflight = {}
+        # The (job, copy of its lattice) of every job slot, on every worker thread
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        if use_threads:
+            self.flags = bytearray(max_jobs)
+            self.executor = ThreadPoolExecutor(max_workers)
+        else:
+            self.flags = multiprocessing.Array('b', max_jobs, lock=False)
+            self.executor = ProcessPoolExecutor(max_workers, initializer=_init_worker, initargs=(self.flags,))
+        self._free = list(range(max_jobs))
+        self._loop = None
+
+    def _semaphores(self):
+        # asyncio primitives belong to one event loop, so they are made again for a new one
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._turns = asyncio.Semaphore(self.max_workers)
+            self._places = asyncio.Semaphore(self.max_jobs)
+        return self._turns, self._places
+
+    async def _task(self, lattice, job, prefix, position, count, slot):
+        turns = self._semaphores()[0]
+        async with turns:
+            if self.flags[slot]:
+                return prefix, (0 if count else []), None
+            self.tasks_run += 1
+            if self.use_threads:
+                answer = await self._submit(job, self._thread_task, job, lattice, prefix, position, count, slot)
+            else:
+                answer = await self._submit(job, _run_job_task, job, None, prefix, position, count, slot, self.time_slice)
+                if answer is None:
+                    self.lattices_sent += 1
+                    answer = await self._submit(job, _run_job_task, job, lattice, prefix, position, count, slot,
+                                                self.time_slice)
+            result, position = answer
+        return prefix, result, position
+
+    def _submit(self, job, fn, *args):
+        # The future is kept until it is done, so the slot of the job is not handed to the
+        # next job while a worker can still be running for this one
+        future = self.executor.submit(fn, *args)
+        inflight = self._inflight[job]
+        inflight.add(future)
+        future.add_done_callback(inflight.discard)
+        return asyncio.wrap_future(future)
+
+    def _thread_task(self, job, lattice, prefix, position, count, slot):
+        # Every thread searches a copy of its own, made on the first task of the job it runs
+        copies = self._local.__dict__
+        if copies.get(slot, (None, None))[0] != job:
+            copies[slot] = (job, lattice.clone())
+            with self._lock:
+                self.lattices_sent += 1
+        return _run_task(copies[slot][1], prefix, position, count, slot, self.time_slice, self.flags)
+
+    async def _produce(self, lattice, job, prefixes, count, slot, parallel, queue):
+        loop = asyncio.get_running_loop()
+        todo = collections.deque((p, []) for p in prefixes)
+        running = set()
+        try:
+            while todo or running:
+                while todo and len(running) < parallel:
+                    prefix, position = todo.popleft()
+                    running.add(loop.create_task(self._task(lattice, job, prefix, position, count, slot)))
+                done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for t in done:
+                    prefix, result, position = t.result()
+                    if position is not None:
+                        todo.append((prefix, position))
+                    # Waiting for room on the queue holds back the next tasks of the job
+                    if count:
+                        await queue.put(result)
+                    else:
+                        for s in result:
+                            await queue.put(s)
+            await queue.put(_DONE)
+        except Exception as e:
+            await queue.put(e)
+        finally:
+            for t in running:
+                t.cancel()
+
+    async def _stream(self, lattice, count, queue_size, timeout, depth, parallel):
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        if isinstance(lattice, SparseLattice):
+            lattice = lattice.clone()
+        else:
+            lattice = SparseLattice.from_lattice(lattice)
+        if lattice.need is not None:
+            raise ValueError("Jobs are not supported for columns with multiplicities")
+        if parallel is None:
+            parallel = self.max_workers
+        places = self._semaphores()[1]
+        await asyncio.wait_for(places.acquire(), _remaining(loop, deadline))
+        slot = self._free.pop()
+        self.flags[slot] = 0
+        self._jobs += 1
+        job = self._jobs
+        self._inflight[job] = set()
+        producer = None
+        try:
+            prefixes = await asyncio.wait_for(loop.run_in_executor(None, split_search, lattice, 4 * parallel, depth),
+                                              _remaining(loop, deadline))
+            queue = asyncio.Queue(queue_size)
+            producer = loop.create_task(self._produce(lattice, job, prefixes, count, slot, parallel, queue))
+            while True:
+                item = await asyncio.wait_for(queue.get(), _remaining(loop, deadline))
+                if item is _DONE:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # The flag stops the running tasks of the job at their next look at the clock
+            self.flags[slot] = 1
+            if producer is not None:
+                producer.cancel()
+                await asyncio.gather(producer, return_exceptions=True)
+            # The tasks of the job still running stop at their next look at the flag
+            inflight = list(self._inflight.pop(job))
+            if inflight:
+                await asyncio.wait([asyncio.wrap_future(f) for f in inflight])
+            self._free.append(slot)
+            places.release()
+
+    def solve(self, lattice, queue_size=64, timeout=None, depth=None, parallel=None):
+        """
+        Returns an async iterator over the solutions (tuples of row ids), in no particular
+        order. At most queue_size solutions wait for the caller, after that the job stops
+        taking workers until there is room. Closing the iterator (see contextlib.aclosing)
+        or cancelling the task that reads it cancels the job.
+        :ivar lattice: The SparseLattice (or Lattice) to solve. The job works on a copy
+        :ivar queue_size: the most solutions to keep waiting for the caller
+        :ivar timeout: the most seconds the job may take, after that asyncio.TimeoutError is raised
+        :ivar depth: the number of levels to split the search on, see split_search
+        :ivar parallel: the most workers the job uses at once, max_workers by default
+        """
+        return self._stream(lattice, False, queue_size, timeout, depth, parallel)
+
+    async def count(self, lattice, timeout=None, depth=None, parallel=None):
+        """ Counts the solutions, see solve """
+        total = 0
+        async with aclosing(self._stream(lattice, True, 1, timeout, depth, parallel)) as counts:
+            async for n in counts:
+                total += n
+        return total
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+_default_pool = None
+
+def default_pool():
+    """ The process pool solve_async and count_async use when they are not given one """
+    global _default_pool
+    if _default_pool is None:
+        _default_pool = SolverPool()
+    return _default_pool
+
+def solve_async(lattice, pool=None, **kwargs):
+    """ async for solution in solve_async(lattice): see SolverPool.solve """
+    if pool is None:
+        pool = default_pool()
+    return pool.solve(lattice, **kwargs)
+
+async def count_async(lattice, pool=None, **kwargs):
+    """ Counts the solutions on a pool without blocking the event loop, see SolverPool.count """
+    if pool is None:
+        pool = default_pool()
+    return await pool.count(lattice, **kwargs)
+
+class AsyncCover_UnitTest(unittest.TestCase):
+    @staticmethod
+    def _domino_rows(rows, cols):
+        # The test fixture lives with the tests of bitset_cover
+        from bitset_cover import _domino_rows
+        return _domino_rows(rows, cols)
+
+    def setUp(self):
+        self.pool = SolverPool(max_workers=2, use_threads=True, time_slice=0.02)
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def test_solve(self):
+        lattice = SparseLattice(self._domino_rows(4, 4), list(range(16)))
+        async def run():
+            return [s async for s in self.pool.solve(lattice, queue_size=4)]
+        solutions = asyncio.run(run())
+        self.assertEqual(sorted(iter_exact_cover_solutions(lattice)), sorted(solutions))
+        self.assertEqual(36, asyncio.run(self.pool.count(lattice)))
+
+    def test_time_slices(self):
+        # Slices of a few nodes make most tasks carry on from a saved position
+        lattice = SparseLattice(self._domino_rows(6, 6), list(range(36)))
+        pool = SolverPool(max_workers=2, use_threads=True, time_slice=0)
+        try:
+            self.assertEqual(6728, asyncio.run(pool.count(lattice, depth=1)))
+            self.assertGreater(pool.tasks_run, 10)
+        finally:
+            pool.shutdown()
+
+    def test_backpressure(self):
+        lattice = SparseLattice(self._domino_rows(6, 6), list(range(36)))
+        pool = SolverPool(max_workers=2, use_threads=True, time_slice=10)
+        async def run():
+            async with aclosing(pool.solve(lattice, queue_size=1, parallel=1)) as solutions:
+                async for s in solutions:
+                    await asyncio.sleep(0.2)
+                    return pool.tasks_run
+        try:
+            self.assertEqual(1, asyncio.run(run()))
+        finally:
+            pool.shutdown()
+
+    def test_cancel(self):
+        lattice = SparseLattice(self._domino_rows(4, 4), list(range(16)))
+        links = lattice.snapshot()
+        async def run():
+            async with aclosing(self.pool.solve(lattice)) as solutions:
+                async for s in solutions:
+                    break
+            return await self.pool.count(lattice)
+        self.assertEqual(36, asyncio.run(run()))
+        self.assertEqual(links, lattice.snapshot())
+        self.assertEqual(self.pool.max_jobs, len(self.pool._free))
+
+    def test_timeout_and_fairness(self):
+        # 12988816 tilings, far too many to count here
+        big = SparseLattice(self._domino_rows(8, 8), list(range(64)))
+        small = SparseLattice(self._domino_rows(4, 4), list(range(16)))
+        pool = SolverPool(max_workers=1, use_threads=True, time_slice=0.02)
+        async def run():
+            with self.assertRaises(asyncio.TimeoutError):
+                await pool.count(big, timeout=0.2)
+            long = asyncio.ensure_future(pool.count(big))
+            await asyncio.sleep(0.1)
+            start = time.monotonic()
+            self.assertEqual(36, await pool.count(small))
+            waited = time.monotonic() - start
+            self.assertFalse(long.done())
+            long.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await long
+            return waited
+        try:
+            self.assertLess(asyncio.run(run()), 2.0)
+            self.assertEqual(pool.max_jobs, len(pool._free))
+        finally:
+            pool.shutdown()
+
+    def test_processes(self):
+        lattice = SparseLattice(self._domino_rows(4, 4), list(range(16)))
+        with SolverPool(max_workers=2, time_slice=0.01) as pool:
+            async def run():
+                solutions = [s async for s in solve_async(lattice, pool=pool)]
+                return solutions, await count_async(lattice, pool=pool)
+            solutions, count = asyncio.run(run())
+        self.assertEqual(sorted(iter_exact_cover_solutions(lattice)), sorted(solutions))
+        self.assertEqual(36, count)
+
+    def test_cancel_frees_workers(self):
+        # The slot of a cancelled job goes to the next job only once its tasks stopped, so
+        # the next job does not clear their cancel flag and wait out a long slice
+        big = SparseLattice(self._domino_rows(8, 8), list(range(64)))
+        small = SparseLattice(self._domino_rows(4, 4), list(range(16)))
+        pool = SolverPool(max_workers=1, use_threads=True, time_slice=30)
+        async def run():
+            long = asyncio.ensure_future(pool.count(big))
+            await asyncio.sleep(0.1)
+            long.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await long
+            self.assertEqual({}, pool._inflight)
+            start = time.monotonic()
+            self.assertEqual(36, await pool.count(small))
+            return time.monotonic() - start
+        try:
+            self.assertLess(asyncio.run(run()), 5.0)
+        finally:
+            pool.shutdown()
+
+    def test_threads_copy_once(self):
+        lattice = SparseLattice(self._domino_rows(6, 6), list(range(36)))
+        pool = SolverPool(max_workers=2, use_threads=True, time_slice=0)
+        try:
+            self.assertEqual(6728, asyncio.run(pool.count(lattice, depth=1)))
+            self.assertGreater(pool.tasks_run, 10)
+            self.assertLessEqual(pool.lattices_sent, 2)
+        finally:
+            pool.shutdown()
+
+    def test_processes_keep_lattice(self):
+        # The lattice goes to a worker about once per job, however many slices the job takes.
+        # Two tasks of the job can find the same worker without it at first
+        lattice = SparseLattice(self._domino_rows(6, 6), list(range(36)))
+        with SolverPool(max_workers=2, time_slice=0) as pool:
+            self.assertEqual(6728, asyncio.run(pool.count(lattice, depth=1)))
+            self.assertGreater(pool.tasks_run, 10)
+            self.assertLessEqual(pool.lattices_sent, 2 * pool.max_workers)
+            sent = pool.lattices_sent
+            self.assertEqual(36, asyncio.run(pool.count(SparseLattice(self._domino_rows(4, 4), list(range(16))))))
+            self.assertGreater(pool.lattices_sent, sent)
+
+    def test_multiplicity(self):
+        lattice = SparseLattice([[0], [0]], ['a'], multiplicity=[2])
+        with self.assertRaises(ValueError):
+            asyncio.run(self.pool.count(lattice))
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+        main()
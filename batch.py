@@ -0,0 +1,205 @@
+import unittest
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from lattice import SparseLattice
+from exact_cover import iter_exact_cover_solutions, count_exact_cover_solutions
+from pentomino import board_mask, board_cells, decode_placements, generate_all_placements, generate_col_names, generate_placements, get_base_shapes, get_polyomino_shapes, _cell_columns
+
+class BoardTable():
+    """
+    The placements of every shape of a batch on one board, generated once and shared by all
+    the problems on that board. A problem keeps the rows of its own pieces and leaves the
+    shape columns of the other pieces secondary, so every problem has the same columns.
+    :ivar mask: the board mask
+    :ivar placements: the sparse rows of every shape, the shape column first
+    :ivar shape_rows: the indices into placements of the rows of every shape, by shape index
+    :ivar col_names: the column names, see generate_col_names
+    :ivar num_shapes: the number of shape columns
+    """
+    def __init__(self, mask, shapes, orientations, num_shapes):
+        self.mask = mask
+        self.num_shapes = num_shapes
+        self.col_names = generate_col_names(shapes, mask, num_shapes)
+        self.placements = []
+        self.shape_rows = {}
+        cell_columns = _cell_columns(mask, num_shapes)
+        for s in shapes:
+            start = len(self.placements)
+            for o in orientations[s.index]:
+                self.placements.extend(generate_placements(o, s.index, num_shapes, mask, cell_columns))
+            self.shape_rows[s.index] = list(range(start, len(self.placements)))
+
+    def lattice(self, pieces):
+        """ Returns (lattice, row_ids): the lattice of the problem with the given shape indices
+        and the index into placements of every one of its rows """
+        row_ids = [i for p in pieces for i in self.shape_rows[p]]
+        secondary = sorted(set(range(self.num_shapes)) - set(pieces))
+        return SparseLattice([self.placements[i] for i in row_ids], self.col_names, secondary), row_ids
+
+class BatchResult():
+    """
+    The result of one problem of a batch.
+    :ivar board: the board as it was given
+    :ivar pieces: the names of the pieces as they were given
+    :ivar count: the number of solutions, at most limit
+    :ivar solutions: the solutions as boards holding the shape index of every cell (-1 where
+        blocked), or None when only the count was asked for
+    """
+    def __init__(self, board, pieces, count, solutions):
+        self.board = board
+        self.pieces = pieces
+        self.count = count
+        self.solutions = solutions
+
+# The board tables of the batch, by board key. It is set once per process by _init_worker
+_worker_tables = None
+
+def _init_worker(tables):
+    global _worker_tables
+    _worker_tables = tables
+
+def _solve_problem(key, pieces, solutions, limit):
+    table = _worker_tables[key]
+    lattice, row_ids = table.lattice(pieces)
+    if not solutions:
+        return count_exact_cover_solutions(lattice, limit=limit), None
+    boards = []
+    for s in itertools.islice(iter_exact_cover_solutions(lattice), limit):
+        boards.append(decode_placements(table.placements, [row_ids[r] for r in s], table.num_shapes, table.mask))
+    return len(boards), boards
+
+def _board_key(board):
+    return tuple(tuple(r) for r in board_mask(board))
+
+def solve_batch(problems, shapes=None, solutions=False, limit=None, max_workers=None, chunksize=8):
+    """
+    Solves many (board, pieces) problems in one call. The orientations of every shape are
+    generated once for the whole batch and the placements once per distinct board, and the
+    workers of the process pool receive them once, when they start. Returns a BatchResult
+    per problem, in the order of problems.
+    :ivar problems: a list of (board, pieces), the board as (rows, cols) or as a mask and the
+        pieces as a list of shape names, every piece used exactly once
+    :ivar shapes: the shapes the pieces are named from, get_base_shapes() by default
+    :ivar solutions: also return the solutions as boards, not only their number
+    :ivar limit: stop every problem after this many solutions
+    :ivar max_workers: the number of processes, os.cpu_count() by default. With 1 the batch
+        is solved in this process
+    :ivar chunksize: the number of problems handed to a worker at a time
+    """
+    if shapes is None:
+        shapes = get_base_shapes()
+    by_name = {}
+    for s in shapes:
+        by_name[s.name] = s
+    num_shapes = max(s.index for s in shapes) + 1
+    sizes = {}
+    orientations = {}
+    for s in shapes:
+        orientations[s.index] = s.generate_orientations()
+        sizes[s.index] = sum(sum(r) for r in s.shape)
+
+    tables = {}
+    tasks = []
+    results = [None] * len(problems)
+    for i in range(len(problems)):
+        board, pieces = problems[i]
+        for p in pieces:
+            if p not in by_name:
+                raise ValueError("Unknown piece %r" % (p,))
+        indices = [by_name[p].index for p in pieces]
+        if len(set(indices)) != len(indices):
+            raise ValueError("Piece set %r names a piece more than once" % (pieces,))
+        # The pieces have to fill the board exactly, which rules most sub-boards out at once
+        if sum(sizes[p] for p in indices) != len(board_cells(board)):
+            results[i] = BatchResult(board, pieces, 0, [] if solutions else None)
+            continue
+        key = _board_key(board)
+        if key not in tables:
+            tables[key] = BoardTable([list(r) for r in key], shapes, orientations, num_shapes)
+        tasks.append((i, key, indices))
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    if max_workers == 1 or len(tasks) <= 1:
+        _init_worker(tables)
+        answers = [_solve_problem(key, indices, solutions, limit) for i, key, indices in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers, initializer=_init_worker, initargs=(tables,)) as executor:
+            answers = list(executor.map(_solve_problem, [t[1] for t in tasks], [t[2] for t in tasks],
+                                        itertools.repeat(solutions), itertools.repeat(limit), chunksize=chunksize))
+    for k in range(len(tasks)):
+        i = tasks[k][0]
+        count, boards = answers[k]
+        results[i] = BatchResult(problems[i][0], problems[i][1], count, boards)
+    return results
+
+def _reference_count(board, pieces, shapes):
+    # Builds the problem the way a single instance is built, with only its own shapes
+    num_shapes = max(s.index for s in shapes) + 1
+    chosen = [s for s in shapes if s.name in pieces]
+    lattice = SparseLattice(generate_all_placements(chosen, board_shape=board, num_shapes=num_shapes),
+                            generate_col_names(chosen, board, num_shapes),
+                            secondary=[i for i in range(num_shapes) if i not in [s.index for s in chosen]])
+    return count_exact_cover_solutions(lattice)
+
+class Batch_UnitTest(unittest.TestCase):
+    def test_subsets(self):
+        shapes = get_base_shapes()
+        names = [s.name for s in shapes]
+        problems = [((3, 5), list(p)) for p in itertools.combinations(names, 3)]
+        results = solve_batch(problems, max_workers=1)
+        self.assertEqual(220, len(results))
+        for r in results:
+            self.assertEqual(_reference_count(r.board, r.pieces, shapes), r.count)
+        self.assertGreater(sum(r.count for r in results), 0)
+
+    def test_solutions(self):
+        problems = [((3, 5), ['I', 'L', 'Y']), ((2, 5), ['I', 'L']), ((3, 20), [s.name for s in get_base_shapes()])]
+        results = solve_batch(problems, solutions=True, max_workers=1)
+        self.assertEqual(8, results[2].count)
+        for r in results:
+            self.assertEqual(r.count, len(r.solutions))
+            indices = sorted(s.index for s in get_base_shapes() if s.name in r.pieces)
+            for board in r.solutions:
+                self.assertEqual(indices, sorted(set(c for row in board for c in row)))
+        self.assertEqual(3, solve_batch(problems[2:], solutions=True, limit=3, max_workers=1)[0].count)
+
+    def test_masks(self):
+        # A 3x4 board without two corners on the left, with every pair of pentominoes
+        mask = [[0, 1, 1, 1], [1, 1, 1, 1], [0, 1, 1, 1]]
+        shapes = get_polyomino_shapes(5, None)
+        problems = [(mask, list(p)) for p in itertools.combinations([s.name for s in shapes], 2)]
+        results = solve_batch(problems, shapes=shapes, max_workers=1)
+        counts = [_reference_count(mask, r.pieces, shapes) for r in results]
+        self.assertEqual(counts, [r.count for r in results])
+        self.assertGreater(sum(counts), 0)
+        self.assertEqual(0, solve_batch([(mask, ['I'])], max_workers=1)[0].count)
+
+    def test_tetrominoes(self):
+        # Five shape columns instead of twelve, on a 3x3 board without a corner
+        mask = [[1, 1, 1], [1, 1, 1], [1, 1, 0]]
+        shapes = get_polyomino_shapes(4, None)
+        problems = [(mask, list(p)) for p in itertools.combinations([s.name for s in shapes], 2)]
+        results = solve_batch(problems, shapes=shapes, max_workers=1)
+        self.assertEqual([_reference_count(mask, r.pieces, shapes) for r in results], [r.count for r in results])
+        self.assertEqual(4, sum(r.count for r in results))
+
+    def test_bad_pieces(self):
+        with self.assertRaises(ValueError):
+            solve_batch([((2, 5), ['I', 'Q'])])
+        with self.assertRaises(ValueError):
+            solve_batch([((2, 5), ['I', 'I'])])
+
+    def test_processes(self):
+        names = [s.name for s in get_base_shapes()]
+        problems = [((3, 5), list(p)) for p in itertools.combinations(names, 3)][:40]
+        serial = solve_batch(problems, solutions=True, max_workers=1)
+        parallel = solve_batch(problems, solutions=True, max_workers=2)
+        self.assertEqual([(r.count, r.solutions) for r in serial], [(r.count, r.solutions) for r in parallel])
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+        main()
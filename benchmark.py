@@ -0,0 +1,286 @@
+import unittest
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from exact_cover import BACKENDS, SearchStats, build_cover, count_cover_solutions, count_exact_cover_solutions
+from pentomino import get_base_shapes, generate_all_placements, generate_col_names, board_with_holes, scan_order, region_filter, region_pruner, BoardSymmetry
+from preprocess import reduce_matrix
+
+class Instance():
+    """
+    One problem of the benchmark corpus.
+    :ivar name: the name the results are reported under
+    :ivar build: a function returning (rows, col_names, order, secondary) for the problem
+    :ivar expected: the number of solutions, if it is known
+    :ivar quick: whether the instance is part of the quick corpus
+    :ivar pruner: a function that returns the prune hook for a built SparseLattice, used by the dlx backend
+    """
+    def __init__(self, name, build, expected=None, quick=True, pruner=None):
+        self.name = name
+        self.build = build
+        self.expected = expected
+        self.quick = quick
+        self.pruner = pruner
+
+def pentomino_problem(board_shape, reduce=False):
+    """ The pentomino matrix of a board with symmetry breaking, as (rows, col_names, order, secondary).
+    With reduce it goes through reduce_matrix and region_filter first """
+    shapes = get_base_shapes()
+    placements = generate_all_placements(shapes, BoardSymmetry(board_shape), board_shape)
+    col_names = generate_col_names(shapes, board_shape)
+    order = scan_order(board_shape)
+    if not reduce:
+        return placements, col_names, order, ()
+    reduction = reduce_matrix(placements, len(col_names), row_filter=region_filter(board_shape))
+    index = {}
+    for i in range(len(reduction.cols)):
+        index[reduction.cols[i]] = i
+    return reduction.rows, [col_names[c] for c in reduction.cols], [index[c] for c in order if c in index], ()
+
+def n_queens_problem(n):
+    """
+    N-queens as exact cover: a primary column per rank and file, which must be covered, and
+    a secondary column per diagonal, which may be.
+    """
+    col_names = ['R%d' % i for i in range(n)] + ['F%d' % i for i in range(n)]
+    col_names += ['A%d' % i for i in range(2 * n - 1)] + ['B%d' % i for i in range(2 * n - 1)]
+    rows = []
+    for r in range(n):
+        for c in range(n):
+            rows.append([r, n + c, 2 * n + r + c, 5 * n - 2 + r - c])
+    return rows, col_names, None, range(2 * n, 6 * n - 2)
+
+def random_problem(num_cols, num_rows, row_size, seed):
+    """
+    A random sparse exact cover problem with at least one solution: the columns are split
+    into rows that cover them exactly once, then random rows of row_size columns are added.
+    """
+    rng = random.Random(seed)
+    cols = list(range(num_cols))
+    rng.shuffle(cols)
+    rows = []
+    for i in range(0, num_cols, row_size):
+        rows.append(sorted(cols[i:i + row_size]))
+    while len(rows) < num_rows:
+        rows.append(sorted(rng.sample(range(num_cols), row_size)))
+    rng.shuffle(rows)
+    return rows, list(range(num_cols)), None, ()
+
+def small_problem(matrix):
+    """ A dense 0/1 matrix of the exact_cover tests as (rows, col_names, order, secondary) """
+    rows = [[c for c in range(len(r)) if r[c] == '1'] for r in matrix]
+    return rows, [chr(ord('a') + c) for c in range(len(matrix[0]))], None, ()
+
+CORPUS = [
+    Instance('exact_cover_simple', lambda: small_problem([['0', '1', '1'], ['1', '0', '0'], ['1', '0', '1'], ['0', '1', '0']]), 2),
+    Instance('exact_cover_none', lambda: small_problem([['0', '1', '1', '0'], ['1', '0', '0', '0'], ['1', '0', '1', '0'], ['0', '1', '0', '0']]), 0),
+    Instance('queens_8', lambda: n_queens_problem(8), 92),
+    Instance('queens_10', lambda: n_queens_problem(10), 724),
+    Instance('random_60x200', lambda: random_problem(60, 200, 5, 1)),
+    Instance('random_120x400', lambda: random_problem(120, 400, 6, 2), quick=False),
+    Instance('pentomino_3x20', lambda: pentomino_problem((3, 20)), 2),
+    Instance('pentomino_3x20_reduced', lambda: pentomino_problem((3, 20), True), 2),
+    Instance('pentomino_8x8_hole', lambda: pentomino_problem(board_with_holes((8, 8), [(3, 3), (3, 4), (4, 3), (4, 4)])), 65, quick=False),
+    Instance('pentomino_3x20_pruned', lambda: pentomino_problem((3, 20)), 2, pruner=lambda l: region_pruner(l, (3, 20))),
+    Instance('pentomino_4x15', lambda: pentomino_problem((4, 15)), 368, quick=False),
+    Instance('pentomino_4x15_pruned', lambda: pentomino_problem((4, 15)), 368, quick=False, pruner=lambda l: region_pruner(l, (4, 15))),
+    Instance('pentomino_5x12', lambda: pentomino_problem((5, 12)), 1010, quick=False),
+    Instance('pentomino_6x10', lambda: pentomino_problem((6, 10)), 2339, quick=False),
+    Instance('pentomino_6x10_reduced', lambda: pentomino_problem((6, 10), True), 2339, quick=False),
+]
+
+def run_instance(instance, backend='dlx'):
+    """
+    Times the matrix generation, the construction of the backend structure and the search
+    of one instance and returns the measurements as a dict.
+    The peak memory is the one of generating and building: tracing the allocations of the
+    search would slow it down several times over.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    rows, col_names, order, secondary = instance.build()
+    generated = time.perf_counter()
+    cover = build_cover(rows, col_names, backend, order, secondary)
+    built = time.perf_counter()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    built_untraced = time.perf_counter()
+    stats = SearchStats()
+    if instance.pruner is not None and backend == 'dlx':
+        count = count_exact_cover_solutions(cover, stats=stats, prune=instance.pruner(cover))
+    else:
+        count = count_cover_solutions(cover, stats=stats)
+    searched = time.perf_counter()
+    return {
+        'name': instance.name,
+        'backend': backend,
+        'rows': len(rows),
+        'cols': len(col_names),
+        'ones': sum(len(r) for r in rows),
+        'solutions': count,
+        'expected': instance.expected,
+        'generate_seconds': generated - start,
+        'build_seconds': built - generated,
+        'search_seconds': searched - built_untraced,
+        'wall_seconds': searched - start,
+        'nodes': stats.nodes,
+        'updates': stats.updates,
+        'covers': stats.covers,
+        'pruned': stats.pruned,
+        'level_nodes': stats.level_nodes,
+        'peak_bytes': peak,
+    }
+
+def _git_commit():
+    try:
+        out = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+    except OSError:
+        return None
+    return out.stdout.strip() or None
+
+def run_benchmarks(instances=CORPUS, backends=('dlx',), progress=None):
+    """ Runs every instance on every backend and returns the report that save_report writes """
+    results = []
+    for instance in instances:
+        for backend in backends:
+            result = run_instance(instance, backend)
+            if progress is not None:
+                progress(result)
+            results.append(result)
+    return {
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results,
+    }
+
+def save_report(report, path):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+def load_report(path):
+    with open(path) as f:
+        return json.load(f)
+
+def compare_reports(baseline, current, tolerance=0.2):
+    """
+    Returns a line for every instance whose solution count changed or whose search took
+    more than tolerance longer than in the baseline.
+    """
+    before = {}
+    for r in baseline['results']:
+        before[(r['name'], r['backend'])] = r
+    regressions = []
+    for r in current['results']:
+        old = before.get((r['name'], r['backend']))
+        if old is None:
+            continue
+        if old['solutions'] != r['solutions']:
+            regressions.append('%s/%s: %d solutions, was %d' % (r['name'], r['backend'], r['solutions'], old['solutions']))
+        elif r['search_seconds'] > old['search_seconds'] * (1 + tolerance) and r['search_seconds'] - old['search_seconds'] > 0.01:
+            regressions.append('%s/%s: search took %.3fs, was %.3fs' % (r['name'], r['backend'], r['search_seconds'], old['search_seconds']))
+    return regressions
+
+def _print_result(result):
+    print('%-22s %-7s %8d sol %10d nodes %12d upd %9.3fs gen %9.3fs build %9.3fs search %8.1f MB' % (
+        result['name'], result['backend'], result['solutions'], result['nodes'], result['updates'],
+        result['generate_seconds'], result['build_seconds'], result['search_seconds'], result['peak_bytes'] / 1e6))
+    sys.stdout.flush()
+
+def run_cli(argv=None):
+    """ The command line of the benchmarks, run with python . (see __main__.py). Returns the exit status """
+    parser = argparse.ArgumentParser(prog='benchmark', description='Benchmarks the exact cover solvers on a fixed corpus')
+    parser.add_argument('--quick', action='store_true', help='only run the instances that take seconds')
+    parser.add_argument('--backend', action='append', choices=BACKENDS, help='backend to run, can be repeated (default dlx)')
+    parser.add_argument('--only', action='append', help='only run the instances with this name, can be repeated')
+    parser.add_argument('--output', help='write the report as JSON to this file')
+    parser.add_argument('--compare', help='a previous report to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown of the search against --compare')
+    args = parser.parse_args(argv)
+
+    instances = [i for i in CORPUS if (not args.quick or i.quick) and (not args.only or i.name in args.only)]
+    report = run_benchmarks(instances, args.backend or ['dlx'], _print_result)
+    if args.output:
+        save_report(report, args.output)
+    failed = [r for r in report['results'] if r['expected'] is not None and r['solutions'] != r['expected']]
+    for r in failed:
+        print('%s/%s: expected %d solutions, found %d' % (r['name'], r['backend'], r['expected'], r['solutions']))
+    regressions = []
+    if args.compare:
+        regressions = compare_reports(load_report(args.compare), report, args.tolerance)
+        for line in regressions:
+            print('REGRESSION ' + line)
+    return 1 if failed or regressions else 0
+
+class Benchmark_UnitTest(unittest.TestCase):
+    def test_n_queens(self):
+        for n, expected in [(4, 2), (5, 10), (6, 4)]:
+            rows, col_names, order, secondary = n_queens_problem(n)
+            for backend in ['dlx', 'bitset']:
+                self.assertEqual(expected, count_cover_solutions(build_cover(rows, col_names, backend, order, secondary)))
+
+    def test_random_problem(self):
+        rows, col_names, order, secondary = random_problem(30, 80, 3, 7)
+        self.assertEqual(80, len(rows))
+        self.assertEqual((rows, col_names, order, secondary), random_problem(30, 80, 3, 7))
+        self.assertGreaterEqual(count_cover_solutions(build_cover(rows, col_names)), 1)
+
+    def test_run_instance(self):
+        result = run_instance(CORPUS[0])
+        self.assertEqual(2, result['solutions'])
+        self.assertEqual(4, result['rows'])
+        self.assertGreater(result['nodes'], 0)
+        self.assertGreater(result['updates'], 0)
+        self.assertGreater(result['peak_bytes'], 0)
+
+    def test_quick_corpus(self):
+        instances = [i for i in CORPUS if i.quick and i.name != 'queens_10']
+        report = run_benchmarks(instances, ['dlx', 'bitset'])
+        for r in report['results']:
+            if r['expected'] is not None:
+                self.assertEqual(r['expected'], r['solutions'], r['name'])
+
+    def test_report_round_trip(self):
+        report = run_benchmarks(CORPUS[:2])
+        fd, path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        try:
+            save_report(report, path)
+            self.assertEqual(report, load_report(path))
+        finally:
+            os.remove(path)
+
+    def test_run_cli(self):
+        fd, path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        try:
+            self.assertEqual(0, run_cli(['--only', 'exact_cover_simple', '--output', path]))
+            self.assertEqual(['exact_cover_simple'], [r['name'] for r in load_report(path)['results']])
+            self.assertEqual(0, run_cli(['--only', 'exact_cover_simple', '--compare', path, '--tolerance', '1000']))
+        finally:
+            os.remove(path)
+
+    def test_compare_reports(self):
+        baseline = {'results': [{'name': 'a', 'backend': 'dlx', 'solutions': 2, 'search_seconds': 1.0},
+                                {'name': 'b', 'backend': 'dlx', 'solutions': 2, 'search_seconds': 1.0}]}
+        current = {'results': [{'name': 'a', 'backend': 'dlx', 'solutions': 2, 'search_seconds': 1.1},
+                               {'name': 'b', 'backend': 'dlx', 'solutions': 2, 'search_seconds': 2.0},
+                               {'name': 'c', 'backend': 'dlx', 'solutions': 1, 'search_seconds': 9.0}]}
+        self.assertEqual(['b/dlx: search took 2.000s, was 1.000s'], compare_reports(baseline, current))
+        current['results'][0]['solutions'] = 3
+        self.assertEqual(2, len(compare_reports(baseline, current)))
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+        main()
@@ -0,0 +1,240 @@
+import unittest
+import numpy as np
+
+class BitsetCover():
+    """
+    An exact cover problem where every row is a bitmask held in one Python int.
+    Bit i stands for the i-th column of order, and the search always branches on the lowest
+    uncovered bit, which one bit trick finds.
+    :ivar rows: the rows of the matrix, each one a list of the column indices that hold a one
+    :ivar col_names: the list of names where index i corresponds to column i
+    :ivar order: the column indices in the order to branch on them, by default the order of the columns
+    :ivar secondary: the indices of the columns that may be covered at most once. They get the
+        bits above all the primary ones, so the search never branches on them
+    """
+    def __init__(self, rows, col_names, order=None, secondary=()):
+        num_cols = len(col_names)
+        self.col_names = list(col_names)
+        self.rows = [list(r) for r in rows]
+
+        for r in self.rows:
+            for c in r:
+                if c < 0 or c >= num_cols:
+                    raise ValueError("Column index %r is out of range for %d columns" % (c, num_cols))
+        # order[i] is the column bit i stands for, bit_of[c] the bit of column c
+        if order is None:
+            order = range(num_cols)
+        order = list(order)
+        if sorted(order) != list(range(num_cols)):
+            raise ValueError("The order must hold every column index once")
+        secondary = set(secondary)
+        self.order = [c for c in order if c not in secondary] + [c for c in order if c in secondary]
+        self.num_primary = num_cols - len(secondary)
+        self.bit_of = [0] * num_cols
+        for i in range(num_cols):
+            self.bit_of[self.order[i]] = i
+
+        # When the search branches on the lowest uncovered bit, every bit below it is covered,
+        # so only the rows whose own lowest bit is that bit can fit. bit_rows only keeps those
+        self.masks = []
+        self.bit_rows = [[] for c in range(num_cols)]
+        for i in range(len(self.rows)):
+            mask = 0
+            for c in self.rows[i]:
+                mask |= 1 << self.bit_of[c]
+            self.masks.append(mask)
+            if mask:
+                self.bit_rows[(mask & -mask).bit_length() - 1].append(i)
+        # Only the primary bits have to be set for a solution
+        self.full = (1 << self.num_primary) - 1
+
+    def search(self, chosen, stats=None):
+        """ Yields every time the row indices on chosen form a solution. A SearchStats given as
+        stats gets its nodes and solutions counted and its progress reported (the bitset
+        search has no link updates) """
+        masks, bit_rows, full = self.masks, self.bit_rows, self.full
+        # One frame per level: the rows that fit the column branched on and the next one to try
+        frame_rows = []
+        frame_next = []
+        used = 0
+        while True:
+            if stats is not None:
+                if stats.visit(len(frame_rows)):
+                    stats.report(_branches(frame_rows, frame_next))
+                if used & full == full:
+                    stats.solutions += 1
+            if used & full == full:
+                yield
+            else:
+                # The lowest zero bit of used is the first uncovered column
+                bit = (~used & (used + 1)).bit_length() - 1
+                frame_rows.append([r for r in bit_rows[bit] if not masks[r] & used])
+                frame_next.append(0)
+                chosen.append(-1)
+
+            # Move on to the next row that fits, backtracking as needed
+            while frame_rows:
+                i = frame_next[-1]
+                used ^= masks[chosen[-1]] if chosen[-1] >= 0 else 0
+                if i < len(frame_rows[-1]):
+                    r = frame_rows[-1][i]
+                    frame_next[-1] = i + 1
+                    chosen[-1] = r
+                    used |= masks[r]
+                    break
+                frame_rows.pop()
+                frame_next.pop()
+                chosen.pop()
+            else:
+                return
+
+def _branches(frame_rows, frame_next):
+    # The (index, total) pair of every level, for the progress estimate of SearchStats
+    return [(frame_next[k] - 1, len(frame_rows[k])) for k in range(len(frame_rows))]
+
+def iter_bitset_solutions(cover, stats=None):
+    """
+    Yields the solutions of a BitsetCover one at a time, as tuples of row indices.
+    :ivar cover: the BitsetCover (or NumpyBitsetCover) to search
+    :ivar stats: a SearchStats to count the work in
+    """
+    chosen = []
+    for _ in cover.search(chosen, stats):
+        yield tuple(chosen)
+
+def count_bitset_solutions(cover, limit=None, stats=None):
+    """
+    Counts the solutions of a BitsetCover without building any of them.
+    :ivar cover: the BitsetCover (or NumpyBitsetCover) to search
+    :ivar limit: stop as soon as this many solutions were found
+    :ivar stats: a SearchStats to count the work in
+    """
+    count = 0
+    if limit is not None and limit <= 0:
+        return count
+    for _ in cover.search([], stats):
+        count += 1
+        if limit is not None and count >= limit:
+            break
+    return count
+
+class NumpyBitsetCover(BitsetCover):
+    """
+    A BitsetCover that keeps the row masks packed in a uint64 array, one row of words per
+    row of the matrix. All the candidates of a column are checked against the covered
+    columns with one vectorized AND, which pays off on wide boards with many candidates.
+    """
+    def __init__(self, rows, col_names, order=None, secondary=()):
+        BitsetCover.__init__(self, rows, col_names, order, secondary)
+        num_cols = len(col_names)
+        self.num_words = max(1, (num_cols + 63) // 64)
+        self.words = np.zeros((len(self.rows), self.num_words), dtype=np.uint64)
+        for i in range(len(self.rows)):
+            for c in self.rows[i]:
+                b = self.bit_of[c]
+                self.words[i, b // 64] |= np.uint64(1) << np.uint64(b % 64)
+        self.bit_rows = [np.array(r, dtype=np.int64) for r in self.bit_rows]
+
+    def search(self, chosen, stats=None):
+        words, bit_rows, num_cols = self.words, self.bit_rows, self.num_primary
+        frame_rows = []
+        frame_next = []
+        frame_used = []
+        used = np.zeros(self.num_words, dtype=np.uint64)
+        # The first uncovered bit is at least as high as the one of the level above
+        first = 0
+        while True:
+            while first < num_cols and (int(used[first // 64]) >> (first % 64)) & 1:
+                first += 1
+            if stats is not None:
+                if stats.visit(len(frame_rows)):
+                    stats.report(_branches(frame_rows, frame_next))
+                if first == num_cols:
+                    stats.solutions += 1
+            if first == num_cols:
+                yield
+            else:
+                candidates = bit_rows[first]
+                fits = candidates[~(words[candidates] & used).any(axis=1)]
+                frame_rows.append(fits)
+                frame_next.append(0)
+                frame_used.append((used, first))
+
+            while frame_rows:
+                i = frame_next[-1]
+                used, first = frame_used[-1]
+                if len(chosen) == len(frame_rows):
+                    chosen.pop()
+                if i < len(frame_rows[-1]):
+                    r = int(frame_rows[-1][i])
+                    frame_next[-1] = i + 1
+                    chosen.append(r)
+                    used = used | words[r]
+                    break
+                frame_rows.pop()
+                frame_next.pop()
+                frame_used.pop()
+            else:
+                return
+
+def _domino_rows(rows, cols):
+    """ The exact cover rows of the domino tilings of a rows x cols board, shared by the tests """
+    matrix = []
+    for r in range(rows):
+        for c in range(cols):
+            if c + 1 < cols:
+                matrix.append([r * cols + c, r * cols + c + 1])
+            if r + 1 < rows:
+                matrix.append([r * cols + c, (r + 1) * cols + c])
+    return matrix
+
+class BitsetCover_UnitTest(unittest.TestCase):
+    def test_simple(self):
+        rows = [[1, 2], [0], [0, 2], [1]]
+        cover = BitsetCover(rows, ['a', 'b', 'c'])
+        self.assertEqual([[0, 1], [2, 3]], sorted(sorted(s) for s in iter_bitset_solutions(cover)))
+
+    def test_no_solution(self):
+        rows = [[1, 2], [0, 1], [0, 2]]
+        self.assertEqual(0, count_bitset_solutions(BitsetCover(rows, ['a', 'b', 'c'])))
+        self.assertEqual(0, count_bitset_solutions(NumpyBitsetCover(rows, ['a', 'b', 'c'])))
+
+    def test_count(self):
+        cover = BitsetCover(_domino_rows(4, 4), list(range(16)))
+        self.assertEqual(36, count_bitset_solutions(cover))
+        self.assertEqual(10, count_bitset_solutions(cover, limit=10))
+        self.assertEqual(0, count_bitset_solutions(cover, limit=0))
+
+    def test_numpy(self):
+        rows = _domino_rows(4, 4)
+        expected = sorted(sorted(s) for s in iter_bitset_solutions(BitsetCover(rows, list(range(16)))))
+        actual = sorted(sorted(s) for s in iter_bitset_solutions(NumpyBitsetCover(rows, list(range(16)))))
+        self.assertEqual(36, len(actual))
+        self.assertEqual(expected, actual)
+
+    def test_numpy_wide(self):
+        # The 5 domino tilings of a 2x4 board next to 62 columns with one row each
+        rows = _domino_rows(2, 4) + [[c] for c in range(8, 70)]
+        cover = NumpyBitsetCover(rows, list(range(70)))
+        self.assertEqual(2, cover.num_words)
+        self.assertEqual(5, count_bitset_solutions(cover))
+        self.assertEqual(5, count_bitset_solutions(BitsetCover(rows, list(range(70)))))
+
+    def test_secondary(self):
+        # Column c may stay empty, but not be covered twice
+        rows = [[0, 2], [1, 2], [0], [1]]
+        for cls in [BitsetCover, NumpyBitsetCover]:
+            cover = cls(rows, ['a', 'b', 'c'], secondary=[2])
+            self.assertEqual([[0, 3], [1, 2], [2, 3]], sorted(sorted(s) for s in iter_bitset_solutions(cover)))
+            cover = cls(rows, ['a', 'b', 'c'], order=[2, 1, 0], secondary=[2])
+            self.assertEqual(3, count_bitset_solutions(cover))
+
+    def test_bad_column(self):
+        with self.assertRaises(ValueError):
+            BitsetCover([[0, 3]], ['a', 'b', 'c'])
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+        main()
@@ -1,6 +1,15 @@
+import itertools
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
 import unittest
 import numpy as np
-from lattice import Lattice
+from lattice import Lattice, SparseLattice
+from bitset_cover import BitsetCover, NumpyBitsetCover, iter_bitset_solutions, count_bitset_solutions
 
 def choose_col(lattice):
     s = float('inf')
@@ -15,15 +24,23 @@ def choose_col(lattice):
 
 def cover_col(lattice, c):
     c = c.col_head
-    c.east.west = c.west
-    c.west.east = c.east
+    east = c.east
+    west = c.west
+    east.west = west
+    west.east = east
 
+    # Every link is read into a local once, the loops below run for every update of the search
     i = c.south
     while i is not c:
         j = i.east
         while j is not i:
-            j.south.north = j.north
-            j.north.south = j.south
+            north = j.north
+            south = j.south
+            south.north = north
+            north.south = south
+            weight = j.weight
+            if weight:
+                j.col_head.size -= weight
             j = j.east
         i = i.south
     return lattice
@@ -34,7 +51,9 @@ def uncover_col(lattice, c):
     while i is not c:
         j = i.west
         while j is not i:
-            j.col_head.size += 1
+            weight = j.weight
+            if weight:
+                j.col_head.size += weight
             j.south.north = j
             j.north.south = j
             j = j.west
@@ -43,54 +62,616 @@ def uncover_col(lattice, c):
     c.west.east = c
     return lattice
 
-def generate_exact_cover_solutions(lattice):
+def choose_sparse_col(lattice):
+    """ Returns the header node of the live column of a SparseLattice with the fewest ones """
+    right, size = lattice.right, lattice.size
+    c = right[0]
+    s = size[c]
+    j = right[c]
+    while j != 0 and s > 0:
+        if size[j] < s:
+            c = j
+            s = size[j]
+        j = right[j]
+    return c
+
+def choose_multiplicity_col(lattice):
+    """ Returns the live column of a SparseLattice with multiplicities that leaves the fewest
+    choices: the fewest rows beyond the number of times it still has to be covered """
+    right, size, need = lattice.right, lattice.size, lattice.need
+    c = right[0]
+    s = size[c] - need[c]
+    j = right[c]
+    while j != 0 and s > 0:
+        if size[j] - need[j] < s:
+            c = j
+            s = size[j] - need[j]
+        j = right[j]
+    return c
+
+class SearchStats():
     """
-	An implenetation of the dancing links solution to the exact cover problem.
-  	:ivar lattice: The lattice for the algorithm to run on
+    Counters a search fills in when it is given one. Without one the search runs the plain
+    cover and uncover, so the counting costs nothing.
+    :ivar nodes: the number of nodes of the search tree, the root included
+    :ivar level_nodes: level_nodes[d] is the number of nodes at depth d, Knuth's profile of the tree
+    :ivar updates: the number of links cover changed, Knuth's measure of the work done
+    :ivar covers: the number of columns covered
+    :ivar uncovers: the number of columns uncovered
+    :ivar solutions: the number of solutions found
+    :ivar pruned: the number of nodes given up because the prune hook said so
+    :ivar fraction: the estimated fraction of the tree searched so far, updated with every report
+    :ivar progress: a function called with the stats at most once every interval seconds
+    :ivar interval: the least number of seconds between two calls of progress
+    :ivar check_every: how many nodes to visit between two looks at the clock
     """
-    solutions = []
+    def __init__(self, progress=None, interval=1.0, check_every=1024):
+        self.nodes = 0
+        self.level_nodes = []
+        self.updates = 0
+        self.covers = 0
+        self.uncovers = 0
+        self.solutions = 0
+        self.pruned = 0
+        self.fraction = 0.0
+        self.progress = progress
+        self.interval = interval
+        self.check_every = check_every
+        self.start = None
+        self._next_report = 0.0
+
+    def visit(self, depth):
+        """ Counts a node at depth and returns True when a progress report is due """
+        if self.start is None:
+            self.start = time.monotonic()
+            self._next_report = self.start + self.interval
+        self.nodes += 1
+        if depth < len(self.level_nodes):
+            self.level_nodes[depth] += 1
+        else:
+            self.level_nodes.append(1)
+        if self.progress is None or self.nodes % self.check_every:
+            return False
+        now = time.monotonic()
+        if now < self._next_report:
+            return False
+        self._next_report = now + self.interval
+        return True
+
+    def report(self, branches):
+        """
+        Estimates how much of the tree is done and calls progress.
+        :ivar branches: one (index, total) pair per level: the branch being searched and the number of branches there
+        """
+        self.fraction = estimate_fraction(branches)
+        self.progress(self)
+
+    def elapsed(self):
+        if self.start is None:
+            return 0.0
+        return time.monotonic() - self.start
+
+    def rate(self):
+        """ Nodes searched per second """
+        elapsed = self.elapsed()
+        return self.nodes / elapsed if elapsed > 0 else 0.0
+
+    def eta(self):
+        """ The estimated number of seconds left, or None before there is an estimate """
+        if self.fraction <= 0:
+            return None
+        return self.elapsed() * (1 - self.fraction) / self.fraction
+
+    def as_dict(self):
+        return {'nodes': self.nodes, 'updates': self.updates, 'solutions': self.solutions,
+                'covers': self.covers, 'uncovers': self.uncovers, 'pruned': self.pruned,
+                'level_nodes': list(self.level_nodes)}
+
+def estimate_fraction(branches):
+    """
+    Knuth's estimate of the fraction of a search tree already searched. Every branch left of
+    the current path is assumed to be as big as its siblings, so at depth k the finished
+    branches count for index / (total_1 * ... * total_k) of the tree.
+    :ivar branches: one (index, total) pair per level of the current path
+    """
+    fraction = 0.0
+    weight = 1.0
+    for index, total in branches:
+        weight /= total
+        fraction += index * weight
+    return fraction
+
+def _counting_ops(lattice, stats):
+    # Wraps lattice.cover and lattice.uncover so every call is counted in stats, along with
+    # the links cover changes: one for the header and one for every other node of every row
+    down, right = lattice.down, lattice.right
+    others = [0] * len(lattice.up)
+    for x in lattice.row_start.values():
+        row = [x]
+        j = right[x]
+        while j != x:
+            row.append(j)
+            j = right[j]
+        for j in row:
+            others[j] = len(row) - 1
+    cover, uncover = lattice.cover, lattice.uncover
+
+    def counting_cover(c):
+        updates = 1
+        i = down[c]
+        while i != c:
+            updates += others[i]
+            i = down[i]
+        stats.updates += updates
+        stats.covers += 1
+        cover(c)
+
+    def counting_uncover(c):
+        stats.uncovers += 1
+        uncover(c)
+    return counting_cover, counting_uncover
+
+class Checkpoint():
+    """
+    The position of a search saved to a file every so often, so that a search that was
+    stopped can carry on where it was. The position is the index of the row chosen at every
+    level among the rows of the column branched on there. As the search is deterministic,
+    covering the same columns and rows again puts the lattice back in the same state.
+    A position at a solution is saved after the solution was yielded, and when the search
+    is closed, so a resumed search yields exactly the solutions an uninterrupted one had left.
+    :ivar path: the file the checkpoint is kept in
+    :ivar interval: the least number of seconds between two saves
+    :ivar check_every: how many nodes to visit between two looks at the clock
+    :ivar position: the path to resume from, empty to start at the root
+    :ivar solutions: the number of solutions yielded before the search left position
+    :ivar emitted: whether position is a solution that was yielded already
+    :ivar done: whether the search has finished
+    """
+    def __init__(self, path, interval=60.0, check_every=4096):
+        self.path = path
+        self.interval = interval
+        self.check_every = check_every
+        self.position = []
+        self.solutions = 0
+        self.emitted = False
+        self.done = False
+        self.shape = None
+        self._nodes = 0
+        self._next_save = time.monotonic() + interval
+        if os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            self.position = state['position']
+            self.solutions = state['solutions']
+            self.emitted = state.get('emitted', False)
+            self.done = state['done']
+            self.shape = state['shape']
+
+    def bind(self, lattice, prefix=()):
+        """ Ties the checkpoint to a problem, refusing a file saved for another one """
+        shape = [lattice.num_rows, len(lattice.col_names), lattice.num_nodes, list(prefix)]
+        if self.shape is not None and self.shape != shape:
+            raise ValueError("The checkpoint %s was saved for another problem" % self.path)
+        self.shape = shape
+
+    def due(self):
+        self._nodes += 1
+        if self._nodes % self.check_every:
+            return False
+        now = time.monotonic()
+        if now < self._next_save:
+            return False
+        self._next_save = now + self.interval
+        return True
+
+    def save(self, position, emitted=False):
+        self.position = position
+        self.emitted = emitted
+        state = {'position': position, 'solutions': self.solutions, 'emitted': emitted, 'done': self.done, 'shape': self.shape}
+        # Write then rename so a crash while saving leaves the last checkpoint whole
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp, self.path)
+
+    def finish(self):
+        self.done = True
+        self.save([])
+
+def _replay(lattice, O, branches, position, cover):
+    # Covers the rows of a saved position again, see Checkpoint
+    down, right, size = lattice.down, lattice.right, lattice.size
+    for index in position:
+        if right[0] == 0:
+            raise ValueError("The checkpoint goes deeper than the search tree")
+        c = choose_sparse_col(lattice)
+        if index >= size[c]:
+            raise ValueError("The checkpoint does not fit the search tree")
+        cover(c)
+        r = down[c]
+        for _ in range(index):
+            r = down[r]
+        O.append(r)
+        branches.append([index, size[c]])
+        j = right[r]
+        while j != r:
+            cover(lattice.col[j])
+            j = right[j]
+
+def _search(lattice, O, max_depth=None, debug=False, stats=None, checkpoint=None, prune=None):
+    """
+    The explicit-stack dancing links search all the public entry points share.
+    Yields None every time the rows whose nodes are on O form a solution, so the
+    callers decide what (if anything) to build from it. With max_depth it also yields
+    (and backtracks) whenever O holds max_depth rows. With debug the links and column sizes
+    are checked every time a level is entered, and a SearchStats given as stats is kept up
+    to date, with progress reports on how much of the tree is done. A Checkpoint holding a
+    position makes the search start from there, and it is saved as the search goes on.
+    prune(lattice) is asked at every node that is not a solution and the node is given up
+    when it returns True. Closing the generator early uncovers everything it covered.
+    """
+    down, left, right, col, size = lattice.down, lattice.left, lattice.right, lattice.col, lattice.size
+    cover, uncover = lattice.cover, lattice.uncover
+    # With stats or a checkpoint, branches[k] is [index, total] of the row chosen at level k
+    branches = []
+    track = stats is not None or checkpoint is not None
+    if stats is not None:
+        cover, uncover = _counting_ops(lattice, stats)
+
+    # O[k] is the node of the row chosen at level k
+    # skip is set when the search resumes at a solution that was yielded before it stopped
+    skip = False
+    try:
+        if checkpoint is not None:
+            if checkpoint.done:
+                return
+            _replay(lattice, O, branches, checkpoint.position, cover)
+            skip = checkpoint.emitted and right[0] == 0
+        while True:
+            if debug:
+                lattice.check_invariants()
+            if stats is not None:
+                if stats.visit(len(O)):
+                    stats.report(branches)
+                if right[0] == 0 and not skip:
+                    stats.solutions += 1
+            if checkpoint is not None and right[0] != 0 and checkpoint.due():
+                checkpoint.save([b[0] for b in branches])
+            if right[0] == 0 and checkpoint is not None:
+                # Saved once the solution is out, so it is not yielded again on resume
+                if not skip:
+                    checkpoint.solutions += 1
+                    try:
+                        yield
+                    except GeneratorExit:
+                        checkpoint.save([b[0] for b in branches], True)
+                        raise
+                    if checkpoint.due():
+                        checkpoint.save([b[0] for b in branches], True)
+                skip = False
+            elif right[0] == 0 or len(O) == max_depth:
+                yield
+            elif prune is not None and prune(lattice):
+                if stats is not None:
+                    stats.pruned += 1
+            else:
+                c = choose_sparse_col(lattice)
+                cover(c)
+                r = down[c]
+                if r != c:
+                    O.append(r)
+                    if track:
+                        branches.append([0, size[c]])
+                    j = right[r]
+                    while j != r:
+                        cover(col[j])
+                        j = right[j]
+                    continue
+                uncover(c)
+
+            # Backtrack to the deepest level that still has a row to try
+            while O:
+                r = O.pop()
+                j = left[r]
+                while j != r:
+                    uncover(col[j])
+                    j = left[j]
+                c = col[r]
+                r = down[r]
+                if r != c:
+                    O.append(r)
+                    if track:
+                        branches[-1][0] += 1
+                    j = right[r]
+                    while j != r:
+                        cover(col[j])
+                        j = right[j]
+                    break
+                if track:
+                    branches.pop()
+                uncover(c)
+            else:
+                if checkpoint is not None:
+                    checkpoint.finish()
+                return
+    finally:
+        while O:
+            r = O.pop()
+            j = left[r]
+            while j != r:
+                uncover(col[j])
+                j = left[j]
+            uncover(col[r])
+
+def _search_multiplicity(lattice, O, debug=False, stats=None, prune=None):
+    """
+    The search for a SparseLattice whose columns have multiplicities. A row is taken by
+    hiding it and covering the columns it fills up (see SparseLattice.take). The rows of
+    the branching column are tried in order and every row that was tried stays hidden
+    for the rows after it, so each set of rows is found once whatever the order it could
+    be chosen in. Yields None every time the rows whose nodes are on O form a solution.
+    """
+    down, right, size, need = lattice.down, lattice.right, lattice.size, lattice.need
+    # One frame per level: the column branched on, its size then and the rows tried in it
+    frames = []
+    try:
+        while True:
+            if debug:
+                lattice.check_invariants()
+            if stats is not None:
+                if stats.visit(len(O)):
+                    stats.report([(len(f[2]) - 1, f[1]) for f in frames])
+                if right[0] == 0:
+                    stats.solutions += 1
+            if right[0] == 0:
+                yield
+            elif prune is not None and prune(lattice):
+                if stats is not None:
+                    stats.pruned += 1
+            else:
+                c = choose_multiplicity_col(lattice)
+                frames.append((c, max(1, size[c]), []))
+
+            # The last row tried on every frame is taken, the ones before it are hidden
+            while frames:
+                c, total, tried = frames[-1]
+                if tried:
+                    lattice.untake(tried[-1])
+                    O.pop()
+                    r = down[tried[-1]]
+                else:
+                    r = down[c]
+                if r != c and size[c] >= need[c]:
+                    tried.append(r)
+                    lattice.take(r)
+                    O.append(r)
+                    break
+                for x in reversed(tried):
+                    lattice.unhide(x)
+                frames.pop()
+            else:
+                return
+    finally:
+        while frames:
+            c, total, tried = frames.pop()
+            if tried:
+                lattice.untake(tried[-1])
+                O.pop()
+            for x in reversed(tried):
+                lattice.unhide(x)
+
+def _row_live(lattice, x, seen):
+    # A row can be chosen while every node of it is linked into its column and none of its
+    # columns is covered yet. A secondary column keeps its header links when it is covered,
+    # so the columns chosen by the prefix so far are kept in seen as well
+    up, down, left, right, col, need = lattice.up, lattice.down, lattice.left, lattice.right, lattice.col, lattice.need
+    j = x
+    while True:
+        h = col[j]
+        if down[up[j]] != j or right[left[h]] != h:
+            return False
+        if need is None:
+            if h in seen:
+                return False
+            seen.add(h)
+        elif need[h] == 0:
+            return False
+        j = right[j]
+        if j == x:
+            return True
+
+def _select_prefix(lattice, prefix):
+    """ Chooses the rows of prefix. Returns False, with nothing chosen, when they do not fit together """
+    seen = set()
+    for i in range(len(prefix)):
+        if not _row_live(lattice, lattice.row_start[prefix[i]], seen):
+            _unselect_prefix(lattice, prefix[:i])
+            return False
+        if lattice.need is None:
+            lattice.select(prefix[i])
+        else:
+            lattice.take(lattice.row_start[prefix[i]])
+    return True
+
+def _unselect_prefix(lattice, prefix):
+    for r in reversed(prefix):
+        if lattice.need is None:
+            lattice.unselect(r)
+        else:
+            lattice.untake(lattice.row_start[r])
+            lattice.unhide(lattice.row_start[r])
+
+def _open_search(lattice, O, debug, stats, checkpoint, prune):
+    if lattice.need is None:
+        return _search(lattice, O, debug=debug, stats=stats, checkpoint=checkpoint, prune=prune)
+    if checkpoint is not None:
+        raise ValueError("Checkpoints are not supported for columns with multiplicities")
+    return _search_multiplicity(lattice, O, debug=debug, stats=stats, prune=prune)
+
+def iter_exact_cover_solutions(lattice, prefix=(), debug=False, stats=None, checkpoint=None, prune=None):
+    """
+    An iterative dancing links search that yields the solutions one at a time.
+    Every solution is a tuple of the row ids it is made of. The choices are kept on an
+    explicit stack, so the depth of the search is not bound by the recursion limit.
+    Secondary columns end up covered at most once, and columns with multiplicities as
+    many times as they ask for. Closing the generator early uncovers everything it covered.
+    :ivar lattice: The SparseLattice (or Lattice) for the algorithm to run on
+    :ivar prefix: row ids that are already chosen. Only the solutions that contain them are
+        searched, and none when two of them share a column or one of them is covered already
+    :ivar debug: check the links and column sizes of the lattice at every step
+    :ivar stats: a SearchStats to count the work in
+    :ivar checkpoint: a Checkpoint to resume from and to save the position in. Only the
+        solutions after the saved position are yielded
+    :ivar prune: a function of the SparseLattice that returns True when the current partial
+        solution cannot be completed, see region_pruner in pentomino.py
+    """
+    if not isinstance(lattice, SparseLattice):
+        lattice = SparseLattice.from_lattice(lattice)
+    row = lattice.row
+    prefix = tuple(prefix)
+    if checkpoint is not None:
+        checkpoint.bind(lattice, prefix)
+    O = []
+    search = _open_search(lattice, O, debug, stats, checkpoint, prune)
+    if not _select_prefix(lattice, prefix):
+        search.close()
+        return
+    try:
+        try:
+            for _ in search:
+                yield prefix + tuple([row[x] for x in O])
+        finally:
+            search.close()
+    finally:
+        _unselect_prefix(lattice, prefix)
+
+def count_exact_cover_solutions(lattice, limit=None, prefix=(), debug=False, stats=None, checkpoint=None, prune=None):
+    """
+    Counts the solutions without building any of them.
+    :ivar lattice: The SparseLattice (or Lattice) for the algorithm to run on
+    :ivar limit: stop as soon as this many solutions were found
+    :ivar prefix: row ids that are already chosen. Only the solutions that contain them are
+        counted, and none when they do not fit together
+    :ivar debug: check the links and column sizes of the lattice at every step
+    :ivar stats: a SearchStats to count the work in
+    :ivar checkpoint: a Checkpoint to resume from and to save the position in. The solutions
+        found before the saved position are part of the count
+    :ivar prune: a function of the SparseLattice that returns True when the current partial
+        solution cannot be completed
+    """
+    if not isinstance(lattice, SparseLattice):
+        lattice = SparseLattice.from_lattice(lattice)
+    count = 0
+    if checkpoint is not None:
+        checkpoint.bind(lattice, prefix)
+        count = checkpoint.solutions
+    if limit is not None and count >= limit:
+        return count
+    search = _open_search(lattice, [], debug, stats, checkpoint, prune)
+    if not _select_prefix(lattice, prefix):
+        search.close()
+        return count
+    try:
+        try:
+            for _ in search:
+                count += 1
+                if limit is not None and count >= limit:
+                    break
+        finally:
+            search.close()
+    finally:
+        _unselect_prefix(lattice, prefix)
+    return count
+
+def iter_search_prefixes(lattice, depth):
+    """
+    Yields the rows chosen on every path of the search tree down to the given depth.
+    Solutions found above that depth are yielded as shorter prefixes. Searching under
+    every prefix (see the prefix argument of iter_exact_cover_solutions) visits the whole
+    tree exactly once.
+    :ivar lattice: The SparseLattice (or Lattice) for the algorithm to run on
+    :ivar depth: the number of levels to expand
+    """
+    if not isinstance(lattice, SparseLattice):
+        lattice = SparseLattice.from_lattice(lattice)
+    if lattice.need is not None:
+        raise ValueError("Splitting the search is not supported for columns with multiplicities")
+    row = lattice.row
     O = []
+    search = _search(lattice, O, max_depth=depth)
+    try:
+        for _ in search:
+            yield tuple([row[x] for x in O])
+    finally:
+        search.close()
+
+def has_exact_cover(lattice):
+    """ Returns True as soon as a single solution is found """
+    return count_exact_cover_solutions(lattice, limit=1) == 1
+
+# The search engines that can run an exact cover problem given as sparse rows
+BACKENDS = ['dlx', 'bitset', 'numpy']
+
+def build_cover(rows, col_names, backend='dlx', order=None, secondary=(), multiplicity=None):
+    """
+    Builds the structure the chosen backend searches: a SparseLattice for 'dlx', a
+    BitsetCover for 'bitset' and a NumpyBitsetCover for 'numpy'.
+    :ivar rows: the rows of the matrix, each one a list of the column indices that hold a one
+    :ivar col_names: the list of names where index i corresponds to column i
+    :ivar backend: one of BACKENDS
+    :ivar order: the order the bitset backends branch on the columns in, see BitsetCover
+    :ivar secondary: the indices of the columns that may be covered at most once
+    :ivar multiplicity: how many times every column has to be covered, only for 'dlx'
+    """
+    if backend == 'dlx':
+        return SparseLattice(rows, col_names, secondary, multiplicity)
+    if multiplicity is not None:
+        raise ValueError("The %r backend does not support multiplicities" % backend)
+    if backend == 'bitset':
+        return BitsetCover(rows, col_names, order, secondary)
+    if backend == 'numpy':
+        return NumpyBitsetCover(rows, col_names, order, secondary)
+    raise ValueError("Unknown backend %r, expected one of %r" % (backend, BACKENDS))
 
-    def exact_cover_search(k):
-        #If R[h] = h, print the current solution and return
-        if lattice.head.east is lattice.head:
-            print("Solution found!")
-            solutions.append(O.copy())
-            return lattice
-        #Otherwise choose a column object c
-        c = choose_col(lattice)
-        #Cover column c
-        cover_col(lattice, c)
-        #for each r <- D[c], D[D[c]], ... , while r is not c,
+def iter_cover_solutions(cover, stats=None):
+    """ Yields the solutions of a structure built by build_cover, as tuples of row indices """
+    if isinstance(cover, BitsetCover):
+        return iter_bitset_solutions(cover, stats)
+    return iter_exact_cover_solutions(cover, stats=stats)
+
+def count_cover_solutions(cover, limit=None, stats=None):
+    """ Counts the solutions of a structure built by build_cover """
+    if isinstance(cover, BitsetCover):
+        return count_bitset_solutions(cover, limit, stats)
+    return count_exact_cover_solutions(cover, limit, stats=stats)
+
+def generate_exact_cover_solutions(lattice):
+    """
+    An implenetation of the dancing links solution to the exact cover problem.
+    Returns every solution as a list holding one node of each chosen row.
+  	:ivar lattice: The lattice for the algorithm to run on
+    """
+    nodes = {}
+    c = lattice.head.east
+    while c is not lattice.head:
         r = c.south
         while r is not c:
-            #set O_k <- r
-            O.insert(k, r)
-            #for each j <- R[r], R[R[r]], ... , while j is not r,
-            j = r.east
-            while j is not r:
-                # cover column C[j]
-                cover_col(lattice, j)
-                j = j.east
-            #search(k + 1)
-            exact_cover_search(k + 1)
-            #set r <- O_k and c <- C[r]
-            r = O[k]
-            c = r.col_head
-            #for each j <- L[r], L[L[r]], ... , while j is not r,
-            j = r.west
-            while j is not r:
-                #uncover column C[j]
-                uncover_col(lattice, j)
-                j = j.west
-            O.pop()
+            nodes.setdefault(r.row_num, r)
             r = r.south
-        #uncover column c and return
-        uncover_col(lattice, c)
-    exact_cover_search(0)
+        c = c.east
+
+    solutions = []
+    for solution in iter_exact_cover_solutions(SparseLattice.from_lattice(lattice)):
+        solutions.append([nodes[r] for r in solution])
     return solutions
 
 class ExactCover_UnitTest(unittest.TestCase):
+    @staticmethod
+    def _domino_rows(rows, cols):
+        # The test fixture lives with the tests of bitset_cover
+        from bitset_cover import _domino_rows
+        return _domino_rows(rows, cols)
 
     def test_cover_col(self):
         col_names = ['a', 'b', 'c']
@@ -160,6 +741,18 @@ class ExactCover_UnitTest(unittest.TestCase):
         self.assertEqual(2, len(solutions))
         self.assertEqual([[1, 2], [3, 4]], solution_rows)
 
+    def test_generate_with_zeros(self):
+        # The nodes of the zeros are kept, but only the ones are searched
+        matrix = [['0', '1', '1'],
+                  ['1', '0', '0'],
+                  ['1', '0', '1'],
+                  ['0', '1', '0']]
+        lattice = Lattice(matrix, ['a', 'b', 'c'])
+        self.assertEqual([2, 2, 2], [h.size for h in lattice.headers()])
+        solutions = generate_exact_cover_solutions(lattice)
+        self.assertEqual([[1, 2], [3, 4]], sorted(sorted(n.row_num for n in s) for s in solutions))
+        self.assertEqual(6, SparseLattice.from_lattice(lattice).num_nodes)
+
     def test_generate_simple_exact_cover_solution2(self):
         col_names = ['a', 'b', 'c', 'd']
         matrix = [['0', '1', '1', '0'],
@@ -170,6 +763,370 @@ class ExactCover_UnitTest(unittest.TestCase):
         solutions = generate_exact_cover_solutions(lattice)
         self.assertEqual(0, len(solutions))
 
+    def test_cover_col_sizes(self):
+        col_names = ['a', 'b', 'c']
+        matrix = [[0, 1, 1],
+                  [1, 0, 0],
+                  [1, 0, 1],
+                  [0, 1, 0]]
+        lattice = Lattice(matrix, col_names, delete_zeros=True)
+        a = lattice.head.east
+        self.assertEqual([2, 2, 2], [a.size, a.east.size, a.east.east.size])
+        cover_col(lattice, a)
+        lattice.check_invariants()
+        self.assertEqual([2, 1], [a.east.size, a.east.east.size])
+        self.assertIs(a.east.east, choose_col(lattice))
+        uncover_col(lattice, a)
+        lattice.check_invariants()
+        self.assertEqual([2, 2, 2], [a.size, a.east.size, a.east.east.size])
+
+    def test_debug_search(self):
+        rows = [[1, 2], [0], [0, 2], [1], [0, 1, 2]]
+        lattice = SparseLattice(rows, ['a', 'b', 'c'])
+        self.assertEqual(3, count_exact_cover_solutions(lattice, debug=True))
+        self.assertEqual(3, len(list(iter_exact_cover_solutions(lattice, prefix=[], debug=True))))
+
+    def test_iter_exact_cover_solutions(self):
+        rows = [[1, 2], [0], [0, 2], [1]]
+        lattice = SparseLattice(rows, ['a', 'b', 'c'])
+        solutions = sorted(sorted(s) for s in iter_exact_cover_solutions(lattice))
+        self.assertEqual([[0, 1], [2, 3]], solutions)
+
+    def test_iter_exact_cover_solutions_lattice(self):
+        col_names = ['a', 'b', 'c']
+        matrix = [['0', '1', '1'],
+                  ['1', '0', '0'],
+                  ['1', '0', '1'],
+                  ['0', '1', '0']]
+        lattice = Lattice(matrix, col_names, delete_zeros=True)
+        solutions = sorted(sorted(s) for s in iter_exact_cover_solutions(lattice))
+        self.assertEqual([[1, 2], [3, 4]], solutions)
+
+    def test_iter_stops_early(self):
+        rows = [[1, 2], [0], [0, 2], [1]]
+        lattice = SparseLattice(rows, ['a', 'b', 'c'])
+        links = (lattice.up[:], lattice.down[:], lattice.left[:], lattice.right[:], lattice.size[:])
+        solutions = iter_exact_cover_solutions(lattice)
+        next(solutions)
+        solutions.close()
+        self.assertEqual(links, (lattice.up, lattice.down, lattice.left, lattice.right, lattice.size))
+
+    def test_count_exact_cover_solutions(self):
+        rows = [[1, 2], [0], [0, 2], [1], [0, 1, 2]]
+        lattice = SparseLattice(rows, ['a', 'b', 'c'])
+        self.assertEqual(3, count_exact_cover_solutions(lattice))
+        self.assertEqual(2, count_exact_cover_solutions(lattice, limit=2))
+        self.assertEqual(0, count_exact_cover_solutions(lattice, limit=0))
+        lattice.check_invariants()
+        self.assertEqual(3, count_exact_cover_solutions(lattice))
+
+    def test_has_exact_cover(self):
+        rows = [[1, 2], [0], [0, 2], [1]]
+        self.assertTrue(has_exact_cover(SparseLattice(rows, ['a', 'b', 'c'])))
+        rows = [[1, 2], [0, 1], [0, 2]]
+        self.assertFalse(has_exact_cover(SparseLattice(rows, ['a', 'b', 'c'])))
+
+    def test_prefix(self):
+        rows = [[1, 2], [0], [0, 2], [1], [0, 1, 2]]
+        lattice = SparseLattice(rows, ['a', 'b', 'c'])
+        self.assertEqual([(1, 0)], list(iter_exact_cover_solutions(lattice, prefix=[1])))
+        self.assertEqual(1, count_exact_cover_solutions(lattice, prefix=[3]))
+        self.assertEqual(3, count_exact_cover_solutions(lattice))
+
+    def test_bad_prefix(self):
+        rows = [[1, 2], [0], [0, 2], [1], [0, 1, 2]]
+        lattice = SparseLattice(rows, ['a', 'b', 'c'], secondary=[2])
+        before = lattice.export()
+        for prefix in [[1, 2], [1, 1], [3, 0, 4]]:
+            self.assertEqual([], list(iter_exact_cover_solutions(lattice, prefix=prefix)))
+            self.assertEqual(0, count_exact_cover_solutions(lattice, prefix=prefix))
+            lattice.check_invariants()
+            self.assertEqual(before.matrix().tolist(), lattice.export().matrix().tolist())
+        # A row that is covered already by a row chosen outside the search
+        lattice.select(1)
+        self.assertEqual(0, count_exact_cover_solutions(lattice, prefix=[2]))
+        self.assertEqual([(3,)], list(iter_exact_cover_solutions(lattice, prefix=[3])))
+        lattice.unselect(1)
+        multiplicity = SparseLattice([[0], [0], [0, 1]], ['a', 'b'], multiplicity=[2, 1])
+        self.assertEqual(1, count_exact_cover_solutions(multiplicity, prefix=[0]))
+        self.assertEqual(0, count_exact_cover_solutions(multiplicity, prefix=[0, 0]))
+        self.assertEqual(0, count_exact_cover_solutions(multiplicity, prefix=[0, 1]))
+        multiplicity.check_invariants()
+
+    def test_iter_search_prefixes(self):
+        rows = [[1, 2], [0], [0, 2], [1], [0, 1, 2]]
+        lattice = SparseLattice(rows, ['a', 'b', 'c'])
+        prefixes = list(iter_search_prefixes(lattice, 1))
+        self.assertEqual([(1,), (2,), (4,)], prefixes)
+        total = 0
+        for p in prefixes:
+            total += count_exact_cover_solutions(lattice, prefix=p)
+        self.assertEqual(3, total)
+
+    def test_backends(self):
+        rows = [[1, 2], [0], [0, 2], [1], [0, 1, 2]]
+        for backend in BACKENDS:
+            cover = build_cover(rows, ['a', 'b', 'c'], backend)
+            self.assertEqual([[0, 1], [2, 3], [4]], sorted(sorted(s) for s in iter_cover_solutions(cover)))
+            self.assertEqual(2, count_cover_solutions(cover, limit=2))
+            stats = SearchStats()
+            self.assertEqual(3, count_cover_solutions(cover, stats=stats))
+            self.assertEqual(3, stats.solutions)
+            self.assertGreater(stats.nodes, 3)
+        with self.assertRaises(ValueError):
+            build_cover(rows, ['a', 'b', 'c'], 'quantum')
+
+    def test_search_stats(self):
+        rows = [[1, 2], [0], [0, 2], [1]]
+        lattice = SparseLattice(rows, ['a', 'b', 'c'])
+        stats = SearchStats()
+        self.assertEqual(2, count_exact_cover_solutions(lattice, stats=stats))
+        # The root, rows 1 and 2 under column a, row 0 under c and row 3 under b
+        self.assertEqual(5, stats.nodes)
+        self.assertEqual(2, stats.solutions)
+        # cover(a) 2, then cover(c) 2 and cover(b) 1 under row 1, cover(c) 2 and cover(b) 1 under row 2
+        self.assertEqual(8, stats.updates)
+        self.assertEqual([1, 2, 2], stats.level_nodes)
+        # cover(a), then c and b under each of the two rows
+        self.assertEqual(5, stats.covers)
+        self.assertEqual(5, stats.uncovers)
+        self.assertEqual({'nodes': 5, 'updates': 8, 'solutions': 2, 'covers': 5, 'uncovers': 5,
+                          'pruned': 0, 'level_nodes': [1, 2, 2]}, stats.as_dict())
+
+    def test_estimate_fraction(self):
+        self.assertEqual(0.0, estimate_fraction([]))
+        self.assertEqual(0.5, estimate_fraction([(1, 2)]))
+        # Second of 2 branches at the top, third of 4 below it
+        self.assertEqual(0.5 + 2 / 8.0, estimate_fraction([(1, 2), (2, 4)]))
+
+    def test_progress(self):
+        reports = []
+        stats = SearchStats(progress=lambda s: reports.append(s.fraction), interval=0, check_every=1)
+        lattice = SparseLattice(self._domino_rows(4, 4), list(range(16)))
+        self.assertEqual(36, count_exact_cover_solutions(lattice, stats=stats))
+        self.assertEqual(stats.nodes, len(reports))
+        self.assertEqual(0.0, reports[0])
+        self.assertTrue(all(0 <= f < 1 for f in reports))
+        self.assertGreater(max(reports), 0.5)
+        self.assertEqual(stats.nodes, sum(stats.level_nodes))
+        self.assertGreater(stats.rate(), 0)
+        self.assertIsNotNone(stats.eta())
+
+    def test_progress_rate_limited(self):
+        reports = []
+        stats = SearchStats(progress=reports.append, interval=3600, check_every=1)
+        count_exact_cover_solutions(SparseLattice(self._domino_rows(4, 4), list(range(16))), stats=stats)
+        self.assertEqual([], reports)
+        for backend in ['bitset', 'numpy']:
+            stats = SearchStats(progress=reports.append, interval=0, check_every=1)
+            self.assertEqual(36, count_cover_solutions(build_cover(self._domino_rows(4, 4), list(range(16)), backend), stats=stats))
+            self.assertEqual(stats.nodes, sum(stats.level_nodes))
+        self.assertGreater(len(reports), 0)
+
+    def test_checkpoint(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'search.json')
+        try:
+            lattice = SparseLattice(self._domino_rows(4, 4), list(range(16)))
+            expected = list(iter_exact_cover_solutions(lattice))
+            # Stop after every few solutions and resume from the last save
+            checkpoint = Checkpoint(path, interval=0, check_every=1)
+            first = list(itertools.islice(iter_exact_cover_solutions(lattice, checkpoint=checkpoint), 10))
+            self.assertEqual(expected[:10], first)
+            saved = Checkpoint(path)
+            self.assertEqual(10, saved.solutions)
+            self.assertTrue(saved.emitted)
+            self.assertFalse(saved.done)
+            rest = list(iter_exact_cover_solutions(lattice, checkpoint=Checkpoint(path, interval=0, check_every=1)))
+            self.assertEqual(expected[10:], rest)
+            self.assertTrue(Checkpoint(path).done)
+            self.assertEqual([], list(iter_exact_cover_solutions(lattice, checkpoint=Checkpoint(path))))
+            # Wherever the first run stops, the two runs together yield every solution once
+            for stop in [1, 5, 17, 35]:
+                os.remove(path)
+                solutions = iter_exact_cover_solutions(lattice, checkpoint=Checkpoint(path, interval=0, check_every=3))
+                first = list(itertools.islice(solutions, stop))
+                solutions.close()
+                rest = list(iter_exact_cover_solutions(lattice, checkpoint=Checkpoint(path)))
+                self.assertEqual(expected, first + rest)
+            lattice.check_invariants()
+        finally:
+            shutil.rmtree(directory)
+
+    def test_checkpoint_count(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'search.json')
+        try:
+            lattice = SparseLattice(self._domino_rows(4, 4), list(range(16)))
+            for limit in [1, 7, 20]:
+                if os.path.exists(path):
+                    os.remove(path)
+                count_exact_cover_solutions(lattice, limit=limit, checkpoint=Checkpoint(path, interval=0, check_every=3))
+                self.assertEqual(36, count_exact_cover_solutions(lattice, checkpoint=Checkpoint(path)))
+            self.assertEqual(36, count_exact_cover_solutions(lattice, checkpoint=Checkpoint(path)))
+            # A checkpoint that already holds the limit is not searched any further
+            os.remove(path)
+            self.assertEqual(7, count_exact_cover_solutions(lattice, limit=7, checkpoint=Checkpoint(path, interval=0, check_every=1)))
+            saved = Checkpoint(path)
+            self.assertGreaterEqual(saved.solutions, 5)
+            self.assertEqual(saved.solutions, count_exact_cover_solutions(lattice, limit=5, checkpoint=saved))
+            self.assertEqual(saved.position, Checkpoint(path).position)
+            with self.assertRaises(ValueError):
+                count_exact_cover_solutions(SparseLattice(self._domino_rows(2, 4), list(range(8))), checkpoint=Checkpoint(path))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_prune(self):
+        lattice = SparseLattice(self._domino_rows(4, 4), list(range(16)))
+        # Give up on every partial tiling that has cell 0 filled but cell 5 empty. No domino
+        # covers both and the search fills cell 0 first, so no tiling is left
+        def prune(lattice):
+            live = set()
+            h = lattice.right[0]
+            while h != 0:
+                live.add(h - 1)
+                h = lattice.right[h]
+            return 0 not in live and 5 in live
+        stats = SearchStats()
+        solutions = list(iter_exact_cover_solutions(lattice, stats=stats, prune=prune))
+        self.assertGreater(stats.pruned, 0)
+        self.assertEqual([], solutions)
+        self.assertEqual(36, count_exact_cover_solutions(lattice))
+        lattice.check_invariants()
+        multiplicity = SparseLattice(self._domino_rows(4, 4), list(range(16)), multiplicity=[1] * 16)
+        self.assertEqual(0, count_exact_cover_solutions(multiplicity, prune=prune))
+        self.assertEqual(36, count_exact_cover_solutions(multiplicity, prune=lambda l: False))
+
+    def test_clone_covered(self):
+        matrix = [['0', '1', '1'],
+                  ['1', '0', '0'],
+                  ['1', '0', '1'],
+                  ['0', '1', '0']]
+        lattice = Lattice(matrix, ['a', 'b', 'c'], delete_zeros=True)
+        before = str(lattice)
+        cover_col(lattice, lattice.head.east)
+        clone = lattice.clone()
+        self.assertEqual(['b', 'c'], [h.col_name for h in clone.headers()])
+        self.assertEqual(len(lattice.nodes()), len(clone.nodes()))
+        uncover_col(clone, clone.columns[0])
+        clone.check_invariants()
+        self.assertEqual(['a', 'b', 'c'], [h.col_name for h in clone.headers()])
+        self.assertEqual(before, str(clone))
+        self.assertEqual(['b', 'c'], [h.col_name for h in lattice.headers()])
+        snapshot = lattice.snapshot()
+        uncover_col(lattice, lattice.columns[0])
+        lattice.reset(snapshot)
+        self.assertEqual(['b', 'c'], [h.col_name for h in lattice.headers()])
+        uncover_col(lattice, lattice.columns[0])
+        self.assertEqual(before, str(lattice))
+
+    def test_snapshot_after_error(self):
+        lattice = SparseLattice(self._domino_rows(4, 4), list(range(16)))
+        snapshot = lattice.snapshot()
+        calls = []
+        def prune(lattice):
+            calls.append(1)
+            if len(calls) == 20:
+                raise KeyboardInterrupt()
+            return False
+        with self.assertRaises(KeyboardInterrupt):
+            count_exact_cover_solutions(lattice, prune=prune)
+        lattice.reset(snapshot)
+        lattice.check_invariants()
+        self.assertEqual(36, count_exact_cover_solutions(lattice))
+        clone = lattice.clone()
+        self.assertEqual(36, count_exact_cover_solutions(clone, prefix=()))
+        self.assertEqual(lattice.right, clone.right)
+
+    def test_secondary(self):
+        # Column c may stay empty, but not be covered twice
+        rows = [[0, 2], [1, 2], [0], [1]]
+        lattice = SparseLattice(rows, ['a', 'b', 'c'], secondary=[2])
+        solutions = sorted(sorted(s) for s in iter_exact_cover_solutions(lattice, debug=True))
+        self.assertEqual([[0, 3], [1, 2], [2, 3]], solutions)
+        for backend in BACKENDS:
+            self.assertEqual(3, count_cover_solutions(build_cover(rows, ['a', 'b', 'c'], backend, secondary=[2])))
+
+    def test_secondary_lattice(self):
+        matrix = [[1, 0, 1],
+                  [0, 1, 1],
+                  [1, 0, 0],
+                  [0, 1, 0]]
+        lattice = Lattice(matrix, ['a', 'b', 'c'], delete_zeros=True, secondary=[2])
+        solutions = generate_exact_cover_solutions(lattice)
+        self.assertEqual([[1, 4], [2, 3], [3, 4]], sorted(sorted(n.row_num for n in s) for s in solutions))
+
+    def test_n_queens_secondary(self):
+        for n, expected in [(1, 1), (4, 2), (5, 10), (6, 4), (8, 92)]:
+            rows = []
+            for r in range(n):
+                for c in range(n):
+                    rows.append([r, n + c, 2 * n + r + c, 5 * n - 2 + r - c])
+            diagonals = range(2 * n, 6 * n - 2)
+            lattice = SparseLattice(rows, list(range(6 * n - 2)), secondary=diagonals)
+            self.assertEqual(expected, count_exact_cover_solutions(lattice))
+
+    def _brute_force(self, rows, num_cols, secondary, multiplicity):
+        # The search only branches on primary columns, so it never takes a row without one
+        rows = [r if set(r) - set(secondary) else None for r in rows]
+        solutions = []
+        for k in range(len(rows) + 1):
+            for chosen in itertools.combinations([r for r in range(len(rows)) if rows[r] is not None], k):
+                counts = [0] * num_cols
+                for r in chosen:
+                    for c in rows[r]:
+                        counts[c] += 1
+                if all(counts[c] <= multiplicity[c] if c in secondary else counts[c] == multiplicity[c] for c in range(num_cols)):
+                    solutions.append(list(chosen))
+        return solutions
+
+    def test_multiplicity(self):
+        # Column a has to be covered twice, b once
+        rows = [[0], [0], [0, 1], [1]]
+        lattice = SparseLattice(rows, ['a', 'b'], multiplicity=[2, 1])
+        solutions = sorted(sorted(s) for s in iter_exact_cover_solutions(lattice, debug=True))
+        self.assertEqual([[0, 1, 3], [0, 2], [1, 2]], solutions)
+        self.assertEqual(1, count_exact_cover_solutions(lattice, prefix=[3]))
+        self.assertEqual([(2, 0), (2, 1)], sorted(iter_exact_cover_solutions(lattice, prefix=[2])))
+        self.assertEqual(3, count_exact_cover_solutions(lattice))
+        lattice.check_invariants()
+        self.assertEqual([0, 2, 1], lattice.need)
+
+    def test_multiplicity_random(self):
+        rng = random.Random(5)
+        for trial in range(30):
+            num_cols = rng.randint(2, 5)
+            rows = [sorted(rng.sample(range(num_cols), rng.randint(1, num_cols))) for r in range(rng.randint(3, 9))]
+            multiplicity = [rng.randint(1, 3) for c in range(num_cols)]
+            secondary = [c for c in range(num_cols) if rng.random() < 0.3]
+            lattice = SparseLattice(rows, list(range(num_cols)), secondary, multiplicity)
+            links = (lattice.up[:], lattice.down[:], lattice.left[:], lattice.right[:], lattice.size[:])
+            stats = SearchStats()
+            solutions = sorted(sorted(s) for s in iter_exact_cover_solutions(lattice, stats=stats))
+            self.assertEqual(self._brute_force(rows, num_cols, secondary, multiplicity), sorted(solutions, key=lambda s: (len(s), s)))
+            self.assertEqual(len(solutions), stats.solutions)
+            self.assertEqual(links, (lattice.up, lattice.down, lattice.left, lattice.right, lattice.size))
+
+    def test_multiplicity_lattice(self):
+        matrix = [[1, 0],
+                  [1, 0],
+                  [1, 1],
+                  [0, 1]]
+        lattice = Lattice(matrix, ['a', 'b'], delete_zeros=True, multiplicity=[2, 1])
+        solutions = generate_exact_cover_solutions(lattice)
+        self.assertEqual([[1, 2, 4], [1, 3], [2, 3]], sorted(sorted(n.row_num for n in s) for s in solutions))
+        with self.assertRaises(ValueError):
+            build_cover([[0]], ['a'], 'bitset', multiplicity=[2])
+        with self.assertRaises(ValueError):
+            list(iter_search_prefixes(SparseLattice([[0]], ['a'], multiplicity=[2]), 1))
+
+    def test_iter_deeper_than_recursion_limit(self):
+        n = sys.getrecursionlimit() + 100
+        lattice = SparseLattice([[i] for i in range(n)], list(range(n)))
+        solutions = list(iter_exact_cover_solutions(lattice))
+        self.assertEqual(1, len(solutions))
+        self.assertEqual(n, len(solutions[0]))
+
 
 def main():
     unittest.main()
@@ -3,6 +3,10 @@
 import unittest
 import numpy as np
 
+def is_one(key):
+    """ Returns True for the keys that count as a one of the matrix: anything but None, 0 and '0' """
+    return key is not None and key is not False and key != 0 and key != '0'
+
 class Node():
     """ A lattice element.
 
@@ -12,10 +16,15 @@ class Node():
 	:ivar east: reference to the node to the east
 	:ivar west: reference to the node to the west
     :ivar col_head: reference to the head node of the column
-    :ivar col_name: the name of the column. Only not null if the node is a head
+    :ivar weight: 1 if the key is a one of the matrix, else 0. This is what the node adds to the size of its column
 
+	The links are kept in __slots__, so a node holds no __dict__. Column names and sizes
+	live on HeaderNode only; col_name reads as None on every other node.
 	"""
-    def __init__(self, key=None, row_num = None, north = None, south = None, east = None, west = None, col_head = None, col_name=None):
+    __slots__ = ('key', 'row_num', 'north', 'south', 'east', 'west', 'col_head', 'weight')
+    col_name = None
+
+    def __init__(self, key=None, row_num = None, north = None, south = None, east = None, west = None, col_head = None):
         """ Initializes a new Lattice Node """
         self.key = key
         self.north = north
@@ -23,19 +32,8 @@ class Node():
         self.east = east
         self.west = west
         self.col_head = col_head
-        self.col_name = col_name
         self.row_num = row_num
-        self.size = 0
-
-    def init_size(self):
-        count = 0
-        ref = self.south
-        while ref is not self:
-            if ref.key is '1':
-                count += 1
-            ref = ref.south
-        self.size = count
-        return count
+        self.weight = 1 if is_one(key) else 0
 
     def set_north(self, new_north):
         """ Helper function: set the node to the north, and set that nodes south to this"""
@@ -60,27 +58,51 @@ class Node():
     def __str__(self):
         return str(self.key)
 
+class HeaderNode(Node):
+    """ The head node of a column, and the root of the lattice.
+
+    :ivar col_name: the name of the column
+    :ivar size: the number of live ones in the column
+    """
+    __slots__ = ('col_name', 'size')
+
+    def __init__(self, col_name=None):
+        Node.__init__(self)
+        self.col_head = self
+        self.col_name = col_name
+        self.size = 0
+
+    def init_size(self):
+        count = 0
+        ref = self.south
+        while ref is not self:
+            count += ref.weight
+            ref = ref.south
+        self.size = count
+        return count
+
 class Lattice():
     """
 	A lattice data structure implementation.
   	:ivar matrix: the 2-dimensional array to be created into a lattice. The array can be of ANY type. the contents of the array become the keys of the Lattice
     :ivar col_names: the list of names where index i corresponds to column i
+    :ivar secondary: the indices of the columns that may be covered at most once instead of exactly once.
+        Their headers are left out of the header ring, so the search never branches on them
+    :ivar multiplicity: how many times every column has to be covered (at most, for the secondary ones), or None for once
     """
 
-    def __init__(self, matrix, col_names, delete_zeros=False):
+    def __init__(self, matrix, col_names, delete_zeros=False, secondary=(), multiplicity=None):
         assert matrix is not None
         assert matrix[0] is not None
         assert matrix[0][0] is not None
 
-        self.head = Node()
+        self.head = HeaderNode('head')
 
         lattice_node_matrix = [[]]
 
         # Insert the Column Headers
         for c in range(0, len(matrix[0])):
-            new_head = Node(col_name=col_names[c])
-            new_head.col_head = new_head
-            lattice_node_matrix[0].append(new_head)
+            lattice_node_matrix[0].append(HeaderNode(col_names[c]))
 
         # Initialize the LatticeNodes
         for r in range(0, len(matrix)):
@@ -111,28 +133,54 @@ class Lattice():
         self.head.set_west(lattice_node_matrix[0][-1])
         self.head.north = self.head
         self.head.south = self.head
-        self.head.col_head = self.head
-        self.head.col_name = 'head'
+        # Every header, covered or not, so the covered parts can still be found
+        self.columns = list(lattice_node_matrix[0])
+
+        self.secondary = []
+        for c in sorted(set(secondary)):
+            h = lattice_node_matrix[0][c]
+            h.west.east = h.east
+            h.east.west = h.west
+            h.east = h
+            h.west = h
+            self.secondary.append(h)
+        # header -> how many times the column has to be covered
+        self.multiplicity = None
+        if multiplicity is not None:
+            self.multiplicity = {}
+            for c in range(len(lattice_node_matrix[0])):
+                self.multiplicity[lattice_node_matrix[0][c]] = multiplicity[c]
 
         c = self.head.east
         while c is not self.head:
             c.init_size()
             c = c.east
+        for c in self.secondary:
+            c.init_size()
 
         if delete_zeros:
-            c = self.head.east
-            while c is not self.head:
+            for c in self.headers():
                 r = c.south
                 while r is not c:
-                    if r.key is not None and r.key is '0':
+                    if not is_one(r.key):
                         self.delete(r)
                     r = r.south
-                c = c.east
         
+    def headers(self):
+        """ Returns the live primary headers, in ring order, followed by the secondary ones """
+        headers = []
+        c = self.head.east
+        while c is not self.head:
+            headers.append(c)
+            c = c.east
+        return headers + self.secondary
+
     def delete(self, lattice_node):
         # Here you just have to make 2 new connections that skip over lattice_node
         lattice_node.east.set_west(lattice_node.west)
         lattice_node.north.set_south(lattice_node.south)
+        if lattice_node.col_head is not None:
+            lattice_node.col_head.size -= lattice_node.weight
         return lattice_node
 
     def restore(self, lattice_node):
@@ -141,49 +189,578 @@ class Lattice():
         lattice_node.west.set_east(lattice_node)
         lattice_node.north.set_south(lattice_node)
         lattice_node.south.set_north(lattice_node)
+        if lattice_node.col_head is not None:
+            lattice_node.col_head.size += lattice_node.weight
         return lattice_node
 
+    def nodes(self):
+        """
+        Returns the head, every header and every node of a row that is still linked into a
+        column ring or a row ring, covered ones included: a covered column keeps its own
+        vertical links, and the rows it hid keep their horizontal ones. Nodes removed with
+        delete() are not part of the lattice any more and are left out.
+        """
+        seen = set()
+        nodes = []
+        for h in [self.head] + self.columns:
+            seen.add(id(h))
+            nodes.append(h)
+        for h in self.columns:
+            r = h.south
+            while r is not h:
+                if id(r) not in seen:
+                    seen.add(id(r))
+                    nodes.append(r)
+                    j = r.east
+                    while j is not r:
+                        if id(j) not in seen:
+                            seen.add(id(j))
+                            nodes.append(j)
+                        j = j.east
+                r = r.south
+        return nodes
+
+    def snapshot(self):
+        """ Returns the links and sizes of every node, for reset() to put back after a search was interrupted """
+        return [(n, n.north, n.south, n.east, n.west, getattr(n, 'size', 0)) for n in self.nodes()]
+
+    def reset(self, snapshot):
+        """ Puts back the links and sizes saved by snapshot() """
+        for n, north, south, east, west, size in snapshot:
+            n.north = north
+            n.south = south
+            n.east = east
+            n.west = west
+            if isinstance(n, HeaderNode):
+                n.size = size
+
+    def clone(self):
+        """ Returns a copy of the lattice in its current state that shares no node with it """
+        nodes = self.nodes()
+        copies = {}
+        for n in nodes:
+            if isinstance(n, HeaderNode):
+                m = HeaderNode(n.col_name)
+                m.size = n.size
+            else:
+                m = Node(n.key, n.row_num)
+            copies[id(n)] = m
+        for n in nodes:
+            m = copies[id(n)]
+            m.north = copies.get(id(n.north))
+            m.south = copies.get(id(n.south))
+            m.east = copies.get(id(n.east))
+            m.west = copies.get(id(n.west))
+            m.col_head = copies.get(id(n.col_head))
+        clone = Lattice.__new__(Lattice)
+        clone.head = copies[id(self.head)]
+        clone.columns = [copies[id(h)] for h in self.columns]
+        clone.secondary = [copies[id(h)] for h in self.secondary]
+        clone.multiplicity = None
+        if self.multiplicity is not None:
+            clone.multiplicity = {}
+            for h in self.multiplicity:
+                clone.multiplicity[copies[id(h)]] = self.multiplicity[h]
+        return clone
+
+    def check_invariants(self):
+        """ Walks the live part of the lattice and raises an AssertionError if a link or a column size is off """
+        for c in self.headers():
+            if c.east.west is not c or c.west.east is not c:
+                raise AssertionError("Header %r is not linked both ways" % c.col_name)
+            count = 0
+            r = c.south
+            while r is not c:
+                if r.south.north is not r or r.north.south is not r:
+                    raise AssertionError("Row %r of column %r is not linked both ways" % (r.row_num, c.col_name))
+                if r.col_head is not c:
+                    raise AssertionError("Row %r of column %r has the wrong column head" % (r.row_num, c.col_name))
+                j = r.east
+                while j is not r:
+                    if j.east.west is not j:
+                        raise AssertionError("Row %r is not linked both ways" % r.row_num)
+                    j = j.east
+                count += r.weight
+                r = r.south
+            if count != c.size:
+                raise AssertionError("Column %r has size %d but %d live ones" % (c.col_name, c.size, count))
+
+    def export(self):
+        """ Returns the live columns and rows as a LatticeState, walking every live node once """
+        headers = self.headers()
+        rows = {}
+        for i in range(len(headers)):
+            c = headers[i]
+            r = c.south
+            while r is not c:
+                if r.weight:
+                    rows.setdefault(r.row_num, []).append(i)
+                r = r.south
+        row_ids = sorted(rows)
+        return LatticeState([h.col_name for h in headers], row_ids, [rows[r] for r in row_ids])
+
     def __str__(self):
-        # Printing solution that does not depend on rows or cols
-        res = ""
+        # Printing solution that does not depend on rows or cols. The parts are joined once
+        # at the end, so this takes time linear in the size of the lattice
+        rows = []
         i = 0
         row_ref = self.head.east
         while row_ref.col_name == None or i == 0:
-            res += "("
+            parts = []
             col_ref = row_ref
             j = 0
             while (col_ref is not row_ref or j == 0) and col_ref is not self.head:
                 if col_ref.key is not None:
-                    res += col_ref.key + ", "
+                    parts.append(str(col_ref.key))
                 elif col_ref.col_name is not None:
-                    res += col_ref.col_name + ", "
+                    parts.append(str(col_ref.col_name))
                 col_ref = col_ref.east
                 j += 1
-            res = res[:-2]
+            rows.append("(" + ", ".join(parts) + ")")
             i += 1
             row_ref = row_ref.south
-            res += "), "
-        res = res[:-2]
-        return res
-        # res = ""
-        # c = self.head.east
-        # cs = {}
-        # res += "("
-        # while c is not self.head:
-        #     res += c.col_name + ", "
-        #     cs[c.col_name] = []
-        #     r = c.south
-        #     while r is not c:
-        #         cs[c.col_name].append(r.key)
-        #         r = r.south
-        #     c = c.east
-        # res = res[:-2] + ")\n"
-        # for i in cs.keys():
-        #     res += "[" + i + "]: "
-        #     for j in cs[i]:
-        #         res += j + ", "
-        #     res = res[:-2] + "\n"
-        # return res
+        return ", ".join(rows)
+
+class LatticeState():
+    """
+    A copy of the live part of a lattice, see export(): the columns still to cover and the
+    rows that can still be chosen. Two states compare equal when they hold the same
+    columns and rows, so states can be logged and compared during a search.
+    :ivar col_names: the names of the live columns, primary ones in search order first
+    :ivar row_ids: the id of every live row, in increasing order
+    :ivar rows: for every live row, the indices into col_names of its ones
+    """
+    def __init__(self, col_names, row_ids, rows):
+        self.col_names = col_names
+        self.row_ids = row_ids
+        self.rows = rows
+
+    def matrix(self):
+        """ Returns the live rows as a dense 0/1 numpy array of shape (rows, columns) """
+        matrix = np.zeros((len(self.rows), len(self.col_names)), dtype=np.uint8)
+        if self.rows:
+            lengths = [len(r) for r in self.rows]
+            matrix[np.repeat(np.arange(len(self.rows)), lengths), np.concatenate(self.rows).astype(np.int64)] = 1
+        return matrix
+
+    def __eq__(self, other):
+        return (isinstance(other, LatticeState) and self.col_names == other.col_names and
+                self.row_ids == other.row_ids and [sorted(r) for r in self.rows] == [sorted(r) for r in other.rows])
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __str__(self):
+        lines = ['columns: ' + ', '.join(str(n) for n in self.col_names)]
+        for k in range(len(self.rows)):
+            lines.append('%s: %s' % (self.row_ids[k], ', '.join(str(self.col_names[c]) for c in self.rows[k])))
+        return '\n'.join(lines)
+
+class RowArrays():
+    """
+    The rows of a compressed sparse row matrix, read from its arrays one at a time, so the
+    arrays can stay memory-mapped. Row i is the list of the column indices
+    indices[indptr[i]:indptr[i + 1]]. See SparseLattice.from_arrays.
+    :ivar indptr: where every row starts in indices, and where the last one ends
+    :ivar indices: the column indices of all the rows, one row after the other
+    """
+    def __init__(self, indptr, indices):
+        self.indptr = indptr
+        self.indices = indices
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError("Row %r is out of range for %d rows" % (i, len(self)))
+        return self.indices[int(self.indptr[i]):int(self.indptr[i + 1])].tolist()
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+class SparseLattice():
+    """
+    An array-backed lattice built only from the ones of a sparse matrix.
+
+    Node 0 is the root, nodes 1..n are the column headers and every node after that
+    is a one of the matrix. The links are stored in parallel lists of ints, the way
+    Knuth's DLX stores them, so building and holding the lattice costs O(number of ones).
+    Secondary columns are left out of the header ring: the search never branches on them,
+    so they end up covered at most once and a row without a primary column is never chosen. With multiplicities a column has to be covered
+    that many times (at most, for a secondary one) and need[h] counts down what is left.
+    :ivar rows: the rows of the matrix, each one a list of the column indices that hold a one
+    :ivar col_names: the list of names where index i corresponds to column i
+    :ivar secondary: the indices of the columns that may be covered at most once instead of exactly once
+    :ivar multiplicity: how many times every column has to be covered, or None for once
+    """
+
+    def __init__(self, rows, col_names, secondary=(), multiplicity=None):
+        assert col_names is not None
+
+        num_cols = len(col_names)
+        self.col_names = list(col_names)
+        self.num_rows = 0
+        # The first node of every row, by row id
+        self.row_start = {}
+
+        # The root and the column headers
+        self.up = list(range(num_cols + 1))
+        self.down = list(range(num_cols + 1))
+        self.left = [num_cols] + list(range(num_cols))
+        self.right = list(range(1, num_cols + 1)) + [0]
+        self.col = list(range(num_cols + 1))
+        self.row = [-1] * (num_cols + 1)
+        self.size = [0] * (num_cols + 1)
+
+        self.secondary = sorted(set(secondary))
+        for c in self.secondary:
+            if c < 0 or c >= num_cols:
+                raise ValueError("Column index %r is out of range for %d columns" % (c, num_cols))
+            h = c + 1
+            self.right[self.left[h]] = self.right[h]
+            self.left[self.right[h]] = self.left[h]
+            self.left[h] = h
+            self.right[h] = h
+
+        self.multiplicity = None
+        self.need = None
+        if multiplicity is not None:
+            if len(multiplicity) != num_cols or min(multiplicity) < 1:
+                raise ValueError("Expected a multiplicity of at least 1 for each of the %d columns" % num_cols)
+            self.multiplicity = list(multiplicity)
+            self.need = [0] + self.multiplicity
+
+        for row in rows:
+            self.append_row(row)
+
+    def append_row(self, row, row_id=None):
+        """ Appends a row given as a list of column indices and returns its row id """
+        up, down, left, right, col = self.up, self.down, self.left, self.right, self.col
+        num_cols = len(self.col_names)
+        if row_id is None:
+            row_id = self.num_rows
+        first = len(up)
+        for c in row:
+            if c < 0 or c >= num_cols:
+                raise ValueError("Column index %r is out of range for %d columns" % (c, num_cols))
+            h = c + 1
+            x = len(up)
+            up.append(up[h])
+            down.append(h)
+            down[up[h]] = x
+            up[h] = x
+            left.append(x - 1)
+            right.append(x + 1)
+            col.append(h)
+            self.row.append(row_id)
+            self.size[h] += 1
+        last = len(up) - 1
+        if last >= first:
+            left[first] = last
+            right[last] = first
+            self.row_start[row_id] = first
+        self.num_rows += 1
+        return row_id
+
+    @classmethod
+    def from_matrix(cls, matrix, col_names, secondary=(), multiplicity=None):
+        """ Builds a sparse lattice from a dense matrix, keeping every cell that is not 0 """
+        rows = []
+        for r in matrix:
+            rows.append([c for c, key in enumerate(r) if is_one(key)])
+        return cls(rows, col_names, secondary, multiplicity)
+
+    @classmethod
+    def from_arrays(cls, indptr, indices, col_names, secondary=(), multiplicity=None):
+        """
+        Builds a sparse lattice from the two arrays of a compressed sparse row matrix, row i
+        holding the columns indices[indptr[i]:indptr[i + 1]]. The links are worked out on the
+        arrays as a whole, so memory-mapped arrays are never turned into rows of lists.
+        """
+        sparse = cls([], col_names, secondary, multiplicity)
+        n = len(sparse.col_names)
+        indptr = np.asarray(indptr, dtype=np.int64)
+        indices = np.asarray(indices, dtype=np.int64)
+        num_rows = len(indptr) - 1
+        if len(indices) and (indices.min() < 0 or indices.max() >= n):
+            bad = indices[(indices < 0) | (indices >= n)][0]
+            raise ValueError("Column index %r is out of range for %d columns" % (int(bad), n))
+        nodes = np.arange(n + 1, n + 1 + len(indices))
+        lengths = np.diff(indptr)
+        first = indptr[:-1] + n + 1
+        last = indptr[1:] + n
+        rows = np.repeat(np.arange(num_rows), lengths)
+
+        # Every row is a ring of its nodes
+        right = nodes + 1
+        left = nodes - 1
+        full = lengths > 0
+        right[last[full] - n - 1] = first[full]
+        left[first[full] - n - 1] = last[full]
+
+        # Every column is a ring of its header and its nodes, in row order
+        heads = indices + 1
+        order = np.argsort(indices, kind='stable')
+        ordered = nodes[order]
+        ordered_heads = heads[order]
+        up = np.arange(n + 1 + len(indices))
+        down = up.copy()
+        same = ordered_heads[1:] == ordered_heads[:-1]
+        down[ordered[:-1][same]] = ordered[1:][same]
+        up[ordered[1:][same]] = ordered[:-1][same]
+        if len(ordered):
+            starts = np.concatenate(([True], ~same))
+            ends = np.concatenate((~same, [True]))
+            down[ordered_heads[starts]] = ordered[starts]
+            up[ordered[starts]] = ordered_heads[starts]
+            up[ordered_heads[ends]] = ordered[ends]
+            down[ordered[ends]] = ordered_heads[ends]
+
+        sparse.up = up.tolist()
+        sparse.down = down.tolist()
+        sparse.left += left.tolist()
+        sparse.right += right.tolist()
+        sparse.col += heads.tolist()
+        sparse.row += rows.tolist()
+        sparse.size = [0] + np.bincount(indices, minlength=n).tolist()
+        sparse.row_start = dict(zip(np.arange(num_rows)[full].tolist(), first[full].tolist()))
+        sparse.num_rows = num_rows
+        return sparse
+
+    @classmethod
+    def from_lattice(cls, lattice):
+        """ Builds a sparse lattice from the live ones of a Lattice. Every row keeps its row_num as its row id """
+        headers = lattice.headers()
+        index = {}
+        for i in range(len(headers)):
+            index[headers[i]] = i
+
+        rows = {}
+        for h in headers:
+            r = h.south
+            while r is not h:
+                # Nodes kept for zeros (without delete_zeros) are not ones of the row
+                if r.weight and r.row_num not in rows:
+                    cols = [index[r.col_head]]
+                    j = r.east
+                    while j is not r:
+                        if j.weight:
+                            cols.append(index[j.col_head])
+                        j = j.east
+                    rows[r.row_num] = cols
+                r = r.south
+
+        num_primary = len(headers) - len(lattice.secondary)
+        multiplicity = None
+        if lattice.multiplicity is not None:
+            multiplicity = [lattice.multiplicity[h] for h in headers]
+        sparse = cls([], [h.col_name for h in headers], range(num_primary, len(headers)), multiplicity)
+        for row_num in sorted(rows):
+            sparse.append_row(rows[row_num], row_num)
+        return sparse
+
+    @property
+    def num_nodes(self):
+        return len(self.up) - len(self.col_names) - 1
+
+    def cover(self, c):
+        """ Removes header node c from the header list and every row that has a one in it """
+        up, down, left, right, col, size = self.up, self.down, self.left, self.right, self.col, self.size
+        right[left[c]] = right[c]
+        left[right[c]] = left[c]
+        i = down[c]
+        while i != c:
+            j = right[i]
+            while j != i:
+                u = up[j]
+                d = down[j]
+                down[u] = d
+                up[d] = u
+                size[col[j]] -= 1
+                j = right[j]
+            i = down[i]
+
+    def uncover(self, c):
+        """ Exactly undoes cover(c) """
+        up, down, left, right, col, size = self.up, self.down, self.left, self.right, self.col, self.size
+        i = up[c]
+        while i != c:
+            j = left[i]
+            while j != i:
+                size[col[j]] += 1
+                down[up[j]] = j
+                up[down[j]] = j
+                j = left[j]
+            i = up[i]
+        right[left[c]] = c
+        left[right[c]] = c
+
+    def check_invariants(self):
+        """ Walks the live part of the lattice and raises an AssertionError if a link or a column size is off """
+        up, down, left, right, col, size = self.up, self.down, self.left, self.right, self.col, self.size
+        headers = []
+        c = right[0]
+        while c != 0:
+            headers.append(c)
+            c = right[c]
+        for c in headers + [h + 1 for h in self.secondary]:
+            if left[right[c]] != c or right[left[c]] != c:
+                raise AssertionError("Header %r is not linked both ways" % self.col_names[c - 1])
+            count = 0
+            r = down[c]
+            while r != c:
+                if up[down[r]] != r or down[up[r]] != r:
+                    raise AssertionError("Row %r of column %r is not linked both ways" % (self.row[r], self.col_names[c - 1]))
+                if col[r] != c:
+                    raise AssertionError("Row %r of column %r has the wrong column" % (self.row[r], self.col_names[c - 1]))
+                j = right[r]
+                while j != r:
+                    if left[right[j]] != j:
+                        raise AssertionError("Row %r is not linked both ways" % self.row[r])
+                    j = right[j]
+                count += 1
+                r = down[r]
+            if count != size[c]:
+                raise AssertionError("Column %r has size %d but %d live ones" % (self.col_names[c - 1], size[c], count))
+
+    def snapshot(self):
+        """
+        Returns a copy of the links and column sizes, for reset() to put back after a search
+        was interrupted. Every list is copied flat, so this costs O(number of ones).
+        """
+        need = None if self.need is None else self.need[:]
+        return (self.up[:], self.down[:], self.left[:], self.right[:], self.size[:], need)
+
+    def reset(self, snapshot):
+        """ Puts back the links and sizes saved by snapshot(), in place """
+        up, down, left, right, size, need = snapshot
+        if len(up) != len(self.up):
+            raise ValueError("The snapshot has %d nodes, the lattice %d" % (len(up) - len(self.size), self.num_nodes))
+        self.up[:] = up
+        self.down[:] = down
+        self.left[:] = left
+        self.right[:] = right
+        self.size[:] = size
+        if need is not None:
+            self.need[:] = need
+
+    def clone(self):
+        """ Returns a copy of the lattice in its current state, for another search to run on at the same time """
+        clone = SparseLattice.__new__(SparseLattice)
+        clone.__dict__.update(self.__dict__)
+        for name in ('up', 'down', 'left', 'right', 'col', 'row', 'size', 'col_names', 'secondary'):
+            setattr(clone, name, getattr(self, name)[:])
+        clone.row_start = dict(self.row_start)
+        if self.need is not None:
+            clone.multiplicity = self.multiplicity[:]
+            clone.need = self.need[:]
+        return clone
+
+    def export(self):
+        """ Returns the live columns and rows as a LatticeState, walking every live node once """
+        down, right, row = self.down, self.right, self.row
+        headers = []
+        c = right[0]
+        while c != 0:
+            headers.append(c)
+            c = right[c]
+        headers += [h + 1 for h in self.secondary]
+        rows = {}
+        for i in range(len(headers)):
+            c = headers[i]
+            r = down[c]
+            while r != c:
+                rows.setdefault(row[r], []).append(i)
+                r = down[r]
+        row_ids = sorted(rows)
+        return LatticeState([self.col_names[h - 1] for h in headers], row_ids, [rows[r] for r in row_ids])
+
+    def select(self, row_id):
+        """ Covers every column of a row, as if the search had chosen it """
+        x = self.row_start[row_id]
+        self.cover(self.col[x])
+        j = self.right[x]
+        while j != x:
+            self.cover(self.col[j])
+            j = self.right[j]
+
+    def unselect(self, row_id):
+        """ Exactly undoes select(row_id) """
+        x = self.row_start[row_id]
+        j = self.left[x]
+        while j != x:
+            self.uncover(self.col[j])
+            j = self.left[j]
+        self.uncover(self.col[x])
+
+    def hide(self, x):
+        """ Unlinks every node of the row of node x from its column """
+        up, down, right, col, size = self.up, self.down, self.right, self.col, self.size
+        j = x
+        while True:
+            u = up[j]
+            d = down[j]
+            down[u] = d
+            up[d] = u
+            size[col[j]] -= 1
+            j = right[j]
+            if j == x:
+                break
+
+    def unhide(self, x):
+        """ Exactly undoes hide(x) """
+        up, down, left, col, size = self.up, self.down, self.left, self.col, self.size
+        j = left[x]
+        while True:
+            size[col[j]] += 1
+            down[up[j]] = j
+            up[down[j]] = j
+            if j == x:
+                break
+            j = left[j]
+
+    def take(self, x):
+        """
+        Chooses the row of node x when the columns have multiplicities: the row is hidden, so
+        it is used at most once, and every column it fills up is covered.
+        """
+        right, col, need = self.right, self.col, self.need
+        self.hide(x)
+        j = x
+        while True:
+            h = col[j]
+            need[h] -= 1
+            if need[h] == 0:
+                self.cover(h)
+            j = right[j]
+            if j == x:
+                break
+
+    def untake(self, x):
+        """ Undoes take(x) but leaves the row hidden, so the search can try the rows after it """
+        left, col, need = self.left, self.col, self.need
+        j = left[x]
+        while True:
+            h = col[j]
+            if need[h] == 0:
+                self.uncover(h)
+            need[h] += 1
+            if j == x:
+                break
+            j = left[j]
+
+    def row_cols(self, x):
+        """ Returns the column indices of the row that node x belongs to, starting at x """
+        cols = [self.col[x] - 1]
+        j = self.right[x]
+        while j != x:
+            cols.append(self.col[j] - 1)
+            j = self.right[j]
+        return cols
 
 class LatticeNode_UnitTest(unittest.TestCase):
     def test_trivial_north(self):
@@ -214,6 +791,17 @@ class LatticeNode_UnitTest(unittest.TestCase):
         self.assertEqual(ancor_node.west, west_node)
         self.assertEqual(west_node.east, ancor_node)
 
+    def test_slots(self):
+        node = Node('1', 2)
+        head = HeaderNode('a')
+        self.assertFalse(hasattr(node, '__dict__'))
+        self.assertFalse(hasattr(head, '__dict__'))
+        self.assertIsNone(node.col_name)
+        self.assertFalse(hasattr(node, 'size'))
+        self.assertEqual(('a', 0, 0), (head.col_name, head.size, head.weight))
+        self.assertIs(head, head.col_head)
+        self.assertEqual((1, 0), (node.weight, Node('0').weight))
+
 class Lattice_UnitTest(unittest.TestCase):
     def test_constructor(self):
         """Tests on a simple 3x3 lattice where each key is a character unique to the lattice""" 
@@ -395,6 +983,106 @@ class Lattice_UnitTest(unittest.TestCase):
         second_col = lattice.head.east.east
         self.assertEqual(2, second_col.size)
 
+    def test_col_size_int_keys(self):
+        matrix = [[0, 1, 0],
+                  [0, 1, 1],
+                  [1, 0, 0]]
+        lattice = Lattice(matrix, ['1', '2', '3'])
+        self.assertEqual([1, 2, 1], [lattice.head.east.size, lattice.head.east.east.size, lattice.head.west.size])
+        lattice.check_invariants()
+
+    def test_delete_size(self):
+        col_names = ['a', 'b', 'c']
+        matrix = [['0', '1', '1'],
+                  ['1', '0', '0'],
+                  ['1', '1', '1']]
+        lattice = Lattice(matrix, col_names, delete_zeros=True)
+        lattice.check_invariants()
+        b = lattice.head.east.east
+        node = lattice.delete(b.south)
+        self.assertEqual(1, b.size)
+        lattice.check_invariants()
+        lattice.restore(node)
+        self.assertEqual(2, b.size)
+
+    def test_check_invariants(self):
+        matrix = [['0', '1', '1'],
+                  ['1', '0', '0']]
+        lattice = Lattice(matrix, ['a', 'b', 'c'], delete_zeros=True)
+        lattice.head.east.size = 5
+        with self.assertRaises(AssertionError):
+            lattice.check_invariants()
+
+    def test_snapshot_reset(self):
+        matrix = [['0', '1', '1'],
+                  ['1', '0', '0'],
+                  ['1', '0', '1']]
+        lattice = Lattice(matrix, ['a', 'b', 'c'], delete_zeros=True)
+        before = str(lattice)
+        snapshot = lattice.snapshot()
+        c = lattice.head.east
+        lattice.delete(c)
+        lattice.delete(c.south)
+        lattice.head.east.size = 7
+        lattice.reset(snapshot)
+        self.assertEqual(before, str(lattice))
+        lattice.check_invariants()
+
+    def test_clone(self):
+        matrix = [['0', '1', '1'],
+                  ['1', '0', '0']]
+        lattice = Lattice(matrix, ['a', 'b', 'c'], delete_zeros=True, secondary=[2], multiplicity=[1, 1, 2])
+        clone = lattice.clone()
+        self.assertEqual(str(lattice), str(clone))
+        self.assertEqual(['a', 'b', 'c'], [h.col_name for h in clone.headers()])
+        self.assertEqual([1, 1, 2], [clone.multiplicity[h] for h in clone.headers()])
+        clone.delete(clone.head.east)
+        clone.check_invariants()
+        lattice.check_invariants()
+        self.assertEqual('a', lattice.head.east.col_name)
+        self.assertEqual(1, lattice.head.east.size)
+
+    def test_export(self):
+        matrix = [['0', '1', '1'],
+                  ['1', '0', '0'],
+                  ['1', '0', '1'],
+                  ['0', '1', '0']]
+        lattice = Lattice(matrix, ['a', 'b', 'c'], delete_zeros=True)
+        self.assertEqual(Lattice(matrix, ['a', 'b', 'c']).export(), lattice.export())
+        state = lattice.export()
+        self.assertEqual(['a', 'b', 'c'], state.col_names)
+        self.assertEqual([1, 2, 3, 4], state.row_ids)
+        self.assertEqual(np.array(matrix, dtype=int).tolist(), state.matrix().tolist())
+        self.assertEqual(SparseLattice.from_matrix(matrix, ['a', 'b', 'c']).export().matrix().tolist(), state.matrix().tolist())
+
+        # Cover a by hand: rows 2 and 3 go with it
+        c = lattice.head.east
+        c.east.set_west(c.west)
+        r = c.south
+        while r is not c:
+            j = r.east
+            while j is not r:
+                j.north.set_south(j.south)
+                j.col_head.size -= j.weight
+                j = j.east
+            r = r.south
+        state = lattice.export()
+        self.assertEqual(['b', 'c'], state.col_names)
+        self.assertEqual([1, 4], state.row_ids)
+        self.assertEqual([[1, 1], [1, 0]], state.matrix().tolist())
+        self.assertEqual('columns: b, c\n1: b, c\n4: b', str(state))
+
+    def test_str_int_keys(self):
+        lattice = Lattice([[0, 1, 1], [1, 0, 0]], [12, 13, 14])
+        self.assertEqual("(12, 13, 14), (0, 1, 1), (1, 0, 0)", str(lattice))
+
+    def test_str_large(self):
+        matrix = [[str((r + c) % 2) for c in range(200)] for r in range(400)]
+        lattice = Lattice(matrix, [str(c) for c in range(200)])
+        text = str(lattice)
+        self.assertEqual(401, text.count('('))
+        self.assertTrue(text.startswith('(0, 1, 2,'))
+
     def test_south_north(self):
         col_names = ['a', 'b', 'c']
         matrix = [['0', '1', '1'],
@@ -404,6 +1092,191 @@ class Lattice_UnitTest(unittest.TestCase):
         b1 = lattice.head.east.east.south
         self.assertEqual(b1, b1.south.north)
 
+class SparseLattice_UnitTest(unittest.TestCase):
+    def test_only_ones_are_nodes(self):
+        rows = [[1, 2], [0], [0, 2], [1]]
+        lattice = SparseLattice(rows, ['a', 'b', 'c'])
+        self.assertEqual(6, lattice.num_nodes)
+        self.assertEqual(4, lattice.num_rows)
+        self.assertEqual([0, 2, 2, 2], lattice.size)
+
+    def test_from_matrix(self):
+        matrix = [['0', '1', '1'],
+                  ['1', '0', '0'],
+                  ['1', '0', '1'],
+                  ['0', '1', '0']]
+        lattice = SparseLattice.from_matrix(matrix, ['a', 'b', 'c'])
+        self.assertEqual(6, lattice.num_nodes)
+        self.assertEqual([1, 2], lattice.row_cols(4))
+        self.assertEqual([0, 2], lattice.row_cols(7))
+
+    def test_links(self):
+        lattice = SparseLattice([[0, 2], [1, 2]], ['a', 'b', 'c'])
+        # Headers are 1..3, the ones are 4..7
+        self.assertEqual([1, 2, 3, 0], [lattice.right[h] for h in range(4)])
+        self.assertEqual(5, lattice.right[4])
+        self.assertEqual(4, lattice.left[4 + 1])
+        self.assertEqual(4, lattice.right[5])
+        self.assertEqual(7, lattice.down[5])
+        self.assertEqual(3, lattice.down[7])
+        self.assertEqual(7, lattice.up[3])
+        self.assertEqual([-1, -1, -1, -1, 0, 0, 1, 1], lattice.row)
+
+    def test_select_unselect(self):
+        lattice = SparseLattice([[1, 2], [0], [0, 2], [1]], ['a', 'b', 'c'])
+        links = (lattice.up[:], lattice.down[:], lattice.left[:], lattice.right[:], lattice.size[:])
+        lattice.select(2)
+        self.assertEqual(2, lattice.right[0])
+        self.assertEqual(0, lattice.right[2])
+        self.assertEqual(1, lattice.size[2])
+        lattice.unselect(2)
+        self.assertEqual(links, (lattice.up, lattice.down, lattice.left, lattice.right, lattice.size))
+
+    def test_check_invariants(self):
+        lattice = SparseLattice([[1, 2], [0], [0, 2], [1]], ['a', 'b', 'c'])
+        lattice.check_invariants()
+        lattice.cover(1)
+        lattice.check_invariants()
+        lattice.size[3] += 1
+        with self.assertRaises(AssertionError):
+            lattice.check_invariants()
+
+    def test_row_cols(self):
+        lattice = SparseLattice([[0, 2], [1, 2]], ['a', 'b', 'c'])
+        self.assertEqual([2, 1], lattice.row_cols(7))
+
+    def test_from_arrays(self):
+        rows = [[1, 2], [], [0], [0, 2], [1]]
+        indptr = np.array([0, 2, 2, 3, 5, 6])
+        indices = np.array([1, 2, 0, 0, 2, 1], dtype=np.int32)
+        self.assertEqual(rows, list(RowArrays(indptr, indices)))
+        self.assertEqual([1], RowArrays(indptr, indices)[-1])
+        for secondary in [(), [2]]:
+            expected = SparseLattice(rows, ['a', 'b', 'c'], secondary)
+            lattice = SparseLattice.from_arrays(indptr, indices, ['a', 'b', 'c'], secondary)
+            lattice.check_invariants()
+            for name in ('up', 'down', 'left', 'right', 'col', 'row', 'size', 'row_start', 'num_rows', 'secondary'):
+                self.assertEqual(getattr(expected, name), getattr(lattice, name))
+        with self.assertRaises(ValueError):
+            SparseLattice.from_arrays(indptr, indices, ['a', 'b'])
+
+    def test_from_lattice(self):
+        matrix = [['0', '1', '1'],
+                  ['1', '0', '0'],
+                  ['1', '0', '1'],
+                  ['0', '1', '0']]
+        lattice = Lattice(matrix, ['a', 'b', 'c'], delete_zeros=True)
+        sparse = SparseLattice.from_lattice(lattice)
+        self.assertEqual(['a', 'b', 'c'], sparse.col_names)
+        self.assertEqual(6, sparse.num_nodes)
+        self.assertEqual([-1, -1, -1, -1, 1, 1, 2, 3, 3, 4], sparse.row)
+
+    def test_bad_column(self):
+        with self.assertRaises(ValueError):
+            SparseLattice([[0, 3]], ['a', 'b', 'c'])
+
+    def test_export(self):
+        lattice = SparseLattice([[1, 2], [0], [0, 2], [1]], ['a', 'b', 'c'], secondary=[2])
+        before = lattice.export()
+        self.assertEqual(['a', 'b', 'c'], before.col_names)
+        self.assertEqual([[0, 1, 1], [1, 0, 0], [1, 0, 1], [0, 1, 0]], before.matrix().tolist())
+        lattice.select(1)
+        state = lattice.export()
+        self.assertEqual(['b', 'c'], state.col_names)
+        self.assertEqual([0, 3], state.row_ids)
+        self.assertEqual([[1, 1], [1, 0]], state.matrix().tolist())
+        self.assertNotEqual(before, state)
+        lattice.unselect(1)
+        self.assertEqual(before, lattice.export())
+        self.assertEqual((0, 0), LatticeState([], [], []).matrix().shape)
+
+    def test_snapshot_reset(self):
+        lattice = SparseLattice([[1, 2], [0], [0, 2], [1]], ['a', 'b', 'c'], multiplicity=[1, 2, 1])
+        links = (lattice.up[:], lattice.down[:], lattice.left[:], lattice.right[:], lattice.size[:], lattice.need[:])
+        snapshot = lattice.snapshot()
+        up = lattice.up
+        lattice.take(lattice.row_start[2])
+        lattice.cover(2)
+        lattice.reset(snapshot)
+        self.assertIs(up, lattice.up)
+        self.assertEqual(links, (lattice.up, lattice.down, lattice.left, lattice.right, lattice.size, lattice.need))
+        lattice.check_invariants()
+        lattice.append_row([0])
+        with self.assertRaises(ValueError):
+            lattice.reset(snapshot)
+
+    def test_clone(self):
+        lattice = SparseLattice([[1, 2], [0], [0, 2], [1]], ['a', 'b', 'c'], secondary=[2])
+        lattice.select(1)
+        clone = lattice.clone()
+        self.assertEqual((lattice.up, lattice.right, lattice.size, lattice.secondary), (clone.up, clone.right, clone.size, clone.secondary))
+        clone.unselect(1)
+        clone.select(0)
+        clone.check_invariants()
+        lattice.check_invariants()
+        self.assertEqual(2, lattice.right[0])
+        self.assertEqual(1, clone.right[0])
+        lattice.unselect(1)
+        clone.unselect(0)
+        self.assertEqual((lattice.up, lattice.down, lattice.left, lattice.right, lattice.size), (clone.up, clone.down, clone.left, clone.right, clone.size))
+
+    def test_secondary(self):
+        lattice = SparseLattice([[0, 2], [1, 2], [0], [1]], ['a', 'b', 'c'], secondary=[2])
+        self.assertEqual([1, 2, 0], [lattice.right[h] for h in range(3)])
+        self.assertEqual((3, 3), (lattice.left[3], lattice.right[3]))
+        self.assertEqual(2, lattice.size[3])
+        lattice.check_invariants()
+        lattice.cover(3)
+        self.assertEqual([0, 1, 1, 2], lattice.size)
+        lattice.check_invariants()
+        lattice.uncover(3)
+        self.assertEqual([0, 2, 2, 2], lattice.size)
+        with self.assertRaises(ValueError):
+            SparseLattice([[0]], ['a'], secondary=[1])
+
+    def test_take_untake(self):
+        lattice = SparseLattice([[0], [0], [0, 1], [1]], ['a', 'b'], multiplicity=[2, 1])
+        links = (lattice.up[:], lattice.down[:], lattice.left[:], lattice.right[:], lattice.size[:])
+        x = lattice.row_start[2]
+        lattice.take(x)
+        # b is filled up and covered, a needs one more row and has rows 0 and 1 left
+        self.assertEqual([0, 1, 0], lattice.need)
+        self.assertEqual(1, lattice.right[0])
+        self.assertEqual(2, lattice.size[1])
+        lattice.check_invariants()
+        lattice.untake(x)
+        self.assertEqual([0, 2, 1], lattice.need)
+        self.assertEqual(1, lattice.size[2])
+        lattice.unhide(x)
+        self.assertEqual(links, (lattice.up, lattice.down, lattice.left, lattice.right, lattice.size))
+        with self.assertRaises(ValueError):
+            SparseLattice([[0]], ['a', 'b'], multiplicity=[1])
+
+    def test_lattice_secondary(self):
+        matrix = [[1, 0, 1],
+                  [0, 1, 1]]
+        lattice = Lattice(matrix, ['a', 'b', 'c'], delete_zeros=True, secondary=[2], multiplicity=[1, 1, 2])
+        self.assertEqual(['a', 'b', 'c'], [h.col_name for h in lattice.headers()])
+        self.assertIs(lattice.head.west, lattice.head.east.east)
+        lattice.check_invariants()
+        self.assertEqual(2, lattice.secondary[0].size)
+        sparse = SparseLattice.from_lattice(lattice)
+        self.assertEqual([2], sparse.secondary)
+        self.assertEqual([1, 1, 2], sparse.multiplicity)
+        sparse.check_invariants()
+
+    def test_cover_uncover(self):
+        lattice = SparseLattice([[1, 2], [0], [0, 2], [1]], ['a', 'b', 'c'])
+        links = (lattice.up[:], lattice.down[:], lattice.left[:], lattice.right[:], lattice.size[:])
+        lattice.cover(1)
+        self.assertEqual(2, lattice.right[0])
+        self.assertEqual(1, lattice.size[3])
+        lattice.cover(3)
+        self.assertEqual(1, lattice.size[2])
+        lattice.uncover(3)
+        lattice.uncover(1)
+        self.assertEqual(links, (lattice.up, lattice.down, lattice.left, lattice.right, lattice.size))
+
 def main():
     unittest.main()
 
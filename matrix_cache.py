@@ -0,0 +1,290 @@
+import unittest
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+from polyomino import CACHE_DIR
+from lattice import SparseLattice, RowArrays
+from exact_cover import count_exact_cover_solutions, iter_exact_cover_solutions
+from pentomino import board_mask, decode_placements, PentomintoShape, generate_all_placements, generate_col_names, get_base_shapes, region_filter, BoardSymmetry
+from preprocess import Reduction, reduce_matrix
+
+# Bumped whenever the way a matrix is generated changes, so old entries are never used
+FORMAT_VERSION = 3
+
+def make_key(**parts):
+    """ The content address of an entry: a hash of everything the matrix is built from """
+    parts['format'] = FORMAT_VERSION
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+def rows_to_arrays(rows, name='rows'):
+    """ Packs sparse rows into the two arrays of a compressed sparse row matrix """
+    indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(r) for r in rows])
+    indices = np.array([c for r in rows for c in r], dtype=np.int32)
+    return {name + '_indptr': indptr, name + '_indices': indices}
+
+def arrays_to_rows(arrays, name='rows'):
+    """ Unpacks the rows packed by rows_to_arrays into lists of column indices """
+    indptr = arrays[name + '_indptr']
+    indices = arrays[name + '_indices'].tolist()
+    bounds = indptr.tolist()
+    return [indices[bounds[i]:bounds[i + 1]] for i in range(len(bounds) - 1)]
+
+class MatrixCache():
+    """
+    An on-disk cache of generated exact cover matrices. Every entry is a directory named
+    by its key, holding .npy arrays that are memory-mapped when loaded and a meta.json.
+    Loading an entry marks it as used, and storing one evicts the least recently used
+    entries until the cache fits in max_bytes.
+    :ivar cache_dir: the directory the entries are kept in
+    :ivar max_bytes: the most the entries may take on disk together
+    """
+    def __init__(self, cache_dir=os.path.join(CACHE_DIR, 'matrices'), max_bytes=256 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def load(self, key):
+        """ Returns the (arrays, meta) of an entry, or None if it is not cached """
+        path = self._path(key)
+        try:
+            with open(os.path.join(path, 'meta.json')) as f:
+                meta = json.load(f)
+            arrays = {}
+            for name in meta['arrays']:
+                arrays[name] = np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+            os.utime(os.path.join(path, 'meta.json'))
+        except (IOError, OSError, ValueError):
+            # Also when another process evicts the entry while it is read
+            return None
+        return arrays, meta['meta']
+
+    def store(self, key, arrays, meta):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Written to a directory of its own first, so a reader never sees half an entry
+        tmp = tempfile.mkdtemp(dir=self.cache_dir, prefix='.tmp-')
+        for name in arrays:
+            np.save(os.path.join(tmp, name + '.npy'), arrays[name])
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump({'arrays': sorted(arrays), 'meta': meta}, f)
+        try:
+            os.rename(tmp, self._path(key))
+        except OSError:
+            # Another process stored the same entry first
+            shutil.rmtree(tmp)
+        self.evict()
+
+    def get_or_build(self, key, build):
+        """ Loads an entry, or calls build() for its (arrays, meta) and stores them first """
+        entry = self.load(key)
+        if entry is None:
+            arrays, meta = build()
+            self.store(key, arrays, meta)
+            entry = self.load(key)
+            if entry is None:
+                # The cache is too small to keep the entry
+                entry = arrays, meta
+        return entry
+
+    def entries(self):
+        """ Returns (last use, bytes, key) of every entry, the least recently used first """
+        entries = []
+        if not os.path.isdir(self.cache_dir):
+            return entries
+        for key in os.listdir(self.cache_dir):
+            path = self._path(key)
+            meta = os.path.join(path, 'meta.json')
+            if key.startswith('.') or not os.path.exists(meta):
+                continue
+            size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+            entries.append((os.path.getmtime(meta), size, key))
+        return sorted(entries)
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for used, size, key in entries)
+        for used, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(self._path(key), ignore_errors=True)
+            total -= size
+
+def pentomino_matrix(shapes=None, board_shape=(6,10), num_shapes=12, symmetry=False, reduce=False, cache=None):
+    """
+    Returns (placements, col_names, reduction, board_symmetry) for a piece set on a board,
+    generating them only when they are not in the cache yet. placements is a RowArrays on
+    the cached arrays, see SparseLattice.from_arrays. reduction is None without reduce, else
+    the Reduction whose rows are the ones to search (see preprocess.py). The shape columns
+    of the pieces that are not in shapes are secondary in the reduction. board_symmetry is
+    None without symmetry, else the BoardSymmetry the placements were restricted with, for
+    its distinct() and expand().
+    :ivar shapes: the shapes to place, get_base_shapes() by default
+    :ivar board_shape: the board as (rows, cols) or as a mask
+    :ivar num_shapes: the number of shape columns
+    :ivar symmetry: break the symmetries of the board with BoardSymmetry
+    :ivar reduce: run reduce_matrix with region_filter on the placements
+    :ivar cache: the MatrixCache to use, a default one if None
+    """
+    if shapes is None:
+        shapes = get_base_shapes()
+    if cache is None:
+        cache = MatrixCache()
+    piece_size = sum(sum(r) for r in shapes[0].shape)
+    key = make_key(kind='pentomino', shapes=[[s.index, s.name, s.shape] for s in shapes],
+                   board=board_mask(board_shape), num_shapes=num_shapes, symmetry=symmetry, reduce=reduce)
+
+    def build():
+        board_symmetry = BoardSymmetry(board_shape, num_shapes) if symmetry else None
+        placements = generate_all_placements(shapes, board_symmetry, board_shape, num_shapes)
+        col_names = generate_col_names(shapes, board_shape, num_shapes)
+        arrays = rows_to_arrays(placements, 'placements')
+        meta = {'col_names': col_names}
+        if symmetry:
+            # The stabilizers are kept as indices into the symmetries of the board
+            stabilizers = board_symmetry.stabilizers
+            meta['symmetry'] = {'piece': board_symmetry.piece,
+                                'stabilizers': [[list(cells), [board_symmetry.perms.index(p) for p in stabilizers[cells]]]
+                                                for cells in sorted(stabilizers)]}
+        if reduce:
+            # The shape columns of the pieces that are not used have no rows to fill them
+            unused = [i for i in range(num_shapes) if i not in set(s.index for s in shapes)]
+            reduction = reduce_matrix(placements, len(col_names), unused,
+                                      row_filter=region_filter(board_shape, num_shapes, piece_size))
+            arrays.update(rows_to_arrays(reduction.rows))
+            arrays['cols'] = np.array(reduction.cols, dtype=np.int32)
+            arrays['row_ids'] = np.array(reduction.row_ids, dtype=np.int32)
+            arrays['secondary'] = np.array(reduction.secondary, dtype=np.int32)
+            meta.update({'forced': reduction.forced, 'infeasible': reduction.infeasible, 'removed': reduction.removed})
+        return arrays, meta
+
+    arrays, meta = cache.get_or_build(key, build)
+    placements = RowArrays(arrays['placements_indptr'], arrays['placements_indices'])
+    reduction = None
+    if reduce:
+        reduction = Reduction(RowArrays(arrays['rows_indptr'], arrays['rows_indices']), arrays['cols'].tolist(),
+                              arrays['row_ids'].tolist(), arrays['secondary'].tolist(),
+                              meta['forced'], meta['infeasible'], meta['removed'], len(placements), len(meta['col_names']))
+    board_symmetry = None
+    if symmetry:
+        board_symmetry = BoardSymmetry(board_shape, num_shapes)
+        board_symmetry.piece = meta['symmetry']['piece']
+        for cells, perms in meta['symmetry']['stabilizers']:
+            board_symmetry.stabilizers[tuple(cells)] = [board_symmetry.perms[k] for k in perms]
+    return placements, meta['col_names'], reduction, board_symmetry
+
+class MatrixCache_UnitTest(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_rows_arrays(self):
+        rows = [[0, 3], [], [1, 2, 4]]
+        self.assertEqual(rows, arrays_to_rows(rows_to_arrays(rows)))
+
+    def test_store_load(self):
+        cache = MatrixCache(self.cache_dir)
+        key = make_key(name='test')
+        self.assertIsNone(cache.load(key))
+        cache.store(key, rows_to_arrays([[0, 1], [2]]), {'col_names': ['a', 'b', 'c']})
+        arrays, meta = cache.load(key)
+        self.assertIsInstance(arrays['rows_indices'], np.memmap)
+        self.assertEqual([[0, 1], [2]], arrays_to_rows(arrays))
+        self.assertEqual(['a', 'b', 'c'], meta['col_names'])
+        self.assertNotEqual(key, make_key(name='test2'))
+
+    def test_get_or_build(self):
+        cache = MatrixCache(self.cache_dir)
+        calls = []
+        def build():
+            calls.append(1)
+            return rows_to_arrays([[0]]), {}
+        for i in range(3):
+            arrays, meta = cache.get_or_build('k', build)
+            self.assertEqual([[0]], arrays_to_rows(arrays))
+        self.assertEqual(1, len(calls))
+
+    def test_lru(self):
+        cache = MatrixCache(self.cache_dir, max_bytes=10 ** 9)
+        rows = [[c] for c in range(1000)]
+        for key in ['a', 'b', 'c']:
+            cache.store(key, rows_to_arrays(rows), {})
+        sizes = [size for used, size, key in cache.entries()]
+        # Use a so that b is the least recently used, then make room for one entry less
+        past = time.time() - 100
+        for i, key in enumerate(['b', 'c', 'a']):
+            os.utime(os.path.join(self.cache_dir, key, 'meta.json'), (past + i, past + i))
+        cache.max_bytes = sum(sizes) - 1
+        cache.evict()
+        self.assertEqual(['c', 'a'], [key for used, size, key in cache.entries()])
+        self.assertIsNone(cache.load('b'))
+
+    def test_pentomino_matrix(self):
+        cache = MatrixCache(self.cache_dir)
+        placements, col_names, reduction, symmetry = pentomino_matrix(board_shape=(3, 20), cache=cache)
+        self.assertIsInstance(placements.indices, np.memmap)
+        self.assertEqual(generate_all_placements(get_base_shapes(), board_shape=(3, 20)), list(placements))
+        self.assertEqual(generate_col_names(get_base_shapes(), (3, 20)), col_names)
+        self.assertIsNone(reduction)
+        self.assertIsNone(symmetry)
+        self.assertEqual(1, len(cache.entries()))
+        again = pentomino_matrix(board_shape=(3, 20), cache=cache)
+        self.assertEqual((list(placements), col_names, None, None), (list(again[0]),) + again[1:])
+        self.assertEqual(1, len(cache.entries()))
+        lattice = SparseLattice.from_arrays(placements.indptr, placements.indices, col_names)
+        self.assertEqual(8, count_exact_cover_solutions(lattice))
+
+        placements, col_names, reduction, symmetry = pentomino_matrix(board_shape=(3, 20), symmetry=True, reduce=True, cache=cache)
+        self.assertEqual(2, count_exact_cover_solutions(reduction.lattice(col_names)))
+        again = pentomino_matrix(board_shape=(3, 20), symmetry=True, reduce=True, cache=cache)[2]
+        self.assertEqual((list(reduction.rows), reduction.cols, reduction.row_ids), (list(again.rows), again.cols, again.row_ids))
+        self.assertEqual(2, len(cache.entries()))
+
+    def test_symmetry(self):
+        # Three I pieces on a 3x5 board: every placement is fixed by a symmetry, so the
+        # stabilizers have to come back from the cache for distinct() to work
+        cache = MatrixCache(self.cache_dir)
+        shapes = [PentomintoShape([[1, 1, 1, 1, 1]], k, name='I%d' % k) for k in range(3)]
+        placements, col_names, reduction, symmetry = pentomino_matrix(shapes, (3, 5), 3, cache=cache)
+        every = [decode_placements(placements, s, 3, (3, 5)) for s in iter_exact_cover_solutions(SparseLattice(placements, col_names))]
+        self.assertEqual(6, len(every))
+        for i in range(2):
+            # Built the first time, loaded from the cache the second
+            placements, col_names, reduction, symmetry = pentomino_matrix(shapes, (3, 5), 3, symmetry=True, cache=cache)
+            self.assertNotEqual({}, symmetry.stabilizers)
+            found = [decode_placements(placements, s, 3, (3, 5)) for s in iter_exact_cover_solutions(SparseLattice(placements, col_names))]
+            distinct = [b for b in found if symmetry.distinct(b)]
+            self.assertEqual(3, len(distinct))
+            expanded = []
+            for b in distinct:
+                expanded.extend(symmetry.expand(b))
+            self.assertEqual(sorted(every), sorted(expanded))
+
+    def test_load_evicted(self):
+        cache = MatrixCache(self.cache_dir)
+        cache.store('k', rows_to_arrays([[0]]), {})
+        os.remove(os.path.join(self.cache_dir, 'k', 'meta.json'))
+        self.assertIsNone(cache.load('k'))
+
+    def test_piece_subset(self):
+        # The shape columns of the nine pieces left out must not make the problem infeasible
+        cache = MatrixCache(self.cache_dir)
+        shapes = [s for s in get_base_shapes() if s.name in ['F', 'P', 'U']]
+        for i in range(2):
+            placements, col_names, reduction, symmetry = pentomino_matrix(shapes, (3, 5), reduce=True, cache=cache)
+            self.assertFalse(reduction.infeasible)
+            self.assertEqual(9, len(reduction.secondary))
+            self.assertEqual(4, count_exact_cover_solutions(reduction.lattice(col_names)))
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+        main()
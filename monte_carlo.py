@@ -0,0 +1,278 @@
+import unittest
+import math
+import random
+import time
+from statistics import NormalDist
+from lattice import SparseLattice
+from exact_cover import choose_sparse_col, iter_exact_cover_solutions, count_exact_cover_solutions, iter_search_prefixes
+
+class Estimate():
+    """
+    The result of estimate_solutions.
+    :ivar count: the estimated number of solutions
+    :ivar stderr: the standard error of count
+    :ivar low: the lower end of the confidence interval
+    :ivar high: the upper end of the confidence interval
+    :ivar confidence: the probability the interval is meant to hold the true count with
+    :ivar probes: the number of random paths taken
+    :ivar strata: the number of strata the tree was split into
+    :ivar elapsed: the seconds the estimate took
+    """
+    def __init__(self, count, stderr, confidence, probes, strata, elapsed):
+        self.count = count
+        self.stderr = stderr
+        self.confidence = confidence
+        z = NormalDist().inv_cdf((1 + confidence) / 2)
+        self.low = max(0.0, count - z * stderr)
+        self.high = count + z * stderr
+        self.probes = probes
+        self.strata = strata
+        self.elapsed = elapsed
+
+    def __str__(self):
+        return '%.4g solutions (%.0f%% interval %.4g to %.4g, %d probes, %d strata, %.2fs)' % (
+            self.count, 100 * self.confidence, self.low, self.high, self.probes, self.strata, self.elapsed)
+
+def _lookahead(lattice, row_id):
+    # The number of choices left at the next level once the row is chosen, 1 for a solution
+    lattice.select(row_id)
+    try:
+        if lattice.right[0] == 0:
+            return 1
+        return lattice.size[choose_sparse_col(lattice)]
+    finally:
+        lattice.unselect(row_id)
+
+def random_path(lattice, rng, lookahead=False, prune=None):
+    """
+    Follows one random path down the search tree and returns (weight, solution). The weight
+    is one over the probability of the path, so its mean over many paths is the number of
+    solutions (Knuth's estimator). solution is None when the path ends in a dead end. The
+    lattice is left as it was found.
+    :ivar lattice: the SparseLattice to search
+    :ivar rng: the random.Random to choose with
+    :ivar lookahead: choose every row in proportion to the choices it leaves at the next
+        level instead of uniformly. Rows that lead straight into a dead end are never
+        chosen, which makes the estimate vary less
+    :ivar prune: a function of the SparseLattice that returns True under a dead end, see _search
+    """
+    right, down, row = lattice.right, lattice.down, lattice.row
+    chosen = []
+    weight = 1.0
+    try:
+        while True:
+            if right[0] == 0:
+                return weight, tuple(chosen)
+            if prune is not None and prune(lattice):
+                return 0.0, None
+            c = choose_sparse_col(lattice)
+            rows = []
+            r = down[c]
+            while r != c:
+                rows.append(row[r])
+                r = down[r]
+            if not rows:
+                return 0.0, None
+            if lookahead:
+                scores = [_lookahead(lattice, r) for r in rows]
+                total = sum(scores)
+                if total == 0:
+                    return 0.0, None
+                pick = rng.random() * total
+                i = 0
+                while i < len(rows) - 1 and (scores[i] == 0 or pick >= scores[i]):
+                    pick -= scores[i]
+                    i += 1
+                while scores[i] == 0:
+                    # Only rounding can land the pick on a dead end at the back
+                    i -= 1
+                weight *= total / scores[i]
+            else:
+                i = rng.randrange(len(rows))
+                weight *= len(rows)
+            lattice.select(rows[i])
+            chosen.append(rows[i])
+    finally:
+        for r in reversed(chosen):
+            lattice.unselect(r)
+
+def _sparse(lattice):
+    if not isinstance(lattice, SparseLattice):
+        lattice = SparseLattice.from_lattice(lattice)
+    if lattice.need is not None:
+        raise ValueError("Sampling is not supported for columns with multiplicities")
+    return lattice
+
+def estimate_solutions(lattice, probes=1000, seed=None, time_budget=None, lookahead=False, strata_depth=0, confidence=0.95, prune=None):
+    """
+    Estimates the number of solutions from random paths down the search tree, without
+    enumerating it. With strata_depth the top levels of the tree are expanded in full and
+    every subtree below them is sampled on its own (stratified sampling): the estimate is
+    the sum of the subtree estimates, and the variance between subtrees drops out.
+    The strata are probed in turns, and the probing stops after the turn in which either
+    probes paths were taken or time_budget seconds passed. Every stratum gets at least two
+    probes, the fewest its variance can be estimated from.
+    :ivar lattice: The SparseLattice (or Lattice) to estimate the solutions of
+    :ivar probes: the number of random paths to take
+    :ivar seed: the seed of the random number generator, for repeatable estimates
+    :ivar time_budget: the most seconds to spend, or None
+    :ivar lookahead: choose rows by the choices they leave, see random_path
+    :ivar strata_depth: the number of levels to expand before sampling
+    :ivar confidence: the probability the interval of the Estimate should hold the count with
+    :ivar prune: a function of the SparseLattice that returns True under a dead end
+    """
+    start = time.monotonic()
+    lattice = _sparse(lattice)
+    rng = random.Random(seed)
+    strata = [()]
+    if strata_depth > 0:
+        strata = list(iter_search_prefixes(lattice, strata_depth))
+    # Welford's running mean and sum of squared differences, one per stratum
+    counts = [0] * len(strata)
+    means = [0.0] * len(strata)
+    squares = [0.0] * len(strata)
+    taken = 0
+    turns = 0
+    while strata:
+        for s in range(len(strata)):
+            prefix = strata[s]
+            for r in prefix:
+                lattice.select(r)
+            try:
+                weight = random_path(lattice, rng, lookahead, prune)[0]
+            finally:
+                for r in reversed(prefix):
+                    lattice.unselect(r)
+            counts[s] += 1
+            delta = weight - means[s]
+            means[s] += delta / counts[s]
+            squares[s] += delta * (weight - means[s])
+            taken += 1
+        turns += 1
+        if turns >= 2 and (taken >= probes or (time_budget is not None and time.monotonic() - start >= time_budget)):
+            break
+
+    variance = 0.0
+    for s in range(len(strata)):
+        if counts[s] > 1:
+            variance += squares[s] / (counts[s] - 1) / counts[s]
+    return Estimate(sum(means), math.sqrt(variance), confidence, taken, len(strata), time.monotonic() - start)
+
+def sample_solutions(lattice, k=1, seed=None, uniform=True, max_probes=100000, time_budget=None, lookahead=False, prune=None):
+    """
+    Returns up to k random solutions (tuples of row ids), found by random paths down the
+    search tree. A random path favours the solutions under few choices, so with uniform a
+    solution reached with weight w is only kept with probability w / bound, bound being the
+    largest weight seen so far. Once the bound is the largest weight of any solution every
+    solution is equally likely. The samples are drawn with replacement.
+    :ivar lattice: The SparseLattice (or Lattice) to sample the solutions of
+    :ivar k: the number of solutions to return
+    :ivar seed: the seed of the random number generator, for repeatable samples
+    :ivar uniform: correct for the bias of the random paths by rejection
+    :ivar max_probes: the most random paths to take
+    :ivar time_budget: the most seconds to spend, or None
+    :ivar lookahead: choose rows by the choices they leave, see random_path
+    :ivar prune: a function of the SparseLattice that returns True under a dead end
+    """
+    start = time.monotonic()
+    lattice = _sparse(lattice)
+    rng = random.Random(seed)
+    bound = 0.0
+    samples = []
+    for probe in range(max_probes):
+        if len(samples) >= k or (time_budget is not None and time.monotonic() - start >= time_budget):
+            break
+        weight, solution = random_path(lattice, rng, lookahead, prune)
+        if solution is None:
+            continue
+        bound = max(bound, weight)
+        if not uniform or rng.random() * bound < weight:
+            samples.append(solution)
+    return samples
+
+class MonteCarlo_UnitTest(unittest.TestCase):
+    @staticmethod
+    def _domino_rows(rows, cols):
+        # The test fixture lives with the tests of bitset_cover
+        from bitset_cover import _domino_rows
+        return _domino_rows(rows, cols)
+
+    def test_estimate(self):
+        lattice = SparseLattice(self._domino_rows(4, 4), list(range(16)))
+        for lookahead in [False, True]:
+            for depth in [0, 2]:
+                estimate = estimate_solutions(lattice, probes=3000, seed=1, lookahead=lookahead, strata_depth=depth)
+                self.assertLess(abs(estimate.count - 36), 36 * 0.15)
+                self.assertLessEqual(estimate.low, 36)
+                self.assertGreaterEqual(estimate.high, 36)
+                self.assertGreaterEqual(estimate.probes, 3000)
+        lattice.check_invariants()
+        self.assertEqual(36, count_exact_cover_solutions(lattice))
+
+    def test_seed(self):
+        lattice = SparseLattice(self._domino_rows(4, 4), list(range(16)))
+        first = estimate_solutions(lattice, probes=50, seed=7)
+        second = estimate_solutions(lattice, probes=50, seed=7)
+        self.assertEqual((first.count, first.stderr), (second.count, second.stderr))
+
+    def test_exact(self):
+        # A single path through the tree, so every probe is exact
+        lattice = SparseLattice([[0, 1], [2], [3]], ['a', 'b', 'c', 'd'])
+        estimate = estimate_solutions(lattice, probes=10, seed=0)
+        self.assertEqual((1.0, 0.0), (estimate.count, estimate.stderr))
+        empty = SparseLattice([[0, 1], [1, 2]], ['a', 'b', 'c'])
+        self.assertEqual(0.0, estimate_solutions(empty, probes=10, seed=0).count)
+        self.assertEqual(0.0, estimate_solutions(empty, probes=10, seed=0, strata_depth=2).count)
+
+    def test_stratified_full(self):
+        # Expanding the whole tree leaves one stratum per solution
+        lattice = SparseLattice(self._domino_rows(2, 4), list(range(8)))
+        estimate = estimate_solutions(lattice, probes=1, seed=0, strata_depth=10)
+        self.assertEqual((5.0, 0.0, 5), (estimate.count, estimate.stderr, estimate.strata))
+
+    def test_time_budget(self):
+        lattice = SparseLattice(self._domino_rows(4, 4), list(range(16)))
+        estimate = estimate_solutions(lattice, probes=10 ** 9, seed=0, time_budget=0, strata_depth=1)
+        self.assertEqual(2 * estimate.strata, estimate.probes)
+        self.assertEqual([], sample_solutions(lattice, 5, seed=0, time_budget=0))
+
+    def test_two_probes(self):
+        # Every stratum is probed twice even when one probe is asked for, so none of them
+        # leaves the interval narrower than it is
+        lattice = SparseLattice(self._domino_rows(6, 6), list(range(36)))
+        estimate = estimate_solutions(lattice, probes=1, seed=3, strata_depth=3)
+        self.assertEqual(2 * estimate.strata, estimate.probes)
+        self.assertGreater(estimate.stderr, 0)
+        self.assertLess(estimate.low, estimate.high)
+
+    def test_lookahead(self):
+        # 6728 domino tilings of the 6x6 square, too many to check one by one in a unit test
+        lattice = SparseLattice(self._domino_rows(6, 6), list(range(36)))
+        plain = estimate_solutions(lattice, probes=2000, seed=3)
+        estimate = estimate_solutions(lattice, probes=2000, seed=3, lookahead=True, strata_depth=3)
+        self.assertLessEqual(estimate.low, 6728)
+        self.assertGreaterEqual(estimate.high, 6728)
+        self.assertLess(estimate.stderr, plain.stderr)
+        self.assertEqual(8, estimate.strata)
+        for s in sample_solutions(lattice, 5, seed=3, lookahead=True):
+            cells = [c for r in s for c in lattice.row_cols(lattice.row_start[r])]
+            self.assertEqual(list(range(36)), sorted(cells))
+
+    def test_sample_uniform(self):
+        lattice = SparseLattice(self._domino_rows(4, 4), list(range(16)))
+        solutions = set(tuple(sorted(s)) for s in iter_exact_cover_solutions(lattice))
+        samples = sample_solutions(lattice, 3600, seed=5)
+        self.assertEqual(3600, len(samples))
+        counts = {}
+        for s in samples:
+            s = tuple(sorted(s))
+            self.assertIn(s, solutions)
+            counts[s] = counts.get(s, 0) + 1
+        self.assertEqual(36, len(counts))
+        self.assertLess(max(counts.values()), 2 * min(counts.values()) + 40)
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+        main()
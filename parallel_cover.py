@@ -0,0 +1,132 @@
+import unittest
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from lattice import Lattice, SparseLattice
+from exact_cover import iter_exact_cover_solutions, count_exact_cover_solutions, iter_search_prefixes
+
+# The lattice every worker process searches. It is set once per process by _init_worker
+_worker_lattice = None
+
+def _init_worker(lattice):
+    global _worker_lattice
+    _worker_lattice = lattice
+
+def _count_prefix(prefix):
+    return count_exact_cover_solutions(_worker_lattice, prefix=prefix)
+
+def _solve_prefix(prefix):
+    return list(iter_exact_cover_solutions(_worker_lattice, prefix=prefix))
+
+def split_search(lattice, num_tasks, depth=None):
+    """
+    Splits the top levels of the search tree into independent prefixes.
+    Without a depth the tree is expanded one level at a time until there are at least
+    num_tasks prefixes, or every path ends above the next level. A forced level, where every
+    prefix has a single child, does not stop the split.
+    :ivar lattice: The SparseLattice (or Lattice) to split
+    :ivar num_tasks: the number of prefixes to aim for
+    :ivar depth: the number of levels to expand, if it should be fixed
+    """
+    if depth is not None:
+        return list(iter_search_prefixes(lattice, depth))
+    depth = 1
+    prefixes = list(iter_search_prefixes(lattice, depth))
+    # A prefix shorter than depth is a solution, so only the full length ones go deeper
+    while len(prefixes) < num_tasks and any(len(p) == depth for p in prefixes):
+        depth += 1
+        prefixes = list(iter_search_prefixes(lattice, depth))
+    return prefixes
+
+def _run(lattice, task, max_workers, depth, tasks_per_worker):
+    if not isinstance(lattice, SparseLattice):
+        lattice = SparseLattice.from_lattice(lattice)
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    prefixes = split_search(lattice, max_workers * tasks_per_worker, depth)
+
+    # The prefixes are handed out one at a time to whichever worker is free, so the
+    # workers that draw small subtrees keep taking work from the shared queue
+    results = [None] * len(prefixes)
+    with ProcessPoolExecutor(max_workers, initializer=_init_worker, initargs=(lattice,)) as executor:
+        futures = {}
+        for i in range(len(prefixes)):
+            futures[executor.submit(task, prefixes[i])] = i
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+    return results
+
+def parallel_count_exact_cover_solutions(lattice, max_workers=None, depth=None, tasks_per_worker=16):
+    """
+    Counts the solutions on a pool of processes.
+    The first levels of the search tree are expanded into prefixes and every worker
+    counts the solutions under the prefixes it takes.
+    :ivar lattice: The SparseLattice (or Lattice) for the algorithm to run on
+    :ivar max_workers: the number of processes, os.cpu_count() by default
+    :ivar depth: the number of levels to split on. By default it is picked from tasks_per_worker
+    :ivar tasks_per_worker: how many prefixes to aim for per worker when depth is not given
+    """
+    return sum(_run(lattice, _count_prefix, max_workers, depth, tasks_per_worker))
+
+def parallel_exact_cover_solutions(lattice, max_workers=None, depth=None, tasks_per_worker=16):
+    """
+    Finds every solution on a pool of processes, see parallel_count_exact_cover_solutions.
+    The solutions are tuples of row ids, in the order the serial search finds them.
+    """
+    solutions = []
+    for part in _run(lattice, _solve_prefix, max_workers, depth, tasks_per_worker):
+        solutions.extend(part)
+    return solutions
+
+class ParallelCover_UnitTest(unittest.TestCase):
+    @staticmethod
+    def _domino_rows(rows, cols):
+        # The test fixture lives with the tests of bitset_cover
+        from bitset_cover import _domino_rows
+        return _domino_rows(rows, cols)
+
+    def test_split_search(self):
+        lattice = SparseLattice(self._domino_rows(4, 4), list(range(16)))
+        prefixes = split_search(lattice, 8)
+        self.assertGreaterEqual(len(prefixes), 8)
+        total = 0
+        for p in prefixes:
+            total += count_exact_cover_solutions(lattice, prefix=p)
+        self.assertEqual(36, total)
+
+    def test_split_forced_levels(self):
+        # Columns x and y have a single row each, so the first two levels are forced
+        rows = [[16], [17]] + self._domino_rows(4, 4)
+        lattice = SparseLattice(rows, list(range(16)) + ['x', 'y'])
+        self.assertEqual([(0,)], split_search(lattice, 8, depth=1))
+        prefixes = split_search(lattice, 8)
+        self.assertGreaterEqual(len(prefixes), 8)
+        self.assertEqual(36, sum(count_exact_cover_solutions(lattice, prefix=p) for p in prefixes))
+        # The whole tree is smaller than the number of tasks asked for
+        self.assertEqual(36, len(split_search(lattice, 1000)))
+        self.assertEqual([], split_search(SparseLattice([[0, 1], [1, 2]], ['a', 'b', 'c']), 8))
+
+    def test_parallel_count(self):
+        lattice = SparseLattice(self._domino_rows(4, 4), list(range(16)))
+        self.assertEqual(36, parallel_count_exact_cover_solutions(lattice, max_workers=2))
+        self.assertEqual(36, parallel_count_exact_cover_solutions(lattice, max_workers=2, depth=3))
+
+    def test_parallel_solutions(self):
+        lattice = SparseLattice(self._domino_rows(4, 4), list(range(16)))
+        expected = list(iter_exact_cover_solutions(lattice))
+        self.assertEqual(expected, parallel_exact_cover_solutions(lattice, max_workers=2, depth=2))
+
+    def test_parallel_lattice(self):
+        col_names = ['a', 'b', 'c']
+        matrix = [['0', '1', '1'],
+                  ['1', '0', '0'],
+                  ['1', '0', '1'],
+                  ['0', '1', '0']]
+        lattice = Lattice(matrix, col_names, delete_zeros=True)
+        solutions = parallel_exact_cover_solutions(lattice, max_workers=2)
+        self.assertEqual([[1, 2], [3, 4]], sorted(sorted(s) for s in solutions))
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+        main()
@@ -1,7 +1,9 @@
 import unittest
+import itertools
 import numpy as np
-from lattice import Lattice
-from exact_cover import generate_exact_cover_solutions
+from lattice import Lattice, SparseLattice
+from exact_cover import generate_exact_cover_solutions, iter_exact_cover_solutions, build_cover, count_cover_solutions, SearchStats
+from polyomino import CACHE_DIR, DIHEDRAL_TRANSFORMS, free_polyominoes, normalize, canonical_form, cells_to_shape, shape_to_cells, polyomino_name
 
 class PentomintoShape():
     def __init__(self, shape, index=0, num_orientations=0, name=''):
@@ -9,36 +11,74 @@ class PentomintoShape():
         self.index = index
         self.num_orientations = num_orientations
         self.name = name
+        # Filled in by generate_orientations
+        self.orientation_cells = []
+        self.symmetries = []
     
     def generate_orientations(self):
-        orientations = []
-        for i in range(0, 4):
-            rotated_shape = np.rot90(self.shape, k=i)
-            orientations.append(rotated_shape.tolist())
-            orientations.append(np.flip(rotated_shape, axis=0).tolist())
-            orientations.append(np.flip(rotated_shape, axis=1).tolist())
-        
-        unique_orientations = []
-        for o in orientations:
-            if o not in unique_orientations:
-                unique_orientations.append(o)
-        if len(unique_orientations) is not self.num_orientations and self.num_orientations is not 0:
+        """ Returns the distinct rotations and reflections of the shape, the shape itself first.
+        Every image is normalized to a sorted tuple of cells, so duplicates are found by hashing.
+        Also records the cells of every orientation and the symmetries of the shape (the indices
+        of the DIHEDRAL_TRANSFORMS that map it onto itself) """
+        cells = shape_to_cells(self.shape)
+        orientations = {}
+        self.symmetries = []
+        for k in range(len(DIHEDRAL_TRANSFORMS)):
+            t = DIHEDRAL_TRANSFORMS[k]
+            image = normalize([t(r, c) for r, c in cells])
+            if image == cells:
+                self.symmetries.append(k)
+            orientations.setdefault(image, None)
+        self.orientation_cells = list(orientations)
+        if len(self.orientation_cells) != self.num_orientations and self.num_orientations != 0:
             print(self.name + ": ERROR ERROR READ ALL ABOUT IT")
-        return unique_orientations
+        return [cells_to_shape(o) for o in self.orientation_cells]
 
-def encode_board(board, shape_index, num_shapes=12):
+def board_mask(board_shape=(6,10)):
+    """ Returns the mask of a board, with a 1 on every open cell.
+    board_shape is either the (rows, cols) of a rectangle or already a mask (a list of lists) """
+    if isinstance(board_shape, tuple):
+        rows, cols = board_shape
+        return [[1] * cols for r in range(rows)]
+    return [[1 if v else 0 for v in r] for r in board_shape]
+
+def board_with_holes(board_shape, holes):
+    """ Returns the mask of a board with the (row, col) cells in holes blocked """
+    mask = board_mask(board_shape)
+    for r, c in holes:
+        mask[r][c] = 0
+    return mask
+
+def board_cells(board_shape=(6,10)):
+    """ Returns the (row, col) of every open cell. Cell i is the i-th board column of an encoding """
+    mask = board_mask(board_shape)
+    return [(r, c) for r in range(len(mask)) for c in range(len(mask[r])) if mask[r][c]]
+
+def generate_col_names(shapes, board_shape=(6,10), num_shapes=12):
+    """ Returns the column names of the encodings: the shape names by index, then the number of every open cell """
+    col_names = [''] * num_shapes
+    for s in shapes:
+        col_names[s.index] = s.name
+    cols = len(board_mask(board_shape)[0])
+    for r, c in board_cells(board_shape):
+        col_names.append(r * cols + c + 1)
+    return col_names
+
+def encode_board(board, shape_index, num_shapes=12, mask=None):
     enc = []
     for i in range(num_shapes):
         enc.append(0)
     enc[shape_index] = 1
-    for r in board:
-        for c in r:
-            enc.append(c)
+    for i in range(len(board)):
+        for j in range(len(board[i])):
+            if mask is None or mask[i][j]:
+                enc.append(board[i][j])
     return enc
 
 def generate_board(shape, board_shape=(6,10), shape_offset=(0,0)):
     board = []
-    rows, cols = board_shape
+    mask = board_mask(board_shape)
+    rows, cols = len(mask), len(mask[0])
     for i in range(rows):
         board.append([])
         for j in range(cols):
@@ -50,17 +90,152 @@ def generate_board(shape, board_shape=(6,10), shape_offset=(0,0)):
     return board
 
 def generate_positions(shape, shape_index, num_shapes=12, board_shape=(6,10)):
-    board_rows, board_cols = board_shape
+    mask = board_mask(board_shape)
+    board_rows, board_cols = len(mask), len(mask[0])
     shape_rows = len(shape)
     shape_cols = len(shape[0])
+    shape_cells = [(r, c) for r in range(shape_rows) for c in range(shape_cols) if shape[r][c]]
     encoded_positions = []
     for r in range(0, board_rows - shape_rows + 1):
         for c in range(0, board_cols - shape_cols + 1):
-            generated_board = generate_board(shape, shape_offset=(r, c))
-            encoded_board = encode_board(generated_board, shape_index)
+            # Skip the positions that would cover a blocked cell
+            if not all(mask[r + i][c + j] for i, j in shape_cells):
+                continue
+            generated_board = generate_board(shape, board_shape, shape_offset=(r, c))
+            encoded_board = encode_board(generated_board, shape_index, num_shapes, mask)
             encoded_positions.append(encoded_board)
     return encoded_positions
 
+def _cell_columns(board_shape, num_shapes):
+    # The column of every open cell of the board, -1 on the blocked ones
+    mask = np.array(board_mask(board_shape), dtype=bool)
+    columns = np.full(mask.shape, -1, dtype=np.int64)
+    columns[mask] = np.arange(num_shapes, num_shapes + mask.sum())
+    return columns
+
+def generate_placements(shape, shape_index, num_shapes=12, board_shape=(6,10), cell_columns=None):
+    """
+    Returns every placement of a shape on the board as a sparse row: the column of the shape
+    followed by the columns of the cells it covers, in the order of generate_positions.
+    The covered cells of all the offsets are computed at once with NumPy broadcasting and
+    the placements that cover a blocked cell are dropped.
+    """
+    if cell_columns is None:
+        cell_columns = _cell_columns(board_shape, num_shapes)
+    cells = np.argwhere(np.asarray(shape))
+    shape_rows, shape_cols = len(shape), len(shape[0])
+    board_rows, board_cols = cell_columns.shape
+    if shape_rows > board_rows or shape_cols > board_cols:
+        return []
+    r_offsets, c_offsets = np.mgrid[0:board_rows - shape_rows + 1, 0:board_cols - shape_cols + 1]
+    covered = cell_columns[r_offsets.reshape(-1, 1) + cells[:, 0], c_offsets.reshape(-1, 1) + cells[:, 1]]
+    covered = covered[(covered >= 0).all(axis=1)]
+    placements = np.empty((len(covered), len(cells) + 1), dtype=np.int64)
+    placements[:, 0] = shape_index
+    placements[:, 1:] = covered
+    return placements.tolist()
+
+def generate_all_placements(shapes, symmetry=None, board_shape=(6,10), num_shapes=12):
+    """ The sparse counterpart of generate_all_orientations_with_encodings, ready for SparseLattice """
+    cell_columns = _cell_columns(board_shape, num_shapes)
+    placements = []
+    for s in shapes:
+        for o in s.generate_orientations():
+            placements.extend(generate_placements(o, s.index, num_shapes, board_shape, cell_columns))
+    if symmetry is not None:
+        placements = symmetry.restrict_placements(placements)
+    return placements
+
+def region_filter(board_shape=(6,10), num_shapes=12, piece_size=5):
+    """
+    Returns a row_filter for reduce_matrix (see preprocess.py) that drops every placement
+    that cuts off a region of empty cells whose size is not a multiple of piece_size, given
+    the cells the forced placements already cover. Such a region can never be tiled.
+    """
+    cells = board_cells(board_shape)
+    index = {}
+    for i in range(len(cells)):
+        index[cells[i]] = i
+    neighbours = []
+    for r, c in cells:
+        neighbours.append([index[n] for n in ((r - 1, c), (r + 1, c), (r, c - 1), (r, c + 1)) if n in index])
+
+    def keep(row, covered):
+        filled = [False] * len(cells)
+        for col in itertools.chain(row, covered):
+            if col >= num_shapes:
+                filled[col - num_shapes] = True
+        for start in range(len(cells)):
+            if filled[start]:
+                continue
+            # Fill the region of start and count its cells
+            filled[start] = True
+            stack = [start]
+            size = 0
+            while stack:
+                i = stack.pop()
+                size += 1
+                for j in neighbours[i]:
+                    if not filled[j]:
+                        filled[j] = True
+                        stack.append(j)
+            if size % piece_size:
+                return False
+        return True
+    return keep
+
+def region_pruner(lattice, board_shape=(6,10), piece_size=5):
+    """
+    Returns a prune hook for the search (see count_exact_cover_solutions) that gives up on
+    a partial tiling as soon as it leaves a region of empty cells whose size is not a
+    multiple of piece_size. The empty cells are the live cell columns of the lattice, which
+    are told apart from the shape columns by their names (see generate_col_names), so the
+    hook also works on a reduced matrix. The regions are flood filled on a bitmask of the
+    board with a blank column on the right, so shifting a row never wraps into the next one.
+    """
+    cols = len(board_mask(board_shape)[0])
+    width = cols + 1
+    bits = [0] * (len(lattice.col_names) + 1)
+    for i in range(len(lattice.col_names)):
+        name = lattice.col_names[i]
+        if isinstance(name, int):
+            r, c = divmod(name - 1, cols)
+            bits[i + 1] = 1 << (r * width + c)
+
+    def prune(lattice):
+        right = lattice.right
+        empty = 0
+        h = right[0]
+        while h != 0:
+            empty |= bits[h]
+            h = right[h]
+        while empty:
+            region = empty & -empty
+            while True:
+                grown = (region | region << 1 | region >> 1 | region << width | region >> width) & empty
+                if grown == region:
+                    break
+                region = grown
+            if bin(region).count('1') % piece_size:
+                return True
+            empty ^= region
+        return False
+    return prune
+
+def scan_order(board_shape=(6,10), num_shapes=12):
+    """ Returns the column order for the bitset backends: the open cells scanned along the short
+    side of the board, so the first empty cell always borders the filled part, then the shapes """
+    mask = board_mask(board_shape)
+    columns = {}
+    for i, cell in enumerate(board_cells(mask)):
+        columns[cell] = num_shapes + i
+    rows, cols = len(mask), len(mask[0])
+    if rows <= cols:
+        cells = [(r, c) for c in range(cols) for r in range(rows)]
+    else:
+        cells = [(r, c) for r in range(rows) for c in range(cols)]
+    return [columns[cell] for cell in cells if cell in columns] + list(range(num_shapes))
+
 def get_base_shapes():
     base_shapes = []
 
@@ -143,14 +318,171 @@ def get_base_shapes():
 
     return base_shapes
 
-def generate_all_orientations_with_encodings(shapes):
+def get_polyomino_shapes(n, cache_dir=CACHE_DIR):
+    """ Returns the free n-ominoes as shapes indexed 0, 1, ... The pentominoes keep their letter names.
+    See free_polyominoes for cache_dir """
+    names = {}
+    if n == 5:
+        for s in get_base_shapes():
+            names[canonical_form(shape_to_cells(s.shape))] = s.name
+    shapes = []
+    polyominoes = free_polyominoes(n, cache_dir)
+    for i in range(len(polyominoes)):
+        cells = polyominoes[i]
+        num_orientations = len(set(normalize([t(r, c) for r, c in cells]) for t in DIHEDRAL_TRANSFORMS))
+        shapes.append(PentomintoShape(cells_to_shape(cells), i, num_orientations, names.get(cells, polyomino_name(n, i))))
+    return shapes
+
+def generate_all_orientations_with_encodings(shapes, symmetry=None, board_shape=(6,10), num_shapes=12):
     encodings = []
     for s in shapes:
         for o in s.generate_orientations():
-            for p in generate_positions(o, s.index):
+            for p in generate_positions(o, s.index, num_shapes, board_shape):
                 encodings.append(p)
+    if symmetry is not None:
+        encodings = symmetry.restrict(encodings)
     return encodings
 
+def board_symmetries(board_shape=(6, 10)):
+    """ Returns the symmetries of a board as permutations of its open cells, the identity first """
+    cells = board_cells(board_shape)
+    index = {}
+    for i in range(len(cells)):
+        index[cells[i]] = i
+    base_r = min(r for r, c in cells)
+    base_c = min(c for r, c in cells)
+    perms = []
+    for t in DIHEDRAL_TRANSFORMS:
+        moved = [t(r, c) for r, c in cells]
+        min_r = min(r for r, c in moved)
+        min_c = min(c for r, c in moved)
+        moved = [(r - min_r + base_r, c - min_c + base_c) for r, c in moved]
+        if all(m in index for m in moved):
+            perm = [index[m] for m in moved]
+            if perm not in perms:
+                perms.append(perm)
+    return perms
+
+def decode_solution(encodings, solution, num_shapes=12, board_shape=(6, 10)):
+    """ Turns a solution (indices into encodings) into a board holding the shape index of every cell, -1 where empty or blocked """
+    mask = board_mask(board_shape)
+    cells = board_cells(mask)
+    board = [[-1] * len(r) for r in mask]
+    for i in solution:
+        enc = encodings[i]
+        shape_index = enc.index(1)
+        for j in range(num_shapes, len(enc)):
+            if enc[j]:
+                r, c = cells[j - num_shapes]
+                board[r][c] = shape_index
+    return board
+
+def decode_placements(placements, solution, num_shapes=12, board_shape=(6, 10)):
+    """ decode_solution() for sparse placement rows """
+    mask = board_mask(board_shape)
+    cells = board_cells(mask)
+    board = [[-1] * len(r) for r in mask]
+    for i in solution:
+        for j in placements[i][1:]:
+            r, c = cells[j - num_shapes]
+            board[r][c] = placements[i][0]
+    return board
+
+class BoardSymmetry():
+    """
+    The symmetry group of a board, used to search one tiling out of each set of rotations
+    and mirror images. restrict() limits one piece to a single placement per orbit of the
+    group, the way Knuth limits the X pentomino to one quarter of the board. When that piece
+    can sit on a placement some symmetry maps onto itself, the tilings through it are still
+    found more than once and distinct() keeps only one of them.
+    :ivar board_shape: the (rows, cols) of the board, or its mask
+    :ivar num_shapes: the number of shape columns at the front of every encoding
+    """
+    def __init__(self, board_shape=(6, 10), num_shapes=12):
+        self.board_shape = board_shape
+        self.num_shapes = num_shapes
+        self.cells = board_cells(board_shape)
+        self.perms = board_symmetries(board_shape)
+        self.piece = None
+        # Placement of the restricted piece -> the symmetries (other than the identity) that fix it
+        self.stabilizers = {}
+
+    def restrict(self, encodings):
+        """ Returns the encodings without the placements of the restricted piece that are images of other placements """
+        n = self.num_shapes
+        placements = []
+        for enc in encodings:
+            placements.append((enc.index(1), tuple([j - n for j in range(n, len(enc)) if enc[j]])))
+        dropped = self._restricted(placements)
+        return [encodings[i] for i in range(len(encodings)) if i not in dropped]
+
+    def restrict_placements(self, placements):
+        """ restrict() for sparse placement rows, see generate_placements """
+        n = self.num_shapes
+        pieces = [(p[0], tuple(sorted([c - n for c in p[1:]]))) for p in placements]
+        dropped = self._restricted(pieces)
+        return [placements[i] for i in range(len(placements)) if i not in dropped]
+
+    def _restricted(self, placements):
+        # placements holds the (piece, sorted cells) of every row. Picks the piece to restrict
+        # and returns the indices of the rows to drop
+        by_piece = {}
+        for i in range(len(placements)):
+            piece, cells = placements[i]
+            by_piece.setdefault(piece, []).append((i, cells))
+
+        best = None
+        for piece in sorted(by_piece):
+            kept = set()
+            stabilizers = {}
+            for i, cells in by_piece[piece]:
+                images = [tuple(sorted([p[c] for c in cells])) for p in self.perms]
+                if cells == min(images):
+                    kept.add(i)
+                    fixing = [self.perms[k] for k in range(1, len(images)) if images[k] == cells]
+                    if fixing:
+                        stabilizers[cells] = fixing
+            # Prefer the piece that leaves the fewest duplicates, then the fewest rows
+            score = (len(stabilizers), len(kept))
+            if best is None or score < best[0]:
+                best = (score, piece, kept, stabilizers)
+        if best is None:
+            return set()
+
+        score, self.piece, kept, self.stabilizers = best
+        return set(i for i, cells in by_piece[self.piece]) - kept
+
+    def _image(self, flat, perm):
+        image = [0] * len(flat)
+        for i in range(len(flat)):
+            image[perm[i]] = flat[i]
+        return image
+
+    def distinct(self, board):
+        """ Returns False for the tilings found by a restricted search that duplicate another one """
+        flat = [board[r][c] for r, c in self.cells]
+        cells = tuple([i for i in range(len(flat)) if flat[i] == self.piece])
+        for perm in self.stabilizers.get(cells, []):
+            if self._image(flat, perm) < flat:
+                return False
+        return True
+
+    def expand(self, board):
+        """ Returns every distinct rotation and mirror image of a tiling, the tiling itself first """
+        flat = [board[r][c] for r, c in self.cells]
+        boards = []
+        seen = set()
+        for perm in self.perms:
+            image = tuple(self._image(flat, perm))
+            if image not in seen:
+                seen.add(image)
+                expanded = [[-1] * len(r) for r in board]
+                for i in range(len(image)):
+                    r, c = self.cells[i]
+                    expanded[r][c] = image[i]
+                boards.append(expanded)
+        return boards
+
 class Pentominto_UnitTest(unittest.TestCase):
     def test_generate_positions(self):
         shape = [[1],
@@ -252,12 +584,239 @@ class Pentominto_UnitTest(unittest.TestCase):
         orientations = shape.generate_orientations()
         self.assertEqual(8, len(orientations))
 
+    def test_generate_orientations_symmetries(self):
+        for s in get_base_shapes():
+            orientations = s.generate_orientations()
+            self.assertEqual(s.num_orientations, len(orientations))
+            self.assertEqual(8, len(orientations) * len(s.symmetries))
+            self.assertEqual(s.shape, orientations[0])
+            self.assertEqual(len(orientations), len(set(s.orientation_cells)))
+            self.assertEqual(0, s.symmetries[0])
+
     def test_generate_all_orientations_with_encodings(self):
         base_shapes = get_base_shapes()
         binary_matrix = generate_all_orientations_with_encodings(base_shapes)
         # Knuth says this should be 1568 in length but its about 25% more than that. Hmmm.
         #print(len(binary_matrix))
 
+    def _small_board_encodings(self, names, board_shape):
+        # Encodings of some of the pieces on a small board, one shape column per piece
+        shapes = [s for s in get_base_shapes() if s.name in names]
+        rows, cols = board_shape
+        encodings = []
+        for k in range(len(shapes)):
+            for o in shapes[k].generate_orientations():
+                for r in range(rows - len(o) + 1):
+                    for c in range(cols - len(o[0]) + 1):
+                        board = generate_board(o, board_shape, shape_offset=(r, c))
+                        encodings.append(encode_board(board, k, len(shapes)))
+        return encodings
+
+    def _boards(self, encodings, symmetry):
+        num_shapes = symmetry.num_shapes
+        col_names = list(range(len(encodings[0])))
+        lattice = SparseLattice.from_matrix(encodings, col_names)
+        boards = []
+        for solution in iter_exact_cover_solutions(lattice):
+            boards.append(decode_solution(encodings, solution, num_shapes, symmetry.board_shape))
+        return boards
+
+    def test_board_symmetries(self):
+        self.assertEqual(4, len(board_symmetries((6, 10))))
+        self.assertEqual(8, len(board_symmetries((8, 8))))
+        self.assertEqual(list(range(60)), board_symmetries((6, 10))[0])
+
+    def test_decode_solution(self):
+        encodings = self._small_board_encodings(['F', 'P', 'U'], (3, 5))
+        symmetry = BoardSymmetry((3, 5), 3)
+        board = self._boards(encodings, symmetry)[0]
+        self.assertEqual(3, len(board))
+        self.assertEqual([5, 5, 5], [sum(1 for r in board for s in r if s == k) for k in range(3)])
+
+    def test_restrict_6x10(self):
+        symmetry = BoardSymmetry((6, 10))
+        encodings = generate_all_orientations_with_encodings(get_base_shapes())
+        restricted = generate_all_orientations_with_encodings(get_base_shapes(), symmetry)
+        # X has 32 placements on the 6x10 board, one in four is kept and none of them is symmetric
+        self.assertEqual(4, symmetry.piece)
+        self.assertEqual(len(encodings) - 24, len(restricted))
+        self.assertEqual({}, symmetry.stabilizers)
+
+    def _check_symmetry_breaking(self, names, board_shape):
+        encodings = self._small_board_encodings(names, board_shape)
+        symmetry = BoardSymmetry(board_shape, len(names))
+        every = self._boards(encodings, symmetry)
+        distinct = [b for b in self._boards(symmetry.restrict(encodings), symmetry) if symmetry.distinct(b)]
+        self.assertEqual(len(every), len(distinct) * len(symmetry.perms))
+        expanded = []
+        for b in distinct:
+            expanded.extend(symmetry.expand(b))
+        self.assertEqual(sorted(every), sorted(expanded))
+
+    def test_symmetry_breaking_rectangle(self):
+        self._check_symmetry_breaking(['L', 'P', 'W', 'Y'], (4, 5))
+
+    def test_symmetry_breaking_square(self):
+        self._check_symmetry_breaking(['I', 'L', 'P', 'T', 'V'], (5, 5))
+        self._check_symmetry_breaking(['F', 'L', 'P', 'U', 'X'], (5, 5))
+
+    def test_symmetry_breaking_symmetric_placements(self):
+        # Three I pieces on a 3x5 board. Every placement is fixed by some symmetry
+        board_shape = (3, 5)
+        shape = [[1, 1, 1, 1, 1]]
+        encodings = []
+        for k in range(3):
+            for r in range(3):
+                encodings.append(encode_board(generate_board(shape, board_shape, shape_offset=(r, 0)), k, 3))
+        symmetry = BoardSymmetry(board_shape, 3)
+        every = self._boards(encodings, symmetry)
+        distinct = [b for b in self._boards(symmetry.restrict(encodings), symmetry) if symmetry.distinct(b)]
+        self.assertNotEqual({}, symmetry.stabilizers)
+        self.assertEqual(6, len(every))
+        self.assertEqual(3, len(distinct))
+        expanded = []
+        for b in distinct:
+            expanded.extend(symmetry.expand(b))
+        self.assertEqual(sorted(every), sorted(expanded))
+
+    def test_board_with_holes(self):
+        mask = board_with_holes((8, 8), [(3, 3), (3, 4), (4, 3), (4, 4)])
+        self.assertEqual(60, len(board_cells(mask)))
+        self.assertEqual((3, 5), board_cells(mask)[27])
+        self.assertEqual(8, len(board_symmetries(mask)))
+        self.assertEqual(4, len(board_symmetries(board_with_holes((8, 8), [(0, 0), (7, 7)]))))
+        self.assertEqual(1, len(board_symmetries(board_with_holes((8, 8), [(0, 0), (0, 1)]))))
+
+    def test_generate_positions_board_shape(self):
+        shape = [[1],
+                 [1],
+                 [1],
+                 [1]]
+        self.assertEqual(17, len(generate_positions(shape, 1, board_shape=(4, 17))))
+        # The hole in the middle of the 8x8 board rules out the 10 vertical positions in its columns
+        mask = board_with_holes((8, 8), [(3, 3), (3, 4), (4, 3), (4, 4)])
+        positions = generate_positions(shape, 1, board_shape=mask)
+        self.assertEqual(30, len(positions))
+        self.assertEqual(12 + 60, len(positions[0]))
+
+    def test_encode_board_mask(self):
+        board = [[1, 1, 0],
+                 [0, 1, 1]]
+        mask = [[1, 1, 1],
+                [0, 1, 1]]
+        self.assertEqual([0, 1, 1, 1, 0, 1, 1], encode_board(board, 1, 2, mask))
+
+    def test_generate_col_names(self):
+        mask = board_with_holes((2, 3), [(0, 1)])
+        col_names = generate_col_names(get_base_shapes(), mask)
+        self.assertEqual(['I', 'N', 'L', 'U', 'X', 'W', 'P', 'F', 'Z', 'T', 'V', 'Y', 1, 3, 4, 5, 6], col_names)
+
+    def test_masked_board_tilings(self):
+        # A 4x6 board with its last column blocked tiles like the 4x5 board
+        shapes = [s for s in get_base_shapes() if s.name in ['L', 'P', 'W', 'Y']]
+        for k in range(len(shapes)):
+            shapes[k] = PentomintoShape(shapes[k].shape, k, shapes[k].num_orientations, shapes[k].name)
+        mask = board_with_holes((4, 6), [(r, 5) for r in range(4)])
+        encodings = generate_all_orientations_with_encodings(shapes, board_shape=mask, num_shapes=4)
+        col_names = generate_col_names(shapes, mask, 4)
+        self.assertEqual(20, len(list(iter_exact_cover_solutions(SparseLattice.from_matrix(encodings, col_names)))))
+
+        symmetry = BoardSymmetry(mask, 4)
+        restricted = generate_all_orientations_with_encodings(shapes, symmetry, mask, 4)
+        boards = []
+        for solution in iter_exact_cover_solutions(SparseLattice.from_matrix(restricted, col_names)):
+            boards.append(decode_solution(restricted, solution, 4, mask))
+        self.assertEqual(5, len(boards))
+        self.assertEqual([-1, -1, -1, -1], [r[5] for r in boards[0]])
+        self.assertEqual(4, len(symmetry.expand(boards[0])))
+
+    def test_generate_placements(self):
+        shape = [[1, 1, 1],
+                 [0, 1, 0],
+                 [0, 1, 0]]
+        placements = generate_placements(shape, 9)
+        self.assertEqual(32, len(placements))
+        self.assertEqual([9, 12, 13, 14, 23, 33], placements[0])
+        positions = generate_positions(shape, 9)
+        for i in range(len(positions)):
+            self.assertEqual([j for j in range(len(positions[i])) if positions[i][j]], placements[i])
+
+    def test_generate_all_placements(self):
+        mask = board_with_holes((8, 8), [(3, 3), (3, 4), (4, 3), (4, 4)])
+        shapes = get_base_shapes()
+        encodings = generate_all_orientations_with_encodings(shapes, board_shape=mask)
+        placements = generate_all_placements(shapes, board_shape=mask)
+        self.assertEqual([[j for j in range(len(e)) if e[j]] for e in encodings], placements)
+        self.assertEqual([], generate_placements([[1, 1, 1, 1, 1]], 0, board_shape=(3, 3)))
+
+    def test_generate_all_placements_symmetry(self):
+        shapes = get_base_shapes()
+        symmetry = BoardSymmetry((6, 10))
+        encodings = generate_all_orientations_with_encodings(shapes, BoardSymmetry((6, 10)))
+        placements = generate_all_placements(shapes, symmetry)
+        self.assertEqual([[j for j in range(len(e)) if e[j]] for e in encodings], placements)
+        self.assertEqual(decode_solution(encodings, [0, 5, 100]), decode_placements(placements, [0, 5, 100]))
+
+    def test_get_polyomino_shapes(self):
+        shapes = get_polyomino_shapes(5, None)
+        self.assertEqual(sorted(s.name for s in get_base_shapes()), sorted(s.name for s in shapes))
+        self.assertEqual(list(range(12)), [s.index for s in shapes])
+        for s in shapes:
+            self.assertEqual(s.num_orientations, len(s.generate_orientations()))
+        self.assertEqual('6-0', get_polyomino_shapes(6, None)[0].name)
+
+    def test_tetromino_matrix(self):
+        # The five free tetrominoes cannot tile a 4x5 board
+        shapes = get_polyomino_shapes(4, None)
+        placements = generate_all_placements(shapes, board_shape=(4, 5), num_shapes=len(shapes))
+        lattice = SparseLattice(placements, generate_col_names(shapes, (4, 5), len(shapes)))
+        self.assertEqual([], list(iter_exact_cover_solutions(lattice)))
+
+    def test_region_filter(self):
+        keep = region_filter((3, 20))
+        cell_columns = _cell_columns((3, 20), 12)
+        # A V in the corner leaves one region of 55 cells, one column in it cuts off the
+        # 3 cells on its left
+        corner = [10] + [int(cell_columns[r, c]) for r, c in [(0, 0), (1, 0), (2, 0), (2, 1), (2, 2)]]
+        self.assertTrue(keep(corner, set()))
+        cut = [10] + [int(cell_columns[r, c]) for r, c in [(0, 1), (1, 1), (2, 1), (2, 2), (2, 3)]]
+        self.assertFalse(keep(cut, set()))
+        # Once the cells on the left are covered the same placement is fine
+        self.assertTrue(keep(cut, set([int(cell_columns[r, 0]) for r in range(3)] + [int(cell_columns[0, 2]), int(cell_columns[1, 2])])))
+
+    def test_region_pruner(self):
+        board_shape = (3, 20)
+        placements = generate_all_placements(get_base_shapes(), board_shape=board_shape)
+        lattice = SparseLattice(placements, generate_col_names(get_base_shapes(), board_shape))
+        prune = region_pruner(lattice, board_shape)
+        self.assertFalse(prune(lattice))
+        cell_columns = _cell_columns(board_shape, 12)
+        # A V one column in cuts off the 3 cells on its left
+        cut = set([10] + [int(cell_columns[r, c]) for r, c in [(0, 1), (1, 1), (2, 1), (2, 2), (2, 3)]])
+        i = [set(p) for p in placements].index(cut)
+        lattice.select(i)
+        self.assertTrue(prune(lattice))
+        lattice.unselect(i)
+
+        stats = SearchStats()
+        pruned = sorted(decode_placements(placements, s, 12, board_shape) for s in iter_exact_cover_solutions(lattice, stats=stats, prune=prune))
+        expected = sorted(decode_placements(placements, s, 12, board_shape) for s in iter_exact_cover_solutions(lattice))
+        self.assertEqual(8, len(pruned))
+        self.assertEqual(expected, pruned)
+        self.assertGreater(stats.pruned, 0)
+
+    def test_scan_order(self):
+        self.assertEqual([2, 5, 3, 6, 4, 7, 0, 1], scan_order((2, 3), 2))
+        self.assertEqual([2, 3, 4, 5, 6, 0, 1], scan_order(board_with_holes((3, 2), [(1, 0)]), 2))
+
+    def test_bitset_backend(self):
+        encodings = self._small_board_encodings(['L', 'P', 'W', 'Y'], (4, 5))
+        rows = [[j for j in range(len(e)) if e[j]] for e in encodings]
+        col_names = list(range(len(encodings[0])))
+        order = scan_order((4, 5), 4)
+        self.assertEqual(20, count_cover_solutions(build_cover(rows, col_names, 'bitset', order)))
+        self.assertEqual(20, count_cover_solutions(build_cover(rows, col_names, 'numpy', order)))
+
     def test_exact_cover(self):
         base_shapes = get_base_shapes()
         col_names = []
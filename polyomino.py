@@ -0,0 +1,145 @@
+import unittest
+import json
+import os
+import shutil
+import tempfile
+
+# The 8 rotations and reflections of the plane, acting on (row, col) coordinates
+DIHEDRAL_TRANSFORMS = [
+    lambda r, c: (r, c),
+    lambda r, c: (c, -r),
+    lambda r, c: (-r, -c),
+    lambda r, c: (-c, r),
+    lambda r, c: (r, -c),
+    lambda r, c: (-r, c),
+    lambda r, c: (c, r),
+    lambda r, c: (-c, -r),
+]
+
+# Where the enumerated polyominoes are kept between runs
+CACHE_DIR = os.environ.get('NMINO_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'n-mino'))
+
+# n -> the free n-ominoes already enumerated in this process
+_free_polyominoes = {1: [((0, 0),)]}
+
+def normalize(cells):
+    """ Translates cells so their smallest row and column are 0 and returns them sorted, as a tuple """
+    min_r = min(r for r, c in cells)
+    min_c = min(c for r, c in cells)
+    return tuple(sorted([(r - min_r, c - min_c) for r, c in cells]))
+
+def canonical_form(cells):
+    """ Returns the smallest normalized image of cells under the 8 rotations and reflections """
+    return min(normalize([t(r, c) for r, c in cells]) for t in DIHEDRAL_TRANSFORMS)
+
+def cells_to_shape(cells):
+    """ Returns the 0/1 matrix of a set of cells """
+    cells = normalize(cells)
+    rows = max(r for r, c in cells) + 1
+    cols = max(c for r, c in cells) + 1
+    shape = [[0] * cols for r in range(rows)]
+    for r, c in cells:
+        shape[r][c] = 1
+    return shape
+
+def shape_to_cells(shape):
+    """ Returns the normalized cells of a 0/1 matrix """
+    return normalize([(r, c) for r in range(len(shape)) for c in range(len(shape[r])) if shape[r][c]])
+
+def _grow(polyominoes):
+    # Every free (n+1)-omino is some free n-omino plus one neighbouring cell, because it
+    # always has a cell whose removal leaves it connected
+    grown = set()
+    for cells in polyominoes:
+        occupied = set(cells)
+        for r, c in cells:
+            for cell in ((r - 1, c), (r + 1, c), (r, c - 1), (r, c + 1)):
+                if cell not in occupied:
+                    grown.add(canonical_form(cells + (cell,)))
+    return sorted(grown)
+
+def _cache_path(n, cache_dir):
+    return os.path.join(cache_dir, 'polyominoes-%d.json' % n)
+
+def free_polyominoes(n, cache_dir=CACHE_DIR):
+    """
+    Returns the free n-ominoes (distinct up to rotation and reflection) as sorted tuples of
+    cells in canonical form, in a fixed order. They are built up from the (n-1)-ominoes and
+    every order is kept in memory and, unless cache_dir is None, as JSON in cache_dir.
+    :ivar n: the number of cells
+    :ivar cache_dir: the directory of the on-disk cache
+    """
+    if n < 1:
+        raise ValueError("A polyomino needs at least one cell, got %r" % n)
+    if n in _free_polyominoes:
+        return _free_polyominoes[n]
+
+    if cache_dir is not None and os.path.exists(_cache_path(n, cache_dir)):
+        with open(_cache_path(n, cache_dir)) as f:
+            polyominoes = [tuple([tuple(cell) for cell in cells]) for cells in json.load(f)]
+    else:
+        polyominoes = _grow(free_polyominoes(n - 1, cache_dir))
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            # Write then rename so a concurrent run never reads half a file
+            fd, tmp = tempfile.mkstemp(dir=cache_dir)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(polyominoes, f)
+            os.replace(tmp, _cache_path(n, cache_dir))
+    _free_polyominoes[n] = polyominoes
+    return polyominoes
+
+def polyomino_name(n, index):
+    """ The name of the index-th free n-omino, e.g. '6-12' """
+    return '%d-%d' % (n, index)
+
+class Polyomino_UnitTest(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+        for n in list(_free_polyominoes):
+            if n > 1:
+                del _free_polyominoes[n]
+
+    def test_counts(self):
+        expected = [1, 1, 2, 5, 12, 35, 108, 369]
+        for n in range(1, len(expected) + 1):
+            self.assertEqual(expected[n - 1], len(free_polyominoes(n, self.cache_dir)))
+
+    def test_canonical_form(self):
+        # Every orientation of the L tetromino has the same canonical form
+        l = [(0, 0), (1, 0), (2, 0), (2, 1)]
+        for t in DIHEDRAL_TRANSFORMS:
+            self.assertEqual(canonical_form(l), canonical_form([t(r, c) for r, c in l]))
+        self.assertNotEqual(canonical_form(l), canonical_form([(0, 0), (1, 0), (2, 0), (3, 0)]))
+
+    def test_shape_cells(self):
+        shape = [[0, 1, 1],
+                 [1, 1, 0],
+                 [0, 1, 0]]
+        self.assertEqual(((0, 1), (0, 2), (1, 0), (1, 1), (2, 1)), shape_to_cells(shape))
+        self.assertEqual(shape, cells_to_shape(shape_to_cells(shape)))
+
+    def test_disk_cache(self):
+        pentominoes = free_polyominoes(5, self.cache_dir)
+        self.assertTrue(os.path.exists(_cache_path(5, self.cache_dir)))
+        del _free_polyominoes[5]
+        del _free_polyominoes[4]
+        self.assertEqual(pentominoes, free_polyominoes(5, self.cache_dir))
+        self.assertNotIn(4, _free_polyominoes)
+
+    def test_no_cache(self):
+        self.assertEqual(12, len(free_polyominoes(5, None)))
+        self.assertEqual([], os.listdir(self.cache_dir))
+
+    def test_bad_order(self):
+        with self.assertRaises(ValueError):
+            free_polyominoes(0)
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+        main()
@@ -0,0 +1,221 @@
+import unittest
+import itertools
+import random
+from lattice import SparseLattice, RowArrays
+from exact_cover import iter_exact_cover_solutions, count_exact_cover_solutions
+from pentomino import get_base_shapes, generate_all_placements, generate_col_names, region_filter, decode_placements
+
+class Reduction():
+    """
+    The result of reduce_matrix: a smaller exact cover problem with the same solutions.
+    Every solution of the reduced problem plus the forced rows is a solution of the original
+    one, see expand.
+    :ivar rows: the rows left, each one a list of indices into cols (or a RowArrays)
+    :ivar cols: the original index of every column left
+    :ivar row_ids: the original index of every row left
+    :ivar secondary: the indices (into cols) of the secondary columns left
+    :ivar forced: the original indices of the rows every solution holds
+    :ivar infeasible: True when the reduction found that there is no solution at all
+    :ivar removed: how many rows every rule removed, by rule
+    """
+    def __init__(self, rows, cols, row_ids, secondary, forced, infeasible, removed, num_rows, num_cols):
+        self.rows = rows
+        self.cols = cols
+        self.row_ids = row_ids
+        self.secondary = secondary
+        self.forced = forced
+        self.infeasible = infeasible
+        self.removed = removed
+        self.num_rows = num_rows
+        self.num_cols = num_cols
+
+    def expand(self, solution):
+        """ Turns a solution of the reduced problem (row indices) into original row indices """
+        return tuple(self.forced) + tuple([self.row_ids[r] for r in solution])
+
+    def lattice(self, col_names):
+        """ Builds the SparseLattice of the reduced problem, col_names being the original column names """
+        names = [col_names[c] for c in self.cols]
+        if isinstance(self.rows, RowArrays):
+            return SparseLattice.from_arrays(self.rows.indptr, self.rows.indices, names, self.secondary)
+        return SparseLattice(self.rows, names, self.secondary)
+
+    def summary(self):
+        return '%d -> %d rows, %d -> %d columns, %d forced, removed: %s' % (
+            self.num_rows, len(self.rows), self.num_cols, len(self.cols), len(self.forced),
+            ', '.join('%s %d' % (rule, self.removed[rule]) for rule in sorted(self.removed)))
+
+def reduce_matrix(rows, num_cols, secondary=(), row_filter=None):
+    """
+    Shrinks an exact cover problem before it is built, repeating until nothing changes:
+    - a primary column with a single row forces that row, which takes out its columns and
+      every row that shares one with it
+    - if every row of a primary column c also has column d, the rows with d but not c are
+      dominated: taking one would leave c with nothing to cover it
+    - row_filter(row, covered) may drop rows given the columns the forced rows cover
+    A primary column left with no row at all makes the problem infeasible.
+    :ivar rows: the rows of the matrix, each one a list of the column indices that hold a one
+    :ivar num_cols: the number of columns
+    :ivar secondary: the indices of the columns that may be covered at most once
+    :ivar row_filter: a function returning False for the rows to drop, see region_filter in pentomino.py
+    """
+    secondary = set(secondary)
+    row_sets = [frozenset(r) for r in rows]
+    col_rows = [set() for c in range(num_cols)]
+    for i in range(len(rows)):
+        for c in rows[i]:
+            col_rows[c].add(i)
+    live = set(range(len(rows)))
+    live_cols = set(range(num_cols))
+    covered = set()
+    forced = []
+    removed = {'forced': 0, 'dominated': 0, 'filtered': 0}
+    infeasible = False
+
+    def drop(i, rule):
+        live.discard(i)
+        for c in row_sets[i]:
+            col_rows[c].discard(i)
+        removed[rule] += 1
+
+    check_filter = row_filter is not None
+    changed = True
+    while changed and not infeasible:
+        changed = False
+        if check_filter:
+            for i in sorted(live):
+                if not row_filter(rows[i], covered):
+                    drop(i, 'filtered')
+                    changed = True
+            check_filter = False
+
+        for c in sorted(live_cols):
+            if c in secondary or c not in live_cols:
+                continue
+            if not col_rows[c]:
+                infeasible = True
+                break
+            if len(col_rows[c]) == 1:
+                i = next(iter(col_rows[c]))
+                forced.append(i)
+                live.discard(i)
+                for d in row_sets[i]:
+                    for j in list(col_rows[d]):
+                        if j != i:
+                            drop(j, 'forced')
+                    col_rows[d].clear()
+                    live_cols.discard(d)
+                    covered.add(d)
+                check_filter = row_filter is not None
+                changed = True
+        if infeasible or changed:
+            continue
+
+        for c in sorted(live_cols):
+            if c in secondary or not col_rows[c]:
+                continue
+            common = frozenset.intersection(*[row_sets[i] for i in col_rows[c]])
+            for d in common:
+                if d != c:
+                    for j in list(col_rows[d] - col_rows[c]):
+                        drop(j, 'dominated')
+                        changed = True
+
+    cols = sorted(live_cols)
+    index = {}
+    for k in range(len(cols)):
+        index[cols[k]] = k
+    row_ids = sorted(live)
+    reduced = [[index[c] for c in rows[i]] for i in row_ids]
+    return Reduction(reduced, cols, row_ids, [index[c] for c in cols if c in secondary], forced,
+                     infeasible, removed, len(rows), num_cols)
+
+def _brute_force_count(rows, num_cols, secondary=()):
+    # The search never takes a row without a primary column
+    rows = [r for r in rows if set(r) - set(secondary)]
+    count = 0
+    for k in range(len(rows) + 1):
+        for chosen in itertools.combinations(rows, k):
+            cols = [c for r in chosen for c in r]
+            if len(cols) == len(set(cols)) and set(range(num_cols)) - set(secondary) <= set(cols):
+                count += 1
+    return count
+
+class Preprocess_UnitTest(unittest.TestCase):
+    def test_forced(self):
+        # Only row 0 covers a, which rules out rows 1 and 3, which leaves row 2 for c
+        rows = [[0, 1], [1, 2], [2], [1]]
+        reduction = reduce_matrix(rows, 3)
+        self.assertFalse(reduction.infeasible)
+        self.assertEqual([], reduction.rows)
+        self.assertEqual([], reduction.cols)
+        self.assertEqual([0, 2], reduction.forced)
+        self.assertEqual([(0, 2)], [reduction.expand(s) for s in iter_exact_cover_solutions(reduction.lattice('abc'))])
+
+    def test_infeasible(self):
+        self.assertTrue(reduce_matrix([[0], [1]], 3).infeasible)
+        # Row 0 is forced by a and rules out row 1, the only one left for c
+        self.assertTrue(reduce_matrix([[0, 1], [1, 2]], 3).infeasible)
+
+    def test_dominated(self):
+        # Every row of a has b, so row 2 (b without a) can never be chosen
+        rows = [[0, 1], [0, 1, 2], [1, 3], [2], [3], [2, 3]]
+        reduction = reduce_matrix(rows, 4)
+        self.assertEqual(1, reduction.removed['dominated'])
+        self.assertNotIn(2, reduction.row_ids)
+        solutions = sorted(sorted(reduction.expand(s)) for s in iter_exact_cover_solutions(reduction.lattice('abcd')))
+        self.assertEqual([[0, 3, 4], [0, 5], [1, 4]], solutions)
+
+    def test_secondary(self):
+        # Column c is secondary, so its single row is not forced
+        rows = [[0, 2], [1], [0], [1, 2]]
+        reduction = reduce_matrix(rows, 3, secondary=[2])
+        self.assertEqual(0, len(reduction.forced))
+        self.assertEqual(3, count_exact_cover_solutions(reduction.lattice('abc')))
+
+    def test_row_filter(self):
+        rows = [[0], [0, 1], [1]]
+        reduction = reduce_matrix(rows, 2, row_filter=lambda row, covered: len(row) == 1)
+        self.assertEqual(1, reduction.removed['filtered'])
+        self.assertEqual([0, 2], sorted(reduction.forced))
+
+    def test_random(self):
+        rng = random.Random(3)
+        for trial in range(60):
+            num_cols = rng.randint(2, 6)
+            rows = [sorted(rng.sample(range(num_cols), rng.randint(1, min(3, num_cols)))) for r in range(rng.randint(2, 9))]
+            secondary = [c for c in range(num_cols) if rng.random() < 0.2]
+            reduction = reduce_matrix(rows, num_cols, secondary)
+            expected = _brute_force_count(rows, num_cols, secondary)
+            if reduction.infeasible:
+                self.assertEqual(0, expected)
+                continue
+            solutions = [reduction.expand(s) for s in iter_exact_cover_solutions(reduction.lattice(list(range(num_cols))))]
+            self.assertEqual(expected, len(solutions))
+            for s in solutions:
+                cols = [c for r in s for c in rows[r]]
+                self.assertEqual(len(cols), len(set(cols)))
+
+    def test_pentomino(self):
+        board_shape = (3, 20)
+        shapes = get_base_shapes()
+        placements = generate_all_placements(shapes, board_shape=board_shape)
+        col_names = generate_col_names(shapes, board_shape)
+        reduction = reduce_matrix(placements, len(col_names), row_filter=region_filter(board_shape))
+        self.assertLess(len(reduction.rows), len(placements) * 2 / 3)
+        boards = []
+        for s in iter_exact_cover_solutions(reduction.lattice(col_names)):
+            boards.append(decode_placements(placements, reduction.expand(s), 12, board_shape))
+        expected = [decode_placements(placements, s, 12, board_shape) for s in iter_exact_cover_solutions(SparseLattice(placements, col_names))]
+        self.assertEqual(8, len(boards))
+        self.assertEqual(sorted(expected), sorted(boards))
+
+    def test_summary(self):
+        summary = reduce_matrix([[0, 1], [1, 2], [2], [1]], 3).summary()
+        self.assertEqual('4 -> 0 rows, 3 -> 0 columns, 2 forced, removed: dominated 0, filtered 0, forced 2', summary)
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+        main()
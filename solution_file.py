@@ -0,0 +1,235 @@
+import unittest
+import os
+import shutil
+import struct
+import tempfile
+import numpy as np
+from lattice import SparseLattice
+from exact_cover import iter_exact_cover_solutions
+from pentomino import board_mask, board_cells, decode_placements, generate_all_placements, get_base_shapes
+
+# A solution file is a fixed header, the board mask (one byte per cell), the placement table
+# (one fixed-width row of column indices per row of the matrix, the shape column first) and
+# the solutions, one fixed-width row of row ids each. Every integer is little-endian
+MAGIC = b'NMINOSOL'
+VERSION = 2
+# magic, version, width, count, row id size, num_shapes, board rows, board cols, matrix rows, placement width,
+# column index size
+HEADER = struct.Struct('<8sIIQIIIIIII')
+# Where the solution count sits in the header, so the writer can fill it in when it is closed
+_COUNT_OFFSET = 16
+
+def _index_dtype(limit):
+    # The narrowest of the two widths that holds every index below limit
+    return np.dtype('<u2') if limit <= 2 ** 16 else np.dtype('<u4')
+
+class SolutionWriter():
+    """
+    Streams solutions to a binary file as fixed-width rows of row ids. The ids take two bytes
+    each when the matrix has fewer than 65536 rows, so a pentomino tiling takes 24 bytes.
+    With placements and a board the file can decode its solutions into boards on its own.
+    :ivar path: the file to write
+    :ivar width: the number of rows in every solution
+    :ivar num_rows: the number of rows of the matrix
+    :ivar placements: the sparse rows of the matrix (shape column first), or None
+    :ivar num_shapes: the number of shape columns in front of the cell columns
+    :ivar board_shape: the board as (rows, cols) or as a mask, or None
+    :ivar buffer_size: how many solutions to keep before writing them out
+    """
+    def __init__(self, path, width, num_rows, placements=None, num_shapes=12, board_shape=None, buffer_size=4096):
+        self.path = path
+        self.width = width
+        self.count = 0
+        self.dtype = _index_dtype(num_rows)
+        self.buffer_size = buffer_size
+        self._buffer = []
+
+        mask = np.zeros((0, 0), dtype=np.uint8)
+        if board_shape is not None:
+            mask = np.array(board_mask(board_shape), dtype=np.uint8)
+        # The table holds column indices, so it is as wide as the largest of them needs
+        table_dtype = np.dtype('<u2')
+        table = np.zeros((0, 0), dtype=table_dtype)
+        if placements is not None:
+            if len(set(len(p) for p in placements)) > 1:
+                raise ValueError("Every placement must cover the same number of columns")
+            table_dtype = _index_dtype(max([c + 1 for p in placements for c in p] + [0]))
+            table = np.array(placements, dtype=table_dtype).reshape(len(placements), -1)
+        else:
+            num_shapes = 0
+
+        self._file = open(path, 'wb')
+        self._file.write(HEADER.pack(MAGIC, VERSION, width, 0, self.dtype.itemsize, num_shapes,
+                                     mask.shape[0], mask.shape[1], len(table), table.shape[1], table_dtype.itemsize))
+        self._file.write(mask.tobytes())
+        self._file.write(table.tobytes())
+
+    def write(self, solution):
+        if len(solution) != self.width:
+            raise ValueError("Expected a solution of %d rows, got %d" % (self.width, len(solution)))
+        self._buffer.append(solution)
+        if len(self._buffer) >= self.buffer_size:
+            self.flush()
+
+    def write_all(self, solutions):
+        for s in solutions:
+            self.write(s)
+
+    def flush(self):
+        if self._buffer:
+            self._file.write(np.array(self._buffer, dtype=self.dtype).tobytes())
+            self.count += len(self._buffer)
+            self._buffer = []
+
+    def close(self):
+        if self._file.closed:
+            return
+        self.flush()
+        self._file.seek(_COUNT_OFFSET)
+        self._file.write(struct.pack('<Q', self.count))
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class SolutionFile():
+    """
+    A solution file written by SolutionWriter. The solutions are memory-mapped, so opening a
+    file of millions of tilings reads nothing but the header and the placement table.
+    :ivar width: the number of rows in every solution
+    :ivar solutions: a (count, width) array of row ids
+    :ivar placements: the (matrix rows, placement width) array of the placements, or None
+    :ivar num_shapes: the number of shape columns in front of the cell columns
+    :ivar mask: the board mask as a 0/1 array, empty without a board
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            (magic, version, width, count, itemsize, num_shapes, rows, cols, num_rows, placement_width,
+             table_itemsize) = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError("%s is not a solution file" % path)
+            if version != VERSION:
+                raise ValueError("%s has version %d, expected %d" % (path, version, VERSION))
+            self.mask = np.frombuffer(f.read(rows * cols), dtype=np.uint8).reshape(rows, cols)
+        self.width = width
+        self.num_shapes = num_shapes
+        dtype = np.dtype('<u%d' % itemsize)
+        offset = HEADER.size + rows * cols
+        self.placements = None
+        if num_rows:
+            self.placements = np.memmap(path, dtype=np.dtype('<u%d' % table_itemsize), mode='r', offset=offset,
+                                        shape=(num_rows, placement_width))
+        offset += num_rows * placement_width * table_itemsize
+        if count:
+            self.solutions = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(count, width))
+        else:
+            self.solutions = np.zeros((0, width), dtype=dtype)
+
+    def __len__(self):
+        return len(self.solutions)
+
+    def __getitem__(self, i):
+        return tuple(self.solutions[i].tolist())
+
+    def decode(self, i):
+        """ The board of the i-th solution, holding the shape index of every cell, -1 where empty or blocked """
+        if self.placements is None or self.mask.size == 0:
+            raise ValueError("The file holds no placements or board to decode with")
+        rows = np.asarray(self.placements[self.solutions[i]], dtype=np.int64)
+        open_cells = np.flatnonzero(self.mask)
+        board = np.full(self.mask.size, -1, dtype=np.int64)
+        board[open_cells[rows[:, 1:] - self.num_shapes]] = rows[:, :1]
+        return board.reshape(self.mask.shape).tolist()
+
+    def boards(self):
+        for i in range(len(self)):
+            yield self.decode(i)
+
+def save_solutions(path, solutions, width, num_rows, placements=None, num_shapes=12, board_shape=None):
+    """ Writes solutions (tuples of row ids, e.g. from iter_exact_cover_solutions) to path and returns how many there were """
+    with SolutionWriter(path, width, num_rows, placements, num_shapes, board_shape) as writer:
+        writer.write_all(solutions)
+    return writer.count
+
+class SolutionFile_UnitTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'solutions.bin')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        solutions = [(0, 1, 2), (3, 4, 5), (70000, 1, 9)]
+        self.assertEqual(3, save_solutions(self.path, solutions, 3, 80000))
+        f = SolutionFile(self.path)
+        self.assertEqual(3, len(f))
+        self.assertEqual(solutions, [f[i] for i in range(len(f))])
+        self.assertEqual(np.dtype('<u4'), f.solutions.dtype)
+        with self.assertRaises(ValueError):
+            f.decode(0)
+
+    def test_compact(self):
+        with SolutionWriter(self.path, 12, 2000, buffer_size=10) as writer:
+            for i in range(1000):
+                writer.write([i % 2000] * 12)
+        self.assertEqual(HEADER.size + 1000 * 12 * 2, os.path.getsize(self.path))
+        f = SolutionFile(self.path)
+        self.assertEqual(1000, len(f))
+        self.assertEqual((999,) * 12, f[999])
+
+    def test_empty(self):
+        save_solutions(self.path, [], 12, 100)
+        self.assertEqual(0, len(SolutionFile(self.path)))
+
+    def test_bad_width(self):
+        with SolutionWriter(self.path, 2, 10) as writer:
+            with self.assertRaises(ValueError):
+                writer.write([1, 2, 3])
+
+    def test_bad_file(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'\0' * HEADER.size)
+        with self.assertRaises(ValueError):
+            SolutionFile(self.path)
+
+    def test_decode(self):
+        board_shape = (3, 20)
+        shapes = get_base_shapes()
+        placements = generate_all_placements(shapes, board_shape=board_shape)
+        lattice = SparseLattice(placements, list(range(12 + 60)))
+        solutions = list(iter_exact_cover_solutions(lattice))
+        save_solutions(self.path, solutions, 12, len(placements), placements, 12, board_shape)
+        f = SolutionFile(self.path)
+        self.assertEqual(8, len(f))
+        for i in range(len(f)):
+            self.assertEqual(decode_placements(placements, solutions[i], 12, board_shape), f.decode(i))
+        self.assertEqual(8, len(list(f.boards())))
+
+    def test_decode_mask(self):
+        board_shape = [[1, 1, 1], [1, 1, 1], [0, 1, 1]]
+        self.assertEqual(8, len(board_cells(board_shape)))
+        # Two straight trominoes on the first two rows, with 2 shape columns in front
+        placements = [[0, 2, 3, 4], [1, 5, 6, 7], [1, 8, 9, 6]]
+        save_solutions(self.path, [(0, 1)], 2, 3, placements, 2, board_shape)
+        f = SolutionFile(self.path)
+        self.assertEqual([[0, 0, 0], [1, 1, 1], [-1, -1, -1]], f.decode(0))
+        self.assertEqual(decode_placements(placements, (0, 1), 2, board_shape), f.decode(0))
+
+    def test_wide_columns(self):
+        # Few rows but column indices past 65535: the table needs four bytes a column, the ids two
+        placements = [[0, 70000], [0, 70001], [0, 70002]]
+        save_solutions(self.path, [(0,)], 1, 3, placements, 1, None)
+        f = SolutionFile(self.path)
+        self.assertEqual(placements, f.placements.tolist())
+        self.assertEqual((np.dtype('<u4'), np.dtype('<u2')), (f.placements.dtype, f.solutions.dtype))
+        self.assertEqual((0,), f[0])
+
+def main():
+    unittest.main()
+
+if __name__ == '__main__':
+        main()